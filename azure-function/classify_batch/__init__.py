@@ -0,0 +1,57 @@
+import logging
+import azure.functions as func
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from classify_tickets import classify_description, classify_description_batch
+from shared_code.batching import batch_items_error, classify_descriptions
+from shared_code.metrics import get_metrics_recorder
+
+# Requests in flight at once, and the most items accepted per call
+BATCH_CONCURRENCY = int(os.environ.get('CLASSIFY_BATCH_CONCURRENCY', '8'))
+BATCH_MAX_ITEMS = int(os.environ.get('CLASSIFY_BATCH_MAX_ITEMS', '1000'))
+
+# One pool per worker process, shared by every invocation
+executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix='classify_batch')
+metrics_recorder = get_metrics_recorder()
+
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request for batch classification.')
+    started = time.monotonic()
+
+    try:
+        # A JSON array of {"id": ..., "description": ...}, e.g. a page of SharePoint list items
+        try:
+            items = req.get_json()
+        except ValueError:
+            items = None
+        error = batch_items_error(items, BATCH_MAX_ITEMS)
+        if error:
+            return func.HttpResponse(error, status_code=400)
+
+        # Optional multi-ticket prompts: up to batch_size tickets per request
+        batch_size = int(req.params.get('batch_size') or os.environ.get('CLASSIFY_BATCH_SIZE', '1'))
+        categories = classify_descriptions(
+            [item.get('description') or '' for item in items],
+            classify_description,
+            classify_description_batch,
+            executor,
+            batch_size,
+        )
+        metrics_recorder.record_invocation('classify_batch', time.monotonic() - started, len(items))
+
+        return func.HttpResponse(
+            json.dumps([{"id": item['id'], "category": category} for item, category in zip(items, categories)]),
+            mimetype="application/json",
+            status_code=200
+        )
+
+    except Exception as e:
+        logging.error(f"Error: {str(e)}")
+        return func.HttpResponse(
+            f"Error processing request: {str(e)}",
+            status_code=500
+        )
@@ -0,0 +1,19 @@
+import logging
+import azure.functions as func
+import json
+import time
+
+from classify_tickets import classify_rows
+from shared_code.jobs import get_job_storage, run_chunk
+from shared_code.metrics import get_metrics_recorder
+
+
+def main(msg: func.QueueMessage) -> None:
+    message = json.loads(msg.get_body().decode('utf-8'))
+
+    # Exceptions leave the message on the queue; after maxDequeueCount it moves to the poison queue,
+    # and the last attempt marks the job failed
+    started = time.monotonic()
+    count = run_chunk(get_job_storage(), message, classify_rows, msg.dequeue_count or 1)
+    get_metrics_recorder().record_invocation('classify_job_chunk', time.monotonic() - started, count)
+    logging.info(f"Classified {count} rows for chunk {message['chunk']} of job {message['job_id']}")
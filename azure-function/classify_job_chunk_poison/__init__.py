@@ -0,0 +1,9 @@
+import azure.functions as func
+import json
+
+from shared_code.jobs import get_job_storage, record_poisoned_chunk
+
+
+def main(msg: func.QueueMessage) -> None:
+    # Fail the chunk's job, so pollers stop waiting for a result that will never come
+    record_poisoned_chunk(get_job_storage(), json.loads(msg.get_body().decode('utf-8')))
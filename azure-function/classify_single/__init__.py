@@ -1,54 +1,52 @@
+import time
+
+# Module load time is logged once per worker; it is the cold-start cost every first request pays
+_load_started = time.perf_counter()
+
 import logging
 import azure.functions as func
 import json
 import os
-import sys
 
-# Add the site-packages to the path if needed
-site_packages_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
-                                  '.python_packages', 'lib', 'site-packages')
-if os.path.exists(site_packages_path) and site_packages_path not in sys.path:
-    sys.path.append(site_packages_path)
+from shared_code.cache import get_classification_cache
+from shared_code.category_codes import (
+    build_code_messages,
+    category_codes_enabled,
+    category_from_reply,
+    code_request_options,
+)
+from shared_code.deployment_pool import get_deployment_pool
+from shared_code.hedging import get_hedged_caller
+from shared_code.local_classifier import get_local_classifier
+from shared_code.metrics import get_metrics_recorder
+from shared_code.prompts import build_messages
+from shared_code.rate_limiter import estimate_message_tokens
+from shared_code.warmup import start_warm_up, warm_up_on_load_enabled
+
+# One deployment pool, cache and metrics recorder per worker process, shared by every invocation
+deployment_pool = get_deployment_pool()
+metrics_recorder = get_metrics_recorder()
+classification_cache = get_classification_cache()
+local_classifier = get_local_classifier()
+# Latency mode: a deadline per ticket and a hedged duplicate for slow requests (CLASSIFY_HEDGE)
+hedged_caller = get_hedged_caller()
+
+# Ask for a category number with a 1-2 token reply instead of the full name
+USE_CATEGORY_CODES = category_codes_enabled()
+
+DEPLOYMENT_ID = os.environ.get("OPENAI_MODEL", "gpt-4o")
+
+# Open a connection while the worker loads, so the first request skips DNS and TLS setup
+if warm_up_on_load_enabled():
+    start_warm_up(deployment_pool.clients())
 
-try:
-    import openai
-except ImportError:
-    logging.error("Failed to import OpenAI. Path: %s", sys.path)
-    raise
+_load_seconds = time.perf_counter() - _load_started
+metrics_recorder.record_startup('classify_single', _load_seconds)
+logging.info(f"classify_single loaded in {_load_seconds * 1000:.0f} ms")
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request for single classification.')
-
-    # Define categories
-    CATEGORIES = [
-        "NHSUK Spam/Marketing",
-        "NHSUK Profiles",
-        "NHSuk Unsupported Service",
-        "NHSUK Content Management Service",
-        "NHSUK Data Services - Directories",
-        "NHSUK Ratings & Reviews",
-        "NHSuk Generic Service",
-        "NHSUK Data Services - GDoS",
-        "NHSUK Personal Medical Query",
-        "NHSUK Find A Service",
-        "NHSUK Syndication",
-        "NHSUK Health Assessment Tools",
-        "NHSUK Internal Tech Request",
-        "NHSUK Find Your NHS Number",
-        "Z_Retired P0 & P5 Web Service",
-        "NBS Q-Flow Acct Mgmt",
-        "NSD Unsupported Service",
-        "NBS Patient Journey",
-        "NHSUK Give Us Feedback Form",
-        "NHSUK Campaigns",
-        "Patient Facing",
-        "Profile manager (GP Reg)",
-        "NHS App National Services",
-        "GeneralPracticeAnnualSelfDeclaration-eDec",
-        "NHSUK Authenticated Website",
-        "Post event message to GP",
-        "CSF – Junk NSD"
-    ]
+    started = time.monotonic()
 
     try:
         # Get the request body
@@ -59,63 +57,60 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 "Please pass a description in the request body",
                 status_code=400
             )
-        
-        # Log environment variables for debugging (hiding API key)
-        logging.info(f"API Version: {os.environ.get('OPENAI_API_VERSION')}")
-        logging.info(f"Endpoint: {os.environ.get('OPENAI_ENDPOINT')}")
-        logging.info(f"Model: {os.environ.get('OPENAI_MODEL')}")
-        
-        # Check for any proxy environment variables
-        proxy_vars = [var for var in os.environ if 'proxy' in var.lower()]
-        if proxy_vars:
-            logging.info(f"Found proxy environment variables: {', '.join(proxy_vars)}")
-        
-        # Disable proxies by setting environment variables
-        os.environ['no_proxy'] = '*'
-        
-        # Log httpx version if available
-        try:
-            import httpx
-            logging.info(f"httpx version: {httpx.__version__}")
-        except ImportError:
-            logging.info("httpx not directly importable")
-        
-        # Configure openai with Azure settings (using the older API style for version 0.28.1)
-        openai.api_type = "azure"
-        openai.api_key = os.environ["OPENAI_API_KEY"]
-        openai.api_version = os.environ["OPENAI_API_VERSION"]
-        openai.api_base = os.environ["OPENAI_ENDPOINT"]
-        
+
         description = req_body['description']
         
+        deployment_id = DEPLOYMENT_ID
+        category = classification_cache.get(description, deployment_id) if classification_cache else None
+        if not category and local_classifier:
+            category = local_classifier.classify(description)
+        if category:
+            metrics_recorder.record_invocation('classify_single', time.monotonic() - started)
+            return func.HttpResponse(
+                json.dumps({"category": category}),
+                mimetype="application/json",
+                status_code=200
+            )
+
         # Classify the ticket
-        prompt = f"""
-Classify the following service desk ticket into one of these categories:
-{', '.join(CATEGORIES)}
+        if USE_CATEGORY_CODES:
+            messages, options = build_code_messages(description), code_request_options(deployment_id)
+        else:
+            messages, options = build_messages(description), {'max_tokens': 20}
 
-Ticket Description:
-{description}
+        def request(deployment):
+            # The pool picks the deployment; its pooled client is reused across invocations in this worker
+            raw = deployment.client.chat.completions.with_raw_response.create(
+                model=deployment.model,
+                messages=messages,
+                temperature=0,
+                **options
+            )
+            return raw.parse(), raw.headers
 
-Category:
-"""
-        try:
-            deployment_id = os.environ.get("OPENAI_MODEL", "gpt-4o")
-            # Using the older API style for version 0.28.1
-            response = openai.ChatCompletion.create(
-                engine=deployment_id,  # In 0.28.1 for Azure, use 'engine' instead of 'model'
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=20,
-                temperature=0
+        async def request_async(deployment):
+            # Hedged attempts run as tasks, so the one that loses can be cancelled
+            raw = await deployment.async_client().chat.completions.with_raw_response.create(
+                model=deployment.model,
+                messages=messages,
+                temperature=0,
+                **options
             )
-            # In 0.28.1, message content is accessed differently
-            category = response.choices[0].message['content'].strip()
+            return raw.parse(), raw.headers
+
+        try:
+            estimated_tokens = estimate_message_tokens(messages, max_tokens=options['max_tokens'])
+            if hedged_caller:
+                response = hedged_caller.call(request_async, estimated_tokens)
+            else:
+                response = deployment_pool.call(request, estimated_tokens)
+            category = category_from_reply(response.choices[0].message.content)
+            if classification_cache:
+                classification_cache.put(description, deployment_id, category)
         except Exception as e:
-            logging.error(f"Error classifying ticket: {str(e)}")
-            logging.error(f"Error type: {type(e).__name__}")
-            # Log additional details if it's a proxies error
-            if "proxies" in str(e).lower():
-                logging.error("This appears to be a proxies-related error. Make sure no proxy settings are conflicting.")
+            logging.error(f"Error classifying ticket: {type(e).__name__}: {str(e)}")
             category = "Classification Error"
+        metrics_recorder.record_invocation('classify_single', time.monotonic() - started)
         
         # Return the category
         return func.HttpResponse(
@@ -1,169 +1,183 @@
+import time
+
+# Module load time is logged once per worker; it is the cold-start cost every first request pays
+_load_started = time.perf_counter()
+
 import logging
 import azure.functions as func
 import io
 import json
-import csv
-import time
+import itertools
 import os
-import sys
 
-# Add the site-packages to the path if needed
-site_packages_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
-                                  '.python_packages', 'lib', 'site-packages')
-if os.path.exists(site_packages_path) and site_packages_path not in sys.path:
-    sys.path.append(site_packages_path)
+from shared_code.batching import classify_in_batch, classify_rows_in_batches
+from shared_code.cache import get_classification_cache
+from shared_code.category_codes import (
+    build_code_messages,
+    category_codes_enabled,
+    category_from_reply,
+    code_request_options,
+)
+from shared_code.deployment_pool import get_deployment_pool
+from shared_code.local_classifier import get_local_classifier
+from shared_code.metrics import get_metrics_recorder
+from shared_code.prompts import build_messages
+from shared_code.rate_limiter import estimate_message_tokens
+from shared_code.readers import TicketStreamReader, compress_body
+from shared_code.streaming import (
+    BlockBlobWriter,
+    ResponseTooLarge,
+    buffer_rows,
+    get_formatter,
+    iter_blob_chunks,
+    iter_bytes,
+    max_response_bytes,
+)
+from shared_code.warmup import start_warm_up, warm_up_on_load_enabled
+
+# One deployment pool, cache and metrics recorder per worker process, shared by every invocation
+deployment_pool = get_deployment_pool()
+metrics_recorder = get_metrics_recorder()
+classification_cache = get_classification_cache()
+local_classifier = get_local_classifier()
 
-try:
-    import openai
-except ImportError:
-    logging.error("Failed to import OpenAI. Path: %s", sys.path)
-    raise
+# Ask for a category number with a 1-2 token reply instead of the full name
+USE_CATEGORY_CODES = category_codes_enabled()
+
+DEPLOYMENT_ID = os.environ.get("OPENAI_MODEL", "gpt-4o")
+
+def classify_description(description, deployment_id=DEPLOYMENT_ID):
+    """Classify one ticket, returning "Classification Error" on failure"""
+    if classification_cache:
+        cached = classification_cache.get(description, deployment_id)
+        if cached:
+            return cached
+    # Obvious tickets are answered in-process without an API call
+    category = local_classifier.classify(description) if local_classifier else None
+    if category:
+        return category
+
+    if USE_CATEGORY_CODES:
+        messages, options = build_code_messages(description), code_request_options(deployment_id)
+        options['temperature'] = 0
+    else:
+        messages, options = build_messages(description), {'temperature': 0.3, 'max_tokens': 500}
+
+    def request(deployment):
+        # The raw response carries the x-ratelimit-remaining-* headers the limiter paces on
+        raw = deployment.client.chat.completions.with_raw_response.create(
+            model=deployment.model,
+            messages=messages,
+            **options
+        )
+        return raw.parse(), raw.headers
+
+    try:
+        response = deployment_pool.call(request, estimate_message_tokens(messages, max_tokens=options['max_tokens']))
+        category = category_from_reply(response.choices[0].message.content)
+        if classification_cache:
+            classification_cache.put(description, deployment_id, category)
+        return category
+    except Exception as e:
+        logging.error(f"Error classifying ticket: {type(e).__name__}: {str(e)}")
+        return "Classification Error"
+
+def classify_description_batch(descriptions, deployment_id=DEPLOYMENT_ID):
+    """Classify several tickets in one request; bad or missing answers are retried one at a time"""
+    return classify_in_batch(descriptions, deployment_id, deployment_pool,
+                             lambda description: classify_description(description, deployment_id),
+                             classification_cache, local_classifier)
+
+def classify_rows(rows, batch_size=1):
+    """Yield each row with its Category set, sending up to batch_size tickets per request"""
+    return classify_rows_in_batches(rows, classify_description, classify_description_batch, batch_size)
+
+# Open a connection while the worker loads, so the first request skips DNS and TLS setup
+if warm_up_on_load_enabled():
+    start_warm_up(deployment_pool.clients())
+
+_load_seconds = time.perf_counter() - _load_started
+metrics_recorder.record_startup('classify_tickets', _load_seconds)
+logging.info(f"classify_tickets loaded in {_load_seconds * 1000:.0f} ms")
 
 def main(req: func.HttpRequest, context: func.Context) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
-
-    # Define categories
-    CATEGORIES = [
-        "NHSUK Spam/Marketing",
-        "NHSUK Profiles",
-        "NHSuk Unsupported Service",
-        "NHSUK Content Management Service",
-        "NHSUK Data Services - Directories",
-        "NHSUK Ratings & Reviews",
-        "NHSuk Generic Service",
-        "NHSUK Data Services - GDoS",
-        "NHSUK Personal Medical Query",
-        "NHSUK Find A Service",
-        "NHSUK Syndication",
-        "NHSUK Health Assessment Tools",
-        "NHSUK Internal Tech Request",
-        "NHSUK Find Your NHS Number",
-        "Z_Retired P0 & P5 Web Service",
-        "NBS Q-Flow Acct Mgmt",
-        "NSD Unsupported Service",
-        "NBS Patient Journey",
-        "NHSUK Give Us Feedback Form",
-        "NHSUK Campaigns",
-        "Patient Facing",
-        "Profile manager (GP Reg)",
-        "NHS App National Services",
-        "GeneralPracticeAnnualSelfDeclaration-eDec",
-        "NHSUK Authenticated Website",
-        "Post event message to GP",
-        "CSF – Junk NSD"
-    ]
+    started = time.monotonic()
 
     try:
-        # Get the CSV file content
-        csv_content = req.get_body().decode('utf-8')
-        
-        # Log environment variables for debugging (hiding API key)
-        logging.info(f"API Version: {os.environ.get('OPENAI_API_VERSION')}")
-        logging.info(f"Endpoint: {os.environ.get('OPENAI_ENDPOINT')}")
-        logging.info(f"Model: {os.environ.get('OPENAI_MODEL')}")
-        
-        # Check for any proxy environment variables
-        proxy_vars = [var for var in os.environ if 'proxy' in var.lower()]
-        if proxy_vars:
-            logging.info(f"Found proxy environment variables: {', '.join(proxy_vars)}")
-        
-        # Disable proxies by setting environment variables
-        os.environ['no_proxy'] = '*'
-        
-        # Log httpx version if available
-        try:
-            import httpx
-            logging.info(f"httpx version: {httpx.__version__}")
-        except ImportError:
-            logging.info("httpx not directly importable")
-        
-        # Create Azure OpenAI client using the new SDK
-        api_key = os.environ["OPENAI_API_KEY"]
-        api_version = os.environ["OPENAI_API_VERSION"]
-        azure_endpoint = os.environ["OPENAI_ENDPOINT"]
-        
-        # Configure openai with Azure settings (using the older API style for version 0.28.1)
+        # Stream the CSV from a blob SAS URL for very large files, otherwise from the body
+        blob_url = req.params.get('blob_url')
+        req_body = None if blob_url else req.get_body()
+        chunks = iter_blob_chunks(blob_url) if blob_url else iter_bytes(req_body)
+
+        output_blob_url = req.params.get('output_blob_url')
+
+        # Parse the export incrementally rather than decoding it all up front; CSV, JSON Lines
+        # or XLSX, gzip or zstd compressed
         try:
-            # Set up the client using global configuration
-            openai.api_type = "azure"
-            openai.api_key = api_key
-            openai.api_version = api_version
-            openai.api_base = azure_endpoint
-            
-            # Test the client initialization
-            logging.info("Testing OpenAI client initialization...")
-        except Exception as e:
-            logging.error(f"Error initializing OpenAI client: {str(e)}")
-            raise
-        
-        # Process the CSV
-        input_stream = io.StringIO(csv_content)
-        output_stream = io.StringIO()
-        
-        reader = csv.DictReader(input_stream)
-        fieldnames = reader.fieldnames + ['Category']
-        writer = csv.DictWriter(output_stream, fieldnames=fieldnames)
-        writer.writeheader()
+            reader = TicketStreamReader(None if blob_url else req.headers.get('Content-Encoding'))
+        except ValueError as e:
+            return func.HttpResponse(str(e), status_code=415)
+        rows = reader.iter_rows(chunks)
+        first_row = next(rows, None)
+        if not reader.fieldnames or 'Description' not in reader.fieldnames:
+            return func.HttpResponse(
+                "The export must contain a 'Description' column",
+                status_code=400
+            )
+        if first_row is not None:
+            rows = itertools.chain([first_row], rows)
+
+        # CSV by default, or NDJSON with ?format=ndjson
+        formatter = get_formatter(req.params.get('format'), reader.fieldnames + ['Category'])
+
+        # With ?output_blob_url= results go to the blob block by block, keeping memory flat
+        output = BlockBlobWriter(output_blob_url, formatter.media_type) if output_blob_url else io.StringIO()
+        output.write(formatter.header())
         
         # Get optional limit parameter
         limit = req.params.get('limit')
         limit = int(limit) if limit else None
         
+        rows = itertools.islice(rows, limit) if limit else rows
+
+        # Without ?output_blob_url= the whole result is built in memory; larger exports are sent elsewhere
+        # before any row is classified
+        max_bytes = max_response_bytes()
+        if not output_blob_url and max_bytes:
+            try:
+                rows = buffer_rows(rows, max_bytes)
+            except ResponseTooLarge as e:
+                return func.HttpResponse(str(e), status_code=413)
+
+        # Optional multi-ticket prompts: up to batch_size tickets per request
+        batch_size = int(req.params.get('batch_size') or os.environ.get('CLASSIFY_BATCH_SIZE', '1'))
+
         count = 0
-        for row in reader:
-            # Check if we've reached the limit
-            if limit and count >= limit:
-                break
-                
-            description = row.get('Description', '')
-            if description:
-                # Classify the ticket
-                system_message = "You are a helpful assistant that classifies service desk tickets into predefined categories."
-                ticket_prompt = f"""
-Classify the following service desk ticket into one of these categories:
-{', '.join(CATEGORIES)}
-
-Ticket Description:
-{description}
-
-Category:
-"""
-                try:
-                    deployment_id = os.environ.get("OPENAI_MODEL", "gpt-4o")
-                    # Using the older API style for version 0.28.1
-                    response = openai.ChatCompletion.create(
-                        engine=deployment_id,  # In 0.28.1 for Azure, use 'engine' instead of 'model'
-                        messages=[
-                            {"role": "system", "content": system_message},
-                            {"role": "user", "content": ticket_prompt}
-                        ],
-                        temperature=0.3,
-                        max_tokens=500,
-                    )
-                    # In 0.28.1, message content is accessed differently
-                    category = response.choices[0].message['content'].strip()
-                except Exception as e:
-                    logging.error(f"Error classifying ticket: {str(e)}")
-                    logging.error(f"Error type: {type(e).__name__}")
-                    # Log additional details if it's a proxies error
-                    if "proxies" in str(e).lower():
-                        logging.error("This appears to be a proxies-related error. Make sure no proxy settings are conflicting.")
-                    category = "Classification Error"
-                
-                # Add a small delay to avoid rate limits
-                time.sleep(0.5)
-            else:
-                category = "No Description"
-                
-            row['Category'] = category
-            writer.writerow(row)
+        for row in classify_rows(rows, batch_size):
+            output.write(formatter.row(row))
             count += 1
-            
+        elapsed = time.monotonic() - started
+        metrics_recorder.record_invocation('classify_tickets', elapsed, count)
+        logging.info(f"Classified {count} tickets in {elapsed:.1f}s; totals for this worker: "
+                     f"{json.dumps(metrics_recorder.summary())}")
+
+        if output_blob_url:
+            output.close()
+            return func.HttpResponse(
+                json.dumps({"rows": count, "output_blob": output_blob_url.split('?')[0]}),
+                mimetype="application/json",
+                status_code=200
+            )
+
         # Return the processed CSV
+        # Compressed when the caller accepts gzip
+        body, content_encoding = compress_body(output.getvalue(), req.headers.get('Accept-Encoding'))
         return func.HttpResponse(
-            output_stream.getvalue(),
-            mimetype="text/csv",
-            status_code=200
+            body,
+            mimetype=formatter.media_type,
+            status_code=200,
+            headers={'Content-Encoding': content_encoding} if content_encoding else None
         )
             
     except Exception as e:
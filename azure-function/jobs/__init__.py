@@ -0,0 +1,137 @@
+import logging
+import azure.functions as func
+import itertools
+import json
+import os
+
+from classify_tickets import classify_rows
+from shared_code.jobs import (
+    DEFAULT_CHUNK_ROWS,
+    InMemoryJobStorage,
+    get_job_storage,
+    iter_job_result,
+    job_status,
+    start_local_workers,
+    submit_job,
+)
+from shared_code.readers import TicketStreamReader, compress_body
+from shared_code.streaming import (
+    BlockBlobWriter,
+    ResponseTooLarge,
+    iter_blob_chunks,
+    iter_bytes,
+    join_limited,
+    max_response_bytes,
+)
+
+# Seconds a Logic App waits before polling a running job again
+RETRY_AFTER_SECONDS = "10"
+
+
+def _json_response(body, status_code=200, headers=None):
+    return func.HttpResponse(json.dumps(body), mimetype="application/json", status_code=status_code,
+                             headers=headers)
+
+
+def _job_url(req, job_id, action=None):
+    """Absolute URL of a job resource, keeping the function key so Logic Apps can poll it"""
+    base = req.url.split('?')[0].rstrip('/')
+    base = base[:base.index('/jobs') + len('/jobs')]
+    url = f"{base}/{job_id}" + (f"/{action}" if action else "")
+    code = req.params.get('code')
+    return f"{url}?code={code}" if code else url
+
+
+def submit(req, storage):
+    # Same inputs as classify_tickets: the request body or a blob SAS URL
+    blob_url = req.params.get('blob_url')
+    chunks = iter_blob_chunks(blob_url) if blob_url else iter_bytes(req.get_body())
+    try:
+        reader = TicketStreamReader(None if blob_url else req.headers.get('Content-Encoding'))
+    except ValueError as e:
+        return func.HttpResponse(str(e), status_code=415)
+    rows = reader.iter_rows(chunks)
+    first_row = next(rows, None)
+    if not reader.fieldnames or 'Description' not in reader.fieldnames:
+        return func.HttpResponse("The export must contain a 'Description' column", status_code=400)
+    if first_row is not None:
+        rows = itertools.chain([first_row], rows)
+
+    limit = req.params.get('limit')
+    rows = itertools.islice(rows, int(limit)) if limit else rows
+    chunk_rows = int(req.params.get('chunk_size') or os.environ.get('CLASSIFY_JOB_CHUNK_ROWS', DEFAULT_CHUNK_ROWS))
+    batch_size = int(req.params.get('batch_size') or os.environ.get('CLASSIFY_BATCH_SIZE', '1'))
+    job = submit_job(storage, rows, reader.fieldnames, chunk_rows, batch_size)
+    logging.info(f"Submitted job {job['job_id']}: {job['rows']} rows in {job['chunks']} chunks")
+
+    if isinstance(storage, InMemoryJobStorage):
+        # No queue trigger fires for the in-memory stand-in, so work through the chunks here
+        start_local_workers(storage, classify_rows)
+
+    result_url = _job_url(req, job['job_id'], 'result')
+    # 202 + Location lets a Logic App HTTP action poll until the result is ready
+    return _json_response(
+        {
+            'job_id': job['job_id'],
+            'status': "queued",
+            'rows': job['rows'],
+            'chunks': job['chunks'],
+            'status_url': _job_url(req, job['job_id']),
+            'result_url': result_url,
+        },
+        status_code=202,
+        headers={'Location': result_url, 'Retry-After': RETRY_AFTER_SECONDS},
+    )
+
+
+def result(req, storage, job):
+    if job['status'] == "failed":
+        return _json_response(job, status_code=500)
+    if job['status'] != "completed":
+        return _json_response(
+            job, status_code=202, headers={'Location': req.url, 'Retry-After': RETRY_AFTER_SECONDS}
+        )
+
+    # With ?output_blob_url= the merged CSV goes to a blob instead of the response
+    output_blob_url = req.params.get('output_blob_url')
+    if output_blob_url:
+        writer = BlockBlobWriter(output_blob_url, "text/csv")
+        for text in iter_job_result(storage, job):
+            writer.write(text)
+        writer.close()
+        return _json_response({'rows': job['rows'], 'output_blob': output_blob_url.split('?')[0]})
+
+    # The v1 model can't stream a response, so the result is built in memory, up to CLASSIFY_MAX_RESPONSE_BYTES
+    max_bytes = max_response_bytes()
+    try:
+        text = join_limited(iter_job_result(storage, job), max_bytes)
+    except ResponseTooLarge:
+        return func.HttpResponse(
+            f"The job result is more than the {max_bytes} bytes returned in one response "
+            f"(CLASSIFY_MAX_RESPONSE_BYTES). Pass output_blob_url",
+            status_code=413
+        )
+    body, content_encoding = compress_body(text, req.headers.get('Accept-Encoding'))
+    return func.HttpResponse(body, mimetype="text/csv", status_code=200,
+                             headers={'Content-Encoding': content_encoding} if content_encoding else None)
+
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    job_id = req.route_params.get('job_id')
+    action = req.route_params.get('action')
+    try:
+        storage = get_job_storage()
+        if req.method == "POST" and not job_id:
+            return submit(req, storage)
+        if req.method != "GET" or not job_id or action not in (None, "result"):
+            return func.HttpResponse("Not found", status_code=404)
+
+        job = job_status(storage, job_id)
+        if job is None:
+            return func.HttpResponse(f"Job {job_id} not found", status_code=404)
+        if action == "result":
+            return result(req, storage, job)
+        return _json_response(job)
+    except Exception as e:
+        logging.error(f"Error: {str(e)}")
+        return func.HttpResponse(f"Error processing request: {str(e)}", status_code=500)
@@ -0,0 +1,2 @@
+# Helpers shared by the Function handlers, azure_function_app.py and the
+# classify_tickets.py batch CLI.
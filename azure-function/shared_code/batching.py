@@ -0,0 +1,193 @@
+import json
+import logging
+
+from shared_code.categories import CATEGORIES, canonical_category
+from shared_code.preprocess import prepare_description
+from shared_code.prompts import SYSTEM_MESSAGE
+from shared_code.rate_limiter import estimate_tokens
+
+DEFAULT_MAX_BATCH_SIZE = 20
+DEFAULT_BATCH_TOKEN_BUDGET = 6000
+
+# Completion tokens allowed per ticket in a batched answer
+COMPLETION_TOKENS_PER_TICKET = 20
+
+BATCH_INSTRUCTIONS = f"""Classify each of the following service desk tickets into exactly one of these categories:
+{json.dumps(CATEGORIES, ensure_ascii=False)}
+
+Reply with a JSON object that maps every ticket id to its category, for example {{"1": "{CATEGORIES[0]}"}}.
+Use the category names exactly as written above.
+
+Tickets:
+"""
+
+_BATCH_OVERHEAD_TOKENS = estimate_tokens(SYSTEM_MESSAGE + BATCH_INSTRUCTIONS)
+
+
+def build_batch_messages(tickets):
+    """Chat messages asking for a JSON {id: category} answer for (id, description) pairs"""
+    payload = json.dumps(
+        [{"id": str(ticket_id), "description": prepare_description(description)}
+         for ticket_id, description in tickets],
+        ensure_ascii=False,
+        indent=0
+    )
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": BATCH_INSTRUCTIONS + payload},
+    ]
+
+
+def batch_max_tokens(ticket_count):
+    return 10 + ticket_count * COMPLETION_TOKENS_PER_TICKET
+
+
+def estimate_batch_tokens(tickets):
+    prompt_tokens = _BATCH_OVERHEAD_TOKENS + sum(estimate_tokens(description) + 8 for _, description in tickets)
+    return prompt_tokens + batch_max_tokens(len(tickets))
+
+
+def parse_batch_response(content, ticket_ids):
+    """Return {id: category} for the well-formed entries of a batched answer.
+
+    Ids that are missing, unknown or mapped to something that is not a
+    category are left out so the caller can retry them one at a time.
+    """
+    try:
+        answer = json.loads(content)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(answer, dict):
+        return {}
+
+    results = {}
+    for ticket_id in ticket_ids:
+        category = answer.get(str(ticket_id))
+        if isinstance(category, str):
+            category = canonical_category(category)
+            if category:
+                results[ticket_id] = category
+    return results
+
+
+def pack_batches(tickets, token_budget=DEFAULT_BATCH_TOKEN_BUDGET, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+    """Group (id, description) pairs into batches bounded by count and estimated tokens"""
+    batch = []
+    batch_tokens = _BATCH_OVERHEAD_TOKENS
+    for ticket_id, description in tickets:
+        ticket_tokens = estimate_tokens(description) + 8 + COMPLETION_TOKENS_PER_TICKET
+        if batch and (len(batch) >= max_batch_size or batch_tokens + ticket_tokens > token_budget):
+            yield batch
+            batch = []
+            batch_tokens = _BATCH_OVERHEAD_TOKENS
+        batch.append((ticket_id, description))
+        batch_tokens += ticket_tokens
+    if batch:
+        yield batch
+
+
+def batch_items_error(items, max_items):
+    """Why a classify_batch body is not a usable list of {id, description} objects, or None"""
+    if not isinstance(items, list):
+        return 'Please pass a JSON array of {"id": ..., "description": ...} objects in the request body'
+    if len(items) > max_items:
+        return f"Too many items: {len(items)} (at most {max_items} per request)"
+    for position, item in enumerate(items):
+        if not isinstance(item, dict) or 'id' not in item:
+            return f"Item {position} must be an object with an id"
+        if not isinstance(item.get('description') or '', str):
+            return f"Item {position} has a description that is not a string"
+    return None
+
+
+def classify_descriptions(descriptions, classify_one, classify_many, executor, batch_size=1):
+    """Categories for `descriptions`, in order, classified concurrently on `executor`.
+
+    Repeated descriptions are classified once. With batch_size > 1 up to that
+    many tickets share a request through classify_many; otherwise every
+    ticket is its own classify_one request. Empty descriptions get
+    "No Description" without a request.
+    """
+    unique = list(dict.fromkeys(description for description in descriptions if description))
+    if batch_size > 1:
+        groups = [[description for _, description in batch]
+                  for batch in pack_batches(enumerate(unique), max_batch_size=batch_size)]
+        results = executor.map(
+            lambda group: classify_many(group) if len(group) > 1 else [classify_one(group[0])], groups
+        )
+        categories = dict(zip(unique, (category for group in results for category in group)))
+    else:
+        categories = dict(zip(unique, executor.map(classify_one, unique)))
+    return [categories[description] if description else "No Description" for description in descriptions]
+
+
+def classify_in_batch(descriptions, model, deployment_pool, classify_one, cache=None, local=None):
+    """Categories for `descriptions`, in order, classified together in one request.
+
+    Cached and locally classified tickets are left out of the request. Tickets
+    missing from the answer, or given an unknown category, go to classify_one.
+    """
+    categories = [None] * len(descriptions)
+    tickets = []
+    for i, description in enumerate(descriptions):
+        cached = cache.get(description, model) if cache else None
+        if not cached and local:
+            cached = local.classify(description)
+        if cached:
+            categories[i] = cached
+        else:
+            tickets.append((i + 1, description))
+    if not tickets:
+        return categories
+
+    messages = build_batch_messages(tickets)
+
+    def request(deployment):
+        raw = deployment.client.chat.completions.with_raw_response.create(
+            model=deployment.model,
+            messages=messages,
+            max_tokens=batch_max_tokens(len(tickets)),
+            temperature=0,
+            response_format={"type": "json_object"}
+        )
+        return raw.parse(), raw.headers
+
+    try:
+        response = deployment_pool.call(request, estimate_batch_tokens(tickets))
+        results = parse_batch_response(response.choices[0].message.content, [i for i, _ in tickets])
+    except Exception as e:
+        logging.error(f"Error classifying batch of {len(tickets)} tickets: {str(e)}")
+        results = {}
+
+    for ticket_id, description in tickets:
+        category = results.get(ticket_id)
+        if category:
+            if cache:
+                cache.put(description, model, category)
+        else:
+            category = classify_one(description)
+        categories[ticket_id - 1] = category
+    return categories
+
+
+def classify_rows_in_batches(rows, classify_one, classify_many, batch_size=1):
+    """Yield each row with its Category set, sending up to batch_size tickets per request.
+
+    A batch of one goes to classify_one; rows without a description get
+    "No Description" without a request.
+    """
+    if batch_size > 1:
+        batches = pack_batches(((row, row.get('Description') or '') for row in rows), max_batch_size=batch_size)
+    else:
+        batches = ([(row, row.get('Description') or '')] for row in rows)
+
+    for batch in batches:
+        descriptions = [description for _, description in batch if description]
+        if len(descriptions) > 1:
+            categories = iter(classify_many(descriptions))
+        else:
+            categories = iter([classify_one(description) for description in descriptions])
+
+        for row, description in batch:
+            row['Category'] = next(categories) if description else "No Description"
+            yield row
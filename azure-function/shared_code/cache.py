@@ -0,0 +1,179 @@
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from shared_code.categories import CATEGORIES_VERSION, NON_CATEGORY_VALUES
+from shared_code.preprocess import preprocess_version
+from shared_code.prompts import prompt_version
+from shared_code.readers import TicketFileReader
+
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), "classification_cache.sqlite")
+DEFAULT_TTL_DAYS = 90.0
+DEFAULT_MAX_ENTRIES = 200000
+
+# Run eviction every this many writes rather than on every put
+EVICTION_INTERVAL = 500
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_description(description):
+    return _WHITESPACE.sub(" ", description).strip().lower()
+
+
+def cache_key(description, model):
+    """Hash of the normalized description plus everything that affects the answer"""
+    parts = [model, prompt_version(), preprocess_version(), CATEGORIES_VERSION, normalize_description(description)]
+    return hashlib.sha256("\x1f".join(parts).encode('utf-8')).hexdigest()
+
+
+class ClassificationCache:
+    """SQLite-backed map from ticket description to category.
+
+    Entries expire after `ttl_days` and the least recently used entries are
+    dropped once there are more than `max_entries`. The database runs in WAL
+    mode so the CLI and a local Function host can share one file.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_days=DEFAULT_TTL_DAYS,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_days * 86400 if ttl_days else None
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS classifications ("
+            " key TEXT PRIMARY KEY,"
+            " category TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " hit_count INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS classifications_last_used ON classifications (last_used)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            path=os.environ.get('CLASSIFICATION_CACHE_PATH', DEFAULT_CACHE_PATH),
+            ttl_days=float(os.environ.get('CLASSIFICATION_CACHE_TTL_DAYS', DEFAULT_TTL_DAYS)),
+            max_entries=int(os.environ.get('CLASSIFICATION_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+        )
+
+    def get(self, description, model):
+        key = cache_key(description, model)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT category, created FROM classifications WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl_seconds and now - row[1] > self.ttl_seconds):
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE classifications SET last_used = ?, hit_count = hit_count + 1 WHERE key = ?",
+                (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, description, model, category):
+        self.put_many([(description, category)], model)
+
+    def put_many(self, items, model):
+        """Store (description, category) pairs, skipping placeholder values"""
+        now = time.time()
+        rows = [
+            (cache_key(description, model), category, now, now)
+            for description, category in items
+            if description and category and category not in NON_CATEGORY_VALUES
+        ]
+        if not rows:
+            return 0
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO classifications (key, category, created, last_used)"
+                " VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            self._writes += len(rows)
+            if self._writes >= EVICTION_INTERVAL:
+                self._evict()
+                self._writes = 0
+        return len(rows)
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        if self.ttl_seconds:
+            self._conn.execute(
+                "DELETE FROM classifications WHERE created < ?", (time.time() - self.ttl_seconds,)
+            )
+        if self.max_entries:
+            self._conn.execute(
+                "DELETE FROM classifications WHERE key IN ("
+                " SELECT key FROM classifications ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        self._conn.commit()
+
+    def warm_from_csv(self, path, model, description_col="Description", category_col="Category"):
+        """Load the results of an earlier "- Categorized.csv" run (possibly compressed); returns rows added"""
+        added = 0
+        batch = []
+        with TicketFileReader(path) as reader:
+            if description_col not in (reader.fieldnames or []) or category_col not in reader.fieldnames:
+                return 0
+            for row in reader:
+                batch.append((row.get(description_col, ""), row.get(category_col, "")))
+                if len(batch) >= 1000:
+                    added += self.put_many(batch, model)
+                    batch = []
+        added += self.put_many(batch, model)
+        return added
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_classification_cache():
+    """Process-wide cache configured from the environment, or None if disabled"""
+    global _shared_cache
+    if os.environ.get('CLASSIFICATION_CACHE_ENABLED', 'true').lower() in ('0', 'false', 'no'):
+        return None
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ClassificationCache.from_env()
+        return _shared_cache
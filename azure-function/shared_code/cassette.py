@@ -0,0 +1,204 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+import httpx
+
+RECORD = 'record'
+REPLAY = 'replay'
+# Response headers that describe the bytes on the wire rather than the body that is stored
+_TRANSFER_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive'}
+
+
+class CassetteMiss(LookupError):
+    """A replayed request that was never recorded"""
+
+
+def request_key(method, url, content, content_type):
+    """Hash identifying a request independently of the endpoint host, header order and JSON key order"""
+    body = b""
+    if content_type.startswith('application/json') and content:
+        body = json.dumps(json.loads(content), sort_keys=True, ensure_ascii=False).encode('utf-8')
+    elif not content_type.startswith('multipart/'):
+        # Multipart uploads carry a random boundary; they are replayed in recording order instead
+        body = content or b""
+    # An endpoint configured with a trailing slash gives paths starting //
+    target = re.sub(r"/{2,}", "/", url.raw_path.decode('ascii'))
+    return hashlib.sha256(b"\x1f".join([method.encode('ascii'), target.encode('utf-8'), body])).hexdigest()
+
+
+class Cassette:
+    """Recorded Azure OpenAI request/response pairs, for profiling and regression runs without a network.
+
+    In record mode every response that passes through the pooled clients is
+    stored in a JSON Lines file with how long it took. In replay mode the
+    same requests are answered from the file after the recorded time
+    multiplied by `latency_scale` (0 answers at once, to measure the
+    client's own overhead). Requests are matched on method, path and
+    body. The endpoint host is ignored. Repeats of a request get the
+    recorded responses in order, so 429s and retries play out as they did.
+    After that the last response repeats. A request that was never
+    recorded raises CassetteMiss, which the client reports as a
+    connection error.
+    """
+
+    def __init__(self, path, mode=REPLAY, latency_scale=1.0):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Cassette mode must be {RECORD} or {REPLAY}, not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.stats = {'recorded': 0, 'replayed': 0, 'throttled': 0, 'misses': 0}
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if mode == RECORD:
+            # Appended to, so several processes of one run can record into the same file
+            self._file = open(path, 'a', buffering=1, encoding='utf-8')
+        else:
+            self._load()
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry['key'], deque()).append(entry)
+
+    def record(self, request, response, content, elapsed):
+        """Store one response, given its decoded body, and return it as it will be replayed"""
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in _TRANSFER_HEADERS}
+        try:
+            body = {'text': content.decode('utf-8')}
+        except UnicodeDecodeError:
+            body = {'base64': base64.b64encode(content).decode('ascii')}
+        entry = {
+            'key': request_key(request.method, request.url, request.content,
+                               request.headers.get('content-type', '')),
+            'method': request.method,
+            'path': request.url.path,
+            'status': response.status_code,
+            'headers': headers,
+            'elapsed': round(elapsed, 6),
+            **body,
+        }
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.stats['recorded'] += 1
+            self.stats['throttled'] += response.status_code == 429
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    def lookup(self, request):
+        """The recorded (response, seconds to wait) for a request; raises CassetteMiss"""
+        key = request_key(request.method, request.url, request.content, request.headers.get('content-type', ''))
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.stats['misses'] += 1
+                raise CassetteMiss(f"No recorded response for {request.method} {request.url.path}")
+            entry = entries.popleft() if len(entries) > 1 else entries[0]
+            self.stats['replayed'] += 1
+            self.stats['throttled'] += entry['status'] == 429
+        content = base64.b64decode(entry['base64']) if 'base64' in entry else entry['text'].encode('utf-8')
+        response = httpx.Response(entry['status'], headers=entry['headers'], content=content, request=request)
+        return response, entry['elapsed'] * self.latency_scale
+
+    def transport(self, inner):
+        """httpx transport that records through `inner`, or replays without using it"""
+        return CassetteTransport(self, inner)
+
+    def async_transport(self, inner):
+        return AsyncCassetteTransport(self, inner)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class CassetteTransport(httpx.BaseTransport):
+    def __init__(self, cassette, inner):
+        self.cassette = cassette
+        self.inner = inner
+
+    def handle_request(self, request):
+        request.read()
+        if self.cassette.mode == REPLAY:
+            response, delay = self.cassette.lookup(request)
+            time.sleep(delay)
+            return response
+        started = time.perf_counter()
+        response = self.inner.handle_request(request)
+        try:
+            content = response.read()
+        finally:
+            response.close()
+        return self.cassette.record(request, response, content, time.perf_counter() - started)
+
+    def close(self):
+        self.inner.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette, inner):
+        self.cassette = cassette
+        self.inner = inner
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        if self.cassette.mode == REPLAY:
+            response, delay = self.cassette.lookup(request)
+            await asyncio.sleep(delay)
+            return response
+        started = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+        return self.cassette.record(request, response, content, time.perf_counter() - started)
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+_shared_cassette = None
+_shared_configured = False
+_shared_lock = threading.Lock()
+
+
+def set_cassette(cassette):
+    """Record or replay through `cassette` (None turns it off) in clients created from now on"""
+    global _shared_cassette, _shared_configured
+    with _shared_lock:
+        _shared_cassette = cassette
+        _shared_configured = True
+
+
+def get_cassette():
+    """Process-wide cassette configured from the environment, unless set_cassette was called.
+
+    OPENAI_CASSETTE_PATH names the file, OPENAI_CASSETTE_MODE is record or
+    replay (default replay) and OPENAI_CASSETTE_LATENCY_SCALE scales the
+    replayed latencies (default 1).
+    """
+    global _shared_cassette, _shared_configured
+    with _shared_lock:
+        if not _shared_configured:
+            path = os.environ.get('OPENAI_CASSETTE_PATH')
+            if path:
+                _shared_cassette = Cassette(
+                    path,
+                    mode=os.environ.get('OPENAI_CASSETTE_MODE', REPLAY).lower(),
+                    latency_scale=float(os.environ.get('OPENAI_CASSETTE_LATENCY_SCALE', 1.0)),
+                )
+                logging.warning(f"Azure OpenAI requests go through the cassette {path} ({_shared_cassette.mode})")
+            _shared_configured = True
+        return _shared_cassette
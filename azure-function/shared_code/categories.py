@@ -0,0 +1,73 @@
+import difflib
+import functools
+import hashlib
+import re
+
+CATEGORIES = [
+    "NHSUK Spam/Marketing",
+    "NHSUK Profiles",
+    "NHSuk Unsupported Service",
+    "NHSUK Content Management Service",
+    "NHSUK Data Services - Directories",
+    "NHSUK Ratings & Reviews",
+    "NHSuk Generic Service",
+    "NHSUK Data Services - GDoS",
+    "NHSUK Personal Medical Query",
+    "NHSUK Find A Service",
+    "NHSUK Syndication",
+    "NHSUK Health Assessment Tools",
+    "NHSUK Internal Tech Request",
+    "NHSUK Find Your NHS Number",
+    "Z_Retired P0 & P5 Web Service",
+    "NBS Q-Flow Acct Mgmt",
+    "NSD Unsupported Service",
+    "NBS Patient Journey",
+    "NHSUK Give Us Feedback Form",
+    "NHSUK Campaigns",
+    "Patient Facing",
+    "Profile manager (GP Reg)",
+    "NHS App National Services",
+    "GeneralPracticeAnnualSelfDeclaration-eDec",
+    "NHSUK Authenticated Website",
+    "Post event message to GP",
+    "CSF – Junk NSD"
+]
+
+# Changes whenever a category is added, removed, renamed or reordered
+CATEGORIES_VERSION = hashlib.sha256("\n".join(CATEGORIES).encode('utf-8')).hexdigest()[:12]
+
+# Placeholder values written instead of a category; never cached or reused
+NON_CATEGORY_VALUES = {"Error", "Classification Error", "No Description"}
+
+# Compact codes for the category-code prompt; follow the order of CATEGORIES
+CATEGORY_CODES = {str(number): category for number, category in enumerate(CATEGORIES, 1)}
+
+_NON_ALPHANUMERIC = re.compile(r"[^a-z0-9]+")
+
+
+def _normalize(text):
+    return _NON_ALPHANUMERIC.sub(" ", text.lower()).strip()
+
+
+_BY_NORMALIZED = {_normalize(category): category for category in CATEGORIES}
+
+
+@functools.lru_cache(maxsize=4096)
+def canonical_category(reply):
+    """Map a model reply to a CATEGORIES entry, or None if nothing is close.
+
+    Tries an exact match, then one ignoring case, spacing and punctuation,
+    then the closest name by difflib ratio.
+    """
+    if not reply:
+        return None
+    reply = reply.strip().strip("\"'`.").strip()
+    if reply in _BY_NORMALIZED.values():
+        return reply
+    normalized = _normalize(reply)
+    if normalized.startswith("category "):
+        normalized = normalized[len("category "):]
+    if normalized in _BY_NORMALIZED:
+        return _BY_NORMALIZED[normalized]
+    close = difflib.get_close_matches(normalized, _BY_NORMALIZED, n=1, cutoff=0.85)
+    return _BY_NORMALIZED[close[0]] if close else None
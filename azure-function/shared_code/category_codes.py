@@ -0,0 +1,75 @@
+import functools
+import logging
+import os
+import re
+
+from shared_code.categories import CATEGORY_CODES, canonical_category
+from shared_code.prompts import get_prompt_layout
+
+# Digits of the longest code, each at most one token
+CODE_MAX_TOKENS = 2
+LOGIT_BIAS = 100
+
+_LEADING_CODE = re.compile(r"^(?:category(?: number)?\s*[:#-]?\s*)?(\d{1,3})\b", re.IGNORECASE)
+
+
+def build_code_messages(description):
+    """Chat messages asking for the number of the category only"""
+    return get_prompt_layout(codes=True).messages(description)
+
+
+@functools.lru_cache(maxsize=None)
+def code_logit_bias(model):
+    """logit_bias restricting the reply to code tokens, or None when tiktoken can't tokenize for `model`.
+
+    Token ids depend on the model's tokenizer. Deployments whose name tiktoken
+    doesn't recognise get no bias rather than a guess at the wrong tokens.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        return None
+    except Exception as e:
+        # tiktoken downloads its encoding files on first use
+        logging.warning(f"Could not load the tokenizer for {model}, sending codes without logit_bias: {e}")
+        return None
+    token_ids = set()
+    for code in CATEGORY_CODES:
+        token_ids.update(encoding.encode(code))
+    return {str(token_id): LOGIT_BIAS for token_id in sorted(token_ids)}
+
+
+def code_request_options(model):
+    """Extra chat completion arguments for the category-code prompt"""
+    options = {'max_tokens': CODE_MAX_TOKENS}
+    logit_bias = code_logit_bias(model)
+    if logit_bias:
+        options['logit_bias'] = logit_bias
+    return options
+
+
+def category_codes_enabled():
+    """Whether the Function app uses the category-code prompt (CLASSIFY_CATEGORY_CODES)"""
+    return os.environ.get('CLASSIFY_CATEGORY_CODES', 'false').lower() in ('1', 'true', 'yes')
+
+
+def parse_category_reply(reply):
+    """CATEGORIES entry for a code or free-text reply, or None if it can't be mapped"""
+    if not reply:
+        return None
+    match = _LEADING_CODE.match(reply.strip())
+    if match and match.group(1) in CATEGORY_CODES:
+        return CATEGORY_CODES[match.group(1)]
+    return canonical_category(reply)
+
+
+def category_from_reply(reply):
+    """Like parse_category_reply, but raises ValueError for replies that can't be mapped"""
+    category = parse_category_reply(reply)
+    if category is None:
+        raise ValueError(f"Reply is not a known category: {reply!r}")
+    return category
@@ -0,0 +1,277 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+from shared_code.metrics import get_metrics_recorder
+from shared_code.openai_client import DEFAULT_MAX_CONNECTIONS, get_async_client, get_client
+from shared_code.rate_limiter import (
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    DEFAULT_TOKENS_PER_MINUTE,
+    RateLimiter,
+    error_headers,
+    is_rate_limit_error,
+    is_server_error,
+)
+
+# Consecutive 429s or server errors after which a deployment is taken out of rotation
+DEFAULT_EJECT_AFTER = 3
+# First ejection; each repeat before a success doubles it, up to MAX_EJECT_SECONDS
+DEFAULT_EJECT_SECONDS = 30.0
+MAX_EJECT_SECONDS = 600.0
+
+
+class Deployment:
+    """One Azure OpenAI deployment in a DeploymentPool.
+
+    Requests are paced by its own RateLimiter, sized to the deployment's
+    quota. `model` is the deployment name sent with each request.
+    """
+
+    def __init__(self, endpoint, api_key, api_version, model, name=None, weight=1.0,
+                 requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 max_connections=DEFAULT_MAX_CONNECTIONS):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.api_version = api_version
+        self.model = model
+        self.name = name or f"{urlparse(endpoint).hostname}/{model}"
+        self.weight = float(weight)
+        self.max_connections = max_connections
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute, max_retries=0)
+        # Health: consecutive failures, and ejections since the last success
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        # Totals for stats()
+        self.requests = 0
+        self.errors = 0
+        self.times_ejected = 0
+
+    @property
+    def client(self):
+        """Pooled AzureOpenAI client for this deployment's endpoint"""
+        return get_client(self.endpoint, self.api_key, self.api_version, self.max_connections)
+
+    def async_client(self):
+        """AsyncAzureOpenAI client for this deployment's endpoint on the running event loop"""
+        return get_async_client(self.endpoint, self.api_key, self.api_version, self.max_connections)
+
+
+class DeploymentPool:
+    """Routes requests across Azure OpenAI deployments, e.g. one model deployed in several regions.
+
+    A request goes to one of the deployments that can start it now, chosen
+    at random in proportion to headroom (requests of its size the buckets
+    hold) times weight, or to the one that can start it soonest if none can.
+    Traffic follows spare quota, and every deployment keeps being tried, so
+    an unhealthy one is noticed. A 429 or server error retries the request on
+    another deployment. After `eject_after` consecutive failures a
+    deployment is ejected for `eject_seconds`, then re-admitted; one more
+    failure before a success ejects it again for twice as long. With a
+    single deployment it behaves like a RateLimiter. Safe to share between
+    threads and asyncio tasks in one process.
+    """
+
+    def __init__(self, deployments, max_retries=DEFAULT_MAX_RETRIES, metrics=None,
+                 eject_after=DEFAULT_EJECT_AFTER, eject_seconds=DEFAULT_EJECT_SECONDS):
+        if not deployments:
+            raise ValueError("A deployment pool needs at least one deployment")
+        self.deployments = list(deployments)
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self._lock = threading.Lock()
+        # Successful requests and the time they took, excluding waits
+        self.completed = 0
+        self.request_seconds = 0.0
+
+    def clients(self):
+        return [deployment.client for deployment in self.deployments]
+
+    def _choose(self, estimated_tokens, tried):
+        """Pick a deployment for the next attempt and reserve capacity on it; returns (deployment, delay)"""
+        now = time.monotonic()
+        with self._lock:
+            admitted = [d for d in self.deployments if d.ejected_until <= now]
+            # Every deployment ejected: use the one that comes back first rather than fail
+            candidates = ([d for d in admitted if d not in tried] or admitted
+                          or [min(self.deployments, key=lambda d: d.ejected_until)])
+        ready, shares = [], []
+        soonest, soonest_wait = None, None
+        for deployment in candidates:
+            wait, available = deployment.limiter.capacity_for(estimated_tokens)
+            if wait == 0 and available * deployment.weight > 0:
+                ready.append(deployment)
+                shares.append(available * deployment.weight)
+            elif soonest is None or wait < soonest_wait:
+                soonest, soonest_wait = deployment, wait
+        # Spread requests in proportion to headroom, so every deployment keeps being tried
+        deployment = random.choices(ready, weights=shares)[0] if ready else soonest
+        return deployment, deployment.limiter.reserve(estimated_tokens)
+
+    def _succeeded(self, deployment, seconds, headers):
+        deployment.limiter.update_from_headers(headers)
+        with self._lock:
+            self.completed += 1
+            self.request_seconds += seconds
+            deployment.requests += 1
+            deployment.failures = 0
+            if deployment.ejections:
+                logging.info(f"Deployment {deployment.name} is healthy again")
+            deployment.ejections = 0
+
+    def _failed(self, deployment, error, attempt):
+        """Record a failed attempt; returns True if the request should be retried"""
+        rate_limited = is_rate_limit_error(error)
+        if rate_limited:
+            deployment.limiter.on_rate_limited(error_headers(error), attempt)
+        elif not (is_server_error(error) and len(self.deployments) > 1):
+            return False
+
+        with self._lock:
+            deployment.errors += 1
+            deployment.failures += 1
+            # A re-admitted deployment that fails again before a success goes straight back out
+            threshold = 1 if deployment.ejections else self.eject_after
+            if len(self.deployments) > 1 and deployment.failures >= threshold:
+                seconds = min(MAX_EJECT_SECONDS, self.eject_seconds * 2 ** deployment.ejections)
+                deployment.ejected_until = time.monotonic() + seconds
+                deployment.ejections += 1
+                deployment.times_ejected += 1
+                deployment.failures = 0
+                logging.warning(f"Ejected deployment {deployment.name} for {seconds:g}s after "
+                                f"{type(error).__name__}: {error}")
+        return True
+
+    def average_request_seconds(self):
+        return self.request_seconds / self.completed if self.completed else 0.0
+
+    def _report(self, queued_since, started, attempt, result=None, failed=False):
+        if not self.metrics:
+            return
+        now = time.monotonic()
+        # Queue wait covers limiter delays, 429 responses and failed attempts before the final one
+        self.metrics.record_request(
+            started - queued_since, now - started, attempt,
+            usage=getattr(result, 'usage', None), model=getattr(result, 'model', None), failed=failed,
+        )
+
+    def call(self, request, estimated_tokens):
+        """Run request(deployment) -> (result, headers) on the best deployment, retrying elsewhere on failure"""
+        queued_since = time.monotonic()
+        tried = set()
+        for attempt in range(self.max_retries + 1):
+            deployment, delay = self._choose(estimated_tokens, tried)
+            if delay:
+                time.sleep(delay)
+            started = time.monotonic()
+            try:
+                result, headers = request(deployment)
+            except Exception as e:
+                if not self._failed(deployment, e, attempt) or attempt == self.max_retries:
+                    self._report(queued_since, started, attempt, failed=True)
+                    raise
+                tried.add(deployment)
+                continue
+            self._succeeded(deployment, time.monotonic() - started, headers)
+            self._report(queued_since, started, attempt, result)
+            return result
+
+    async def call_async(self, request, estimated_tokens, avoid=(), on_choose=None):
+        """Async variant of call(); request(deployment) must return an awaitable.
+
+        Deployments in `avoid` are only used when no other is admitted.
+        `on_choose(deployment)` is called as soon as each attempt's deployment
+        is picked, before any wait for its rate limiter.
+        """
+        queued_since = time.monotonic()
+        tried = set(avoid)
+        for attempt in range(self.max_retries + 1):
+            deployment, delay = self._choose(estimated_tokens, tried)
+            if on_choose:
+                on_choose(deployment)
+            if delay:
+                await asyncio.sleep(delay)
+            started = time.monotonic()
+            try:
+                result, headers = await request(deployment)
+            except Exception as e:
+                if not self._failed(deployment, e, attempt) or attempt == self.max_retries:
+                    self._report(queued_since, started, attempt, failed=True)
+                    raise
+                tried.add(deployment)
+                continue
+            self._succeeded(deployment, time.monotonic() - started, headers)
+            self._report(queued_since, started, attempt, result)
+            return result
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                d.name: {
+                    'requests': d.requests,
+                    'errors': d.errors,
+                    'ejections': d.times_ejected,
+                    'admitted': d.ejected_until <= now,
+                }
+                for d in self.deployments
+            }
+
+
+def deployments_from_env():
+    """Deployments listed in OPENAI_DEPLOYMENTS, or the single OPENAI_ENDPOINT / OPENAI_MODEL one.
+
+    OPENAI_DEPLOYMENTS is a JSON array of objects with any of name, endpoint,
+    api_key, api_key_setting (the app setting holding the key, e.g. a Key
+    Vault reference), api_version, model, weight, requests_per_minute and
+    tokens_per_minute. Missing values come from the OPENAI_* settings.
+    """
+    defaults = {
+        'endpoint': os.environ.get("OPENAI_ENDPOINT"),
+        'api_key': os.environ.get("OPENAI_API_KEY"),
+        'api_version': os.environ.get("OPENAI_API_VERSION"),
+        'model': os.environ.get("OPENAI_MODEL", "gpt-4o"),
+        'requests_per_minute': int(os.environ.get('OPENAI_REQUESTS_PER_MINUTE', DEFAULT_REQUESTS_PER_MINUTE)),
+        'tokens_per_minute': int(os.environ.get('OPENAI_TOKENS_PER_MINUTE', DEFAULT_TOKENS_PER_MINUTE)),
+        'max_connections': int(os.environ.get('OPENAI_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS)),
+    }
+    entries = json.loads(os.environ['OPENAI_DEPLOYMENTS']) if os.environ.get('OPENAI_DEPLOYMENTS') else [{}]
+    deployments = []
+    for entry in entries:
+        settings = {**defaults, **entry}
+        key_setting = settings.pop('api_key_setting', None)
+        if key_setting:
+            settings['api_key'] = os.environ[key_setting]
+        deployments.append(Deployment(**settings))
+    return deployments
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_deployment_pool():
+    """Process-wide deployment pool configured from the environment.
+
+    Every handler in a Function worker draws from the same deployment quotas,
+    so they must share one pool rather than each budgeting separately.
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = DeploymentPool(
+                deployments_from_env(),
+                max_retries=int(os.environ.get('OPENAI_MAX_RETRIES', DEFAULT_MAX_RETRIES)),
+                metrics=get_metrics_recorder(),
+                eject_after=int(os.environ.get('OPENAI_EJECT_AFTER_FAILURES', DEFAULT_EJECT_AFTER)),
+                eject_seconds=float(os.environ.get('OPENAI_EJECT_SECONDS', DEFAULT_EJECT_SECONDS)),
+            )
+        return _shared_pool
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from shared_code.deployment_pool import get_deployment_pool
+from shared_code.metrics import get_metrics_recorder
+
+# Hedge once the first attempt is slower than this share of recent calls
+DEFAULT_HEDGE_PERCENTILE = 0.95
+# Hedge delay until enough calls have been timed to take a percentile
+DEFAULT_HEDGE_DELAY = 1.0
+DEFAULT_DEADLINE_SECONDS = 10.0
+MIN_SAMPLES = 20
+LATENCY_WINDOW = 500
+
+
+class DeadlineExceeded(Exception):
+    """Neither attempt answered within the deadline"""
+
+
+class HedgedCaller:
+    """Runs single requests against a deadline, hedging the slow ones.
+
+    The first attempt goes to the DeploymentPool as usual. If it hasn't
+    answered after the `percentile` latency of recent calls, a duplicate is
+    sent, to another deployment when the pool has one, and whichever answers
+    first wins. The other attempt is cancelled, which closes its connection.
+    Both attempts are cancelled when the deadline passes. Attempts run as
+    tasks on a background event loop, so call() can be used from synchronous
+    handlers in any thread.
+    """
+
+    def __init__(self, pool, percentile=DEFAULT_HEDGE_PERCENTILE, deadline=DEFAULT_DEADLINE_SECONDS,
+                 initial_delay=DEFAULT_HEDGE_DELAY, metrics=None):
+        self.pool = pool
+        self.percentile = percentile
+        self.deadline = deadline
+        self.initial_delay = initial_delay
+        self.metrics = metrics
+        # Seconds each attempt took, or ran before it was cancelled
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def hedge_delay(self):
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < MIN_SAMPLES:
+            return min(self.initial_delay, self.deadline)
+        return min(samples[min(len(samples) - 1, int(self.percentile * len(samples)))], self.deadline)
+
+    def _event_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='hedged_requests', daemon=True).start()
+            return self._loop
+
+    def call(self, request, estimated_tokens):
+        """Run async request(deployment) -> (result, headers) with hedging; raises DeadlineExceeded"""
+        return asyncio.run_coroutine_threadsafe(
+            self.call_async(request, estimated_tokens), self._event_loop()
+        ).result()
+
+    async def call_async(self, request, estimated_tokens):
+        started = time.monotonic()
+        # Known as soon as the pool picks it, so a hedge avoids it even while the first attempt is queued
+        first_deployments = []
+        first = asyncio.ensure_future(
+            self.pool.call_async(request, estimated_tokens, on_choose=first_deployments.append)
+        )
+        attempts = {first: started}
+        finished = {}
+        first.add_done_callback(lambda task: finished.setdefault(task, time.monotonic()))
+        pending = {first}
+        hedge = None
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_delay())
+            if not done:
+                hedge = asyncio.ensure_future(
+                    self.pool.call_async(request, estimated_tokens, avoid=first_deployments)
+                )
+                attempts[hedge] = time.monotonic()
+                hedge.add_done_callback(lambda task: finished.setdefault(task, time.monotonic()))
+                pending.add(hedge)
+            while True:
+                # An attempt that failed after the pool's own retries leaves the other one to answer
+                for task in done:
+                    if not task.exception():
+                        self._record(started, hedge, task)
+                        return task.result()
+                if not pending:
+                    # Every attempt failed; raise the latest error
+                    self._record(started, hedge, None)
+                    return (hedge or first).result()
+                remaining = self.deadline - (time.monotonic() - started)
+                done, pending = await asyncio.wait(pending, timeout=max(remaining, 0),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self._record(started, hedge, None, timed_out=True)
+                    raise DeadlineExceeded(f"No answer within {self.deadline:g}s")
+        finally:
+            for task in pending:
+                task.cancel()
+            self._record_attempts(attempts, finished)
+
+    def _record_attempts(self, attempts, finished):
+        """Add every attempt's time to the latency window, up to its cancellation if it was cancelled.
+
+        A cancelled attempt would have taken at least that long; leaving the
+        slow attempts out would pull the hedge delay down and hedge ever more.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for task, started in attempts.items():
+                self._latencies.append(finished.get(task, now) - started)
+
+    def _record(self, started, hedge, winner, timed_out=False):
+        if self.metrics:
+            self.metrics.record_hedged_call(time.monotonic() - started, hedged=hedge is not None,
+                                            hedge_won=winner is not None and winner is hedge,
+                                            timed_out=timed_out)
+
+
+def hedging_enabled():
+    return os.environ.get('CLASSIFY_HEDGE', 'false').lower() in ('1', 'true', 'yes')
+
+
+_shared_caller = None
+_shared_caller_lock = threading.Lock()
+
+
+def get_hedged_caller():
+    """Process-wide HedgedCaller on the shared deployment pool, or None unless CLASSIFY_HEDGE is true"""
+    global _shared_caller
+    if not hedging_enabled():
+        return None
+    with _shared_caller_lock:
+        if _shared_caller is None:
+            _shared_caller = HedgedCaller(
+                get_deployment_pool(),
+                percentile=float(os.environ.get('CLASSIFY_HEDGE_PERCENTILE', DEFAULT_HEDGE_PERCENTILE * 100)) / 100,
+                deadline=float(os.environ.get('CLASSIFY_DEADLINE_SECONDS', DEFAULT_DEADLINE_SECONDS)),
+                metrics=get_metrics_recorder(),
+            )
+        return _shared_caller
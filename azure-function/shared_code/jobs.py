@@ -0,0 +1,273 @@
+import csv
+import io
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+JOB_QUEUE = "classify-chunks"
+JOB_CONTAINER = "classify-jobs"
+# Rows in a chunk are classified one after another, so a chunk must finish well inside the function timeout
+DEFAULT_CHUNK_ROWS = 50
+# Deliveries of a chunk message before it moves to the poison queue (host.json queues.maxDequeueCount)
+MAX_DEQUEUE_COUNT = 5
+# Threads standing in for queue-triggered instances with the in-memory storage
+LOCAL_WORKERS = 4
+
+
+class InMemoryJobStorage:
+    """Process-local stand-in for the job blobs and queue, for local runs and tests"""
+
+    def __init__(self):
+        self._blobs = {}
+        self._queue = deque()
+        self._lock = threading.Lock()
+
+    def put(self, name, text):
+        with self._lock:
+            self._blobs[name] = text
+
+    def get(self, name):
+        with self._lock:
+            return self._blobs.get(name)
+
+    def count(self, prefix):
+        with self._lock:
+            return sum(1 for name in self._blobs if name.startswith(prefix))
+
+    def names(self, prefix):
+        with self._lock:
+            return sorted(name for name in self._blobs if name.startswith(prefix))
+
+    def enqueue(self, message):
+        with self._lock:
+            self._queue.append(json.dumps(message))
+
+    def dequeue(self):
+        with self._lock:
+            return json.loads(self._queue.popleft()) if self._queue else None
+
+
+class AzureJobStorage:
+    """Job blobs and queue in the Function app's storage account, or Azurite locally"""
+
+    def __init__(self, connection_string, container=JOB_CONTAINER, queue=JOB_QUEUE):
+        from azure.core.exceptions import ResourceExistsError
+        from azure.storage.blob import BlobServiceClient
+        from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+
+        self._container = BlobServiceClient.from_connection_string(connection_string).get_container_client(container)
+        # Queue triggers expect base64 message bodies by default
+        self._queue = QueueClient.from_connection_string(
+            connection_string, queue, message_encode_policy=TextBase64EncodePolicy()
+        )
+        for create in (self._container.create_container, self._queue.create_queue):
+            try:
+                create()
+            except ResourceExistsError:
+                pass
+
+    def put(self, name, text):
+        self._container.upload_blob(name, text.encode('utf-8'), overwrite=True)
+
+    def get(self, name):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            return self._container.download_blob(name).readall().decode('utf-8')
+        except ResourceNotFoundError:
+            return None
+
+    def count(self, prefix):
+        return sum(1 for _ in self._container.list_blob_names(name_starts_with=prefix))
+
+    def names(self, prefix):
+        return sorted(self._container.list_blob_names(name_starts_with=prefix))
+
+    def enqueue(self, message):
+        self._queue.send_message(json.dumps(message))
+
+
+_shared_storage = None
+_shared_storage_lock = threading.Lock()
+
+
+def get_job_storage():
+    """Process-wide job storage; JOB_STORAGE=memory selects the in-memory stand-in"""
+    global _shared_storage
+    with _shared_storage_lock:
+        if _shared_storage is None:
+            if os.environ.get('JOB_STORAGE', '').lower() == 'memory':
+                _shared_storage = InMemoryJobStorage()
+            else:
+                _shared_storage = AzureJobStorage(os.environ['AzureWebJobsStorage'])
+        return _shared_storage
+
+
+def _job_blob(job_id, name):
+    return f"{job_id}/{name}"
+
+
+def _chunk_name(chunk):
+    return f"{chunk:06d}.csv"
+
+
+def _csv_text(fieldnames, rows, header=True):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def submit_job(storage, rows, fieldnames, chunk_rows=DEFAULT_CHUNK_ROWS, batch_size=1):
+    """Store rows as chunks of `chunk_rows`, queue one message per chunk and return the job record.
+
+    Chunks are queued as they are stored, so workers start before the upload
+    has been split completely. The job record is written first, as
+    `submitting`, and completed once every chunk is queued; if splitting the
+    upload fails the job is recorded as `failed`.
+    """
+    job_id = uuid.uuid4().hex
+    job = {
+        'job_id': job_id,
+        'status': "submitting",
+        'fieldnames': fieldnames + ['Category'],
+        'submitted': time.time(),
+    }
+    storage.put(_job_blob(job_id, "job.json"), json.dumps(job))
+    chunks = 0
+    total = 0
+    chunk = []
+
+    def flush():
+        nonlocal chunks
+        storage.put(_job_blob(job_id, f"input/{_chunk_name(chunks)}"), _csv_text(fieldnames, chunk))
+        storage.enqueue({'job_id': job_id, 'chunk': chunks, 'batch_size': batch_size})
+        chunks += 1
+
+    try:
+        for row in rows:
+            chunk.append(row)
+            total += 1
+            if len(chunk) >= chunk_rows:
+                flush()
+                chunk = []
+        if chunk:
+            flush()
+    except Exception as e:
+        job.update(status="failed", error=f"Submission failed after {total} rows: {e}")
+        storage.put(_job_blob(job_id, "job.json"), json.dumps(job))
+        raise
+
+    del job['status']
+    job.update(chunks=chunks, rows=total)
+    storage.put(_job_blob(job_id, "job.json"), json.dumps(job))
+    return job
+
+
+def process_chunk(storage, message, classify_rows):
+    """Classify one queued chunk; `classify_rows(rows, batch_size)` yields rows with a Category.
+
+    Output overwrites any earlier attempt, so redelivered messages are harmless.
+    """
+    job_id, chunk = message['job_id'], message['chunk']
+    text = storage.get(_job_blob(job_id, f"input/{_chunk_name(chunk)}"))
+    if text is None:
+        logging.warning(f"Input for chunk {chunk} of job {job_id} not found; skipping")
+        return 0
+    reader = csv.DictReader(io.StringIO(text))
+    fieldnames = reader.fieldnames + ['Category']
+    rows = list(classify_rows(reader, message.get('batch_size', 1)))
+    storage.put(_job_blob(job_id, f"output/{_chunk_name(chunk)}"), _csv_text(fieldnames, rows, header=False))
+    return len(rows)
+
+
+def record_chunk_failure(storage, message, error):
+    """Mark a chunk as failed for good, so the job reports `failed` instead of running forever"""
+    job_id, chunk = message['job_id'], message['chunk']
+    logging.error(f"Chunk {chunk} of job {job_id} failed: {error}")
+    storage.put(
+        _job_blob(job_id, f"failed/{chunk:06d}.json"),
+        json.dumps({'chunk': chunk, 'error': str(error), 'failed': time.time()}),
+    )
+
+
+def run_chunk(storage, message, classify_rows, dequeue_count=1, max_dequeue_count=MAX_DEQUEUE_COUNT):
+    """process_chunk for a queue worker, recording the failure on the message's last delivery.
+
+    Exceptions are re-raised, so earlier deliveries are retried and the last
+    one still moves the message to the poison queue.
+    """
+    try:
+        return process_chunk(storage, message, classify_rows)
+    except Exception as e:
+        if dequeue_count >= max_dequeue_count:
+            record_chunk_failure(storage, message, e)
+        raise
+
+
+def record_poisoned_chunk(storage, message):
+    """Mark a chunk from the poison queue as failed, unless its last attempt already did.
+
+    Covers attempts that never reached run_chunk's handler, such as a timeout
+    or a crashed worker.
+    """
+    job_id, chunk = message['job_id'], message['chunk']
+    if storage.get(_job_blob(job_id, f"failed/{chunk:06d}.json")) is None:
+        record_chunk_failure(storage, message, f"Gave up after {MAX_DEQUEUE_COUNT} attempts")
+
+
+def drain_queue(storage, classify_rows):
+    """Run queued chunks in this process, standing in for the queue-triggered workers"""
+    while True:
+        message = storage.dequeue()
+        if message is None:
+            return
+        try:
+            # Nothing redelivers an in-memory message, so the first attempt is the last
+            run_chunk(storage, message, classify_rows, max_dequeue_count=1)
+        except Exception:
+            pass
+
+
+def start_local_workers(storage, classify_rows, workers=LOCAL_WORKERS):
+    """Drain the in-memory queue on background threads, as parallel Function instances would"""
+    for _ in range(workers):
+        threading.Thread(target=drain_queue, args=(storage, classify_rows), daemon=True).start()
+
+
+def job_status(storage, job_id):
+    """Job record with progress, or None for an unknown job.
+
+    A job with a chunk that ran out of attempts is `failed`, with
+    `failed_chunks` and the first chunk's `error`. A job still being split
+    into chunks is `submitting`, or `failed` if that went wrong.
+    """
+    text = storage.get(_job_blob(job_id, "job.json"))
+    if text is None:
+        return None
+    job = json.loads(text)
+    if 'status' in job:
+        return job
+    completed = storage.count(_job_blob(job_id, "output/"))
+    job['completed_chunks'] = completed
+    failed = storage.names(_job_blob(job_id, "failed/"))
+    if failed:
+        job['status'] = "failed"
+        job['failed_chunks'] = len(failed)
+        job['error'] = json.loads(storage.get(failed[0]))['error']
+    else:
+        job['status'] = "completed" if completed >= job['chunks'] else ("running" if completed else "queued")
+    return job
+
+
+def iter_job_result(storage, job):
+    """Merge the chunk outputs of a completed job into one CSV, in input order"""
+    yield _csv_text(job['fieldnames'], [])
+    for chunk in range(job['chunks']):
+        yield storage.get(_job_blob(job['job_id'], f"output/{_chunk_name(chunk)}")) or ""
@@ -0,0 +1,225 @@
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+from shared_code.categories import CATEGORIES, NON_CATEGORY_VALUES
+from shared_code.readers import TicketFileReader
+
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_EPOCHS = 8
+DEFAULT_MIN_DF = 2
+MODEL_FORMAT = 1
+
+# Tickets that are obvious from a few words; checked before the model. Words real tickets also use,
+# such as "unsubscribe" (from NHS emails) or "crypto" (a reported scam), are left to the model
+RULES = [
+    (re.compile(r"\b(seo|backlinks?|guest posts?|link building|casino)\b"),
+     "NHSUK Spam/Marketing"),
+    (re.compile(r"\b(find|forgot(ten)?|lost|don'?t know|what is|where is) (out )?(my|our) nhs number\b"),
+     "NHSUK Find Your NHS Number"),
+]
+
+_EMAIL = re.compile(r"\S+@\S+")
+_URL = re.compile(r"https?://\S+|www\.\S+")
+_NUMBER = re.compile(r"\d+")
+_WORD = re.compile(r"[a-z#']+")
+
+
+def _terms(description):
+    """Unigram and bigram counts with emails, URLs and numbers masked"""
+    text = description.lower()
+    text = _EMAIL.sub(" email ", text)
+    text = _URL.sub(" url ", text)
+    text = _NUMBER.sub("#", text)
+    words = _WORD.findall(text)
+    counts = {}
+    for term in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        counts[term] = counts.get(term, 0) + 1
+    return counts
+
+
+def _softmax(scores):
+    top = max(scores)
+    exps = [math.exp(score - top) for score in scores]
+    total = sum(exps)
+    return [value / total for value in exps]
+
+
+def match_rule(description):
+    text = description.lower()
+    for pattern, category in RULES:
+        if category in CATEGORIES and pattern.search(text):
+            return category
+    return None
+
+
+class LocalClassifier:
+    """In-process fast path in front of the LLM.
+
+    Keyword rules and a TF-IDF softmax regression trained on earlier
+    "- Categorized.csv" output answer tickets they are confident about;
+    classify() returns None for the rest so the caller can escalate them.
+    """
+
+    def __init__(self, classes, idf, weights, bias, threshold=DEFAULT_THRESHOLD):
+        self.classes = classes
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+        self.threshold = threshold
+        self.rule_hits = 0
+        self.model_hits = 0
+        self.escalated = 0
+        self.local_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _vector(self, description):
+        vector = {
+            term: (1.0 + math.log(count)) * self.idf[term]
+            for term, count in _terms(description).items()
+            if term in self.idf
+        }
+        norm = math.sqrt(sum(value * value for value in vector.values()))
+        if norm:
+            vector = {term: value / norm for term, value in vector.items()}
+        return vector
+
+    def _scores(self, vector):
+        scores = list(self.bias)
+        for term, value in vector.items():
+            for k, weight in enumerate(self.weights[term]):
+                scores[k] += value * weight
+        return scores
+
+    def predict(self, description):
+        """Return (category, confidence) from the model alone"""
+        probabilities = _softmax(self._scores(self._vector(description)))
+        best = max(range(len(self.classes)), key=probabilities.__getitem__)
+        return self.classes[best], probabilities[best]
+
+    def classify(self, description):
+        """Return a category when the rules or the model are confident, otherwise None"""
+        started = time.perf_counter()
+        category = match_rule(description)
+        source = 'rule'
+        if category is None:
+            category, confidence = self.predict(description)
+            source = 'model'
+            if confidence < self.threshold or category not in CATEGORIES:
+                category = None
+        with self._lock:
+            self.local_seconds += time.perf_counter() - started
+            if category is None:
+                self.escalated += 1
+            elif source == 'rule':
+                self.rule_hits += 1
+            else:
+                self.model_hits += 1
+        return category
+
+    def stats(self):
+        local = self.rule_hits + self.model_hits
+        total = local + self.escalated
+        return {
+            'local': local,
+            'rule_hits': self.rule_hits,
+            'model_hits': self.model_hits,
+            'escalated': self.escalated,
+            'local_share': round(local / total, 3) if total else 0.0,
+            'avg_local_ms': round(1000 * self.local_seconds / total, 3) if total else 0.0,
+        }
+
+    @classmethod
+    def train(cls, examples, threshold=DEFAULT_THRESHOLD, epochs=DEFAULT_EPOCHS,
+              min_df=DEFAULT_MIN_DF, learning_rate=0.5, l2=1e-5, seed=1):
+        """Fit the model on (description, category) pairs with plain SGD"""
+        examples = [
+            (description, category) for description, category in examples
+            if description and category in CATEGORIES
+        ]
+        if not examples:
+            raise ValueError("no labelled tickets to train on")
+
+        documents = [_terms(description) for description, _ in examples]
+        df = {}
+        for terms in documents:
+            for term in terms:
+                df[term] = df.get(term, 0) + 1
+        idf = {
+            term: math.log((len(documents) + 1) / (count + 1)) + 1.0
+            for term, count in df.items() if count >= min_df
+        }
+        classes = sorted({category for _, category in examples})
+        class_index = {category: k for k, category in enumerate(classes)}
+        model = cls(classes, idf, {term: [0.0] * len(classes) for term in idf}, [0.0] * len(classes), threshold)
+
+        data = [
+            (model._vector(description), class_index[category])
+            for description, category in examples
+        ]
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            rate = learning_rate / (1.0 + epoch)
+            for vector, label in data:
+                probabilities = _softmax(model._scores(vector))
+                probabilities[label] -= 1.0
+                for k, gradient in enumerate(probabilities):
+                    model.bias[k] -= rate * gradient
+                for term, value in vector.items():
+                    weights = model.weights[term]
+                    for k, gradient in enumerate(probabilities):
+                        weights[k] -= rate * (gradient * value + l2 * weights[k])
+        return model
+
+    def save(self, path):
+        model = {
+            'format': MODEL_FORMAT,
+            'classes': self.classes,
+            'idf': {term: round(value, 5) for term, value in self.idf.items()},
+            'weights': {term: [round(w, 5) for w in weights] for term, weights in self.weights.items()},
+            'bias': [round(b, 5) for b in self.bias],
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(model, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, threshold=DEFAULT_THRESHOLD):
+        with open(path, encoding='utf-8') as f:
+            model = json.load(f)
+        if model.get('format') != MODEL_FORMAT:
+            raise ValueError(f"unsupported local classifier model format in {path}")
+        return cls(model['classes'], model['idf'], model['weights'], model['bias'], threshold)
+
+
+def read_training_examples(paths, description_col="Description", category_col="Category"):
+    """Yield (description, category) pairs from earlier output files, in any format TicketFileReader reads"""
+    for path in paths:
+        with TicketFileReader(path) as reader:
+            for row in reader:
+                category = (row.get(category_col) or "").strip()
+                if category and category not in NON_CATEGORY_VALUES:
+                    yield row.get(description_col) or "", category
+
+
+_shared_classifier = None
+_shared_classifier_lock = threading.Lock()
+
+
+def get_local_classifier():
+    """Process-wide classifier from LOCAL_CLASSIFIER_MODEL_PATH, or None when not configured"""
+    global _shared_classifier
+    path = os.environ.get('LOCAL_CLASSIFIER_MODEL_PATH')
+    if not path:
+        return None
+    with _shared_classifier_lock:
+        if _shared_classifier is None:
+            threshold = float(os.environ.get('LOCAL_CLASSIFIER_THRESHOLD', DEFAULT_THRESHOLD))
+            _shared_classifier = LocalClassifier.load(path, threshold)
+        return _shared_classifier
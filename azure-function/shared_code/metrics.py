@@ -0,0 +1,377 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+# Histogram bucket upper bounds in milliseconds
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+# Bucket upper bounds for prompt tokens saved per ticket by preprocessing
+TOKEN_BUCKETS = (0, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# USD per million (input, cached input, output) tokens, matched on the longest model name prefix.
+# Check the Azure OpenAI pricing page for your region and override with
+# OPENAI_PRICE_*_PER_1M or the [metrics] section of config.ini.
+MODEL_PRICES = {
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4.1': (2.00, 0.50, 8.00),
+    'gpt-4.1-mini': (0.40, 0.10, 1.60),
+    'gpt-35-turbo': (0.50, 0.50, 1.50),
+    'text-embedding-3-small': (0.02, 0.02, 0.0),
+    'text-embedding-3-large': (0.13, 0.13, 0.0),
+}
+
+
+def _field(obj, name):
+    """Read a usage field from a 1.x model, a 0.28 OpenAIObject or a plain dict"""
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def usage_tokens(usage):
+    """(prompt, completion, cached prompt) token counts of a response's usage, zero when missing"""
+    details = _field(usage, 'prompt_tokens_details')
+    return (
+        _field(usage, 'prompt_tokens') or 0,
+        _field(usage, 'completion_tokens') or 0,
+        _field(details, 'cached_tokens') or 0,
+    )
+
+
+def model_prices(model):
+    """Prices for the longest MODEL_PRICES prefix of `model`, or None for an unknown model"""
+    matches = [name for name in MODEL_PRICES if model and model.startswith(name)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+class Histogram:
+    """Fixed-bucket histogram; percentiles are interpolated within a bucket"""
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.bounds[i - 1] if i else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / bucket_count, self.max)
+            seen += bucket_count
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 1),
+            'p50': round(self.percentile(0.50), 1),
+            'p95': round(self.percentile(0.95), 1),
+            'p99': round(self.percentile(0.99), 1),
+            'max': round(self.max, 1),
+        }
+
+
+class MetricsRecorder:
+    """Aggregates latency, retries, token usage and estimated cost of Azure OpenAI requests.
+
+    The RateLimiter reports every request it runs, so queue wait (limiter
+    delays and 429 back-off), request latency and retries are measured where
+    they happen. Handlers report their invocations. With `log_path`, one
+    JSON line per request is appended there; with an exporter, every record
+    is also sent to OpenTelemetry.
+    """
+
+    def __init__(self, prices=None, log_path=None, exporter=None):
+        self.prices = prices
+        self.exporter = exporter
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        # Requests where Azure OpenAI reused a cached prompt prefix
+        self.cached_requests = 0
+        self.cost = 0.0
+        self.unpriced_requests = 0
+        self.queue_wait = Histogram()
+        self.latency = Histogram()
+        self.invocations = {}
+        self.startups = {}
+        self.preprocessed_tokens_before = 0
+        self.preprocessed_tokens_after = 0
+        self.tokens_saved = Histogram(TOKEN_BUCKETS)
+        self.hedged_calls = Histogram()
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadlines_exceeded = 0
+        self._lock = threading.Lock()
+        # Line buffered, so records from several processes appending to one file stay whole
+        self._log = open(log_path, 'a', buffering=1, encoding='utf-8') if log_path else None
+
+    def request_cost(self, prompt_tokens, completion_tokens, cached_tokens, model):
+        prices = self.prices or model_prices(model)
+        if not prices:
+            return None
+        input_price, cached_price, output_price = prices
+        return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+                + completion_tokens * output_price) / 1_000_000
+
+    def record_request(self, waited, latency, retries, usage=None, model=None, failed=False):
+        """Record one request: seconds queued, seconds for the final attempt, retries and usage"""
+        prompt_tokens, completion_tokens, cached_tokens = usage_tokens(usage)
+        cost = self.request_cost(prompt_tokens, completion_tokens, cached_tokens, model)
+        waited_ms, latency_ms = waited * 1000, latency * 1000
+        with self._lock:
+            self.requests += 1
+            self.failures += failed
+            self.retries += retries
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_tokens += cached_tokens
+            self.cached_requests += cached_tokens > 0
+            if cost is None:
+                self.unpriced_requests += not failed
+            else:
+                self.cost += cost
+            self.queue_wait.record(waited_ms)
+            if not failed:
+                self.latency.record(latency_ms)
+            if self._log:
+                self._log.write(json.dumps({
+                    'time': round(time.time(), 3), 'model': model, 'queue_wait_ms': round(waited_ms, 1),
+                    'latency_ms': round(latency_ms, 1), 'retries': retries, 'failed': failed,
+                    'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                    'cached_tokens': cached_tokens, 'cost_usd': cost,
+                }) + "\n")
+        if self.exporter:
+            self.exporter.request(waited_ms, latency_ms, retries, prompt_tokens, completion_tokens,
+                                  cached_tokens, cost, model, failed)
+
+    def record_invocation(self, name, seconds, tickets=1):
+        """Record one handler invocation that classified `tickets` tickets"""
+        with self._lock:
+            self.invocations.setdefault(name, Histogram()).record(seconds * 1000)
+        if self.exporter:
+            self.exporter.invocation(name, seconds * 1000, tickets)
+
+    def record_preprocessing(self, tokens_before, tokens_after):
+        """Record the description tokens of one ticket before and after preprocessing"""
+        with self._lock:
+            self.preprocessed_tokens_before += tokens_before
+            self.preprocessed_tokens_after += tokens_after
+            self.tokens_saved.record(tokens_before - tokens_after)
+        if self.exporter:
+            self.exporter.preprocessing(tokens_before - tokens_after)
+
+    def record_hedged_call(self, seconds, hedged, hedge_won, timed_out=False):
+        """Record one call made by a HedgedCaller, from its first attempt to the answer"""
+        with self._lock:
+            self.hedged_calls.record(seconds * 1000)
+            self.hedges += hedged
+            self.hedge_wins += hedge_won
+            self.deadlines_exceeded += timed_out
+        if self.exporter:
+            self.exporter.hedged_call(seconds * 1000, hedged, hedge_won, timed_out)
+
+    def record_startup(self, name, seconds):
+        """Record how long a handler module took to load in this worker"""
+        with self._lock:
+            self.startups[name] = seconds * 1000
+        if self.exporter:
+            self.exporter.startup(name, seconds * 1000)
+
+    def summary(self, tickets=None):
+        with self._lock:
+            summary = {
+                'requests': self.requests,
+                'failed_requests': self.failures,
+                'retries': self.retries,
+                'queue_wait_ms': self.queue_wait.summary(),
+                'latency_ms': self.latency.summary(),
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'cached_tokens': self.cached_tokens,
+                # Share of prompt tokens, and of requests, served from the prompt cache
+                'prompt_cache_hit_rate': round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+                'cached_requests': self.cached_requests,
+                'estimated_cost_usd': round(self.cost, 6),
+            }
+            if self.unpriced_requests:
+                summary['unpriced_requests'] = self.unpriced_requests
+            if tickets:
+                summary['cost_per_1000_tickets_usd'] = round(self.cost / tickets * 1000, 6)
+            for name, histogram in self.invocations.items():
+                summary[f'{name}_ms'] = histogram.summary()
+            if self.tokens_saved.count:
+                summary['preprocessing'] = {
+                    'tokens_before': self.preprocessed_tokens_before,
+                    'tokens_after': self.preprocessed_tokens_after,
+                    'tokens_saved_per_ticket': self.tokens_saved.summary(),
+                }
+            if self.hedged_calls.count:
+                summary['hedging'] = {
+                    'calls': self.hedged_calls.count,
+                    'hedged': self.hedges,
+                    'hedge_rate': round(self.hedges / self.hedged_calls.count, 4),
+                    'hedge_wins': self.hedge_wins,
+                    'deadlines_exceeded': self.deadlines_exceeded,
+                    'latency_ms': self.hedged_calls.summary(),
+                }
+            if self.startups:
+                summary['startup_ms'] = {name: round(ms, 1) for name, ms in self.startups.items()}
+            return summary
+
+    def format_summary(self, tickets=None):
+        """Human-readable end-of-run summary"""
+        s = self.summary(tickets)
+        lines = [
+            f"Azure OpenAI requests: {s['requests']} ({s['failed_requests']} failed, {s['retries']} retries after 429s or failover)",
+            f"  latency ms:    {s['latency_ms']}",
+            f"  queue wait ms: {s['queue_wait_ms']}",
+            f"  tokens: {s['prompt_tokens']} prompt ({s['cached_tokens']} cached, "
+            f"{s['prompt_cache_hit_rate']:.1%}; {s['cached_requests']} requests hit the prompt cache), "
+            f"{s['completion_tokens']} completion",
+            f"  estimated cost: ${s['estimated_cost_usd']:.4f}"
+            + (f" (${s['cost_per_1000_tickets_usd']:.4f} per 1000 tickets)" if tickets else ""),
+        ]
+        if s.get('preprocessing'):
+            saved = s['preprocessing']['tokens_saved_per_ticket']
+            lines.append(f"  preprocessing saved {s['preprocessing']['tokens_before'] - s['preprocessing']['tokens_after']} "
+                         f"description tokens over {saved['count']} tickets (mean {saved['mean']}, p95 {saved['p95']})")
+        if s.get('hedging'):
+            hedging = s['hedging']
+            lines.append(f"  hedged {hedging['hedged']} of {hedging['calls']} calls ({hedging['hedge_rate']:.1%}), "
+                         f"{hedging['hedge_wins']} answered by the hedge, {hedging['deadlines_exceeded']} past the "
+                         f"deadline; latency ms {hedging['latency_ms']}")
+        if s.get('unpriced_requests'):
+            lines.append(f"  {s['unpriced_requests']} requests to a model without a price were not costed")
+        return "\n".join(lines)
+
+    def close(self):
+        if self._log:
+            self._log.close()
+            self._log = None
+
+
+class OpenTelemetryExporter:
+    """Forwards records to OpenTelemetry instruments (Application Insights with azure-monitor-opentelemetry)"""
+
+    def __init__(self, meter):
+        self._queue_wait = meter.create_histogram("classification.queue_wait", unit="ms",
+                                                  description="Rate limiter and 429 back-off wait per request")
+        self._latency = meter.create_histogram("classification.request.duration", unit="ms",
+                                               description="Azure OpenAI request latency")
+        self._invocation = meter.create_histogram("classification.invocation.duration", unit="ms",
+                                                  description="Function handler duration")
+        self._startup = meter.create_histogram("classification.startup.duration", unit="ms",
+                                               description="Handler module load time per worker")
+        self._requests = meter.create_counter("classification.requests", description="Azure OpenAI requests")
+        self._retries = meter.create_counter("classification.retries", description="Requests retried after 429")
+        self._tokens = meter.create_counter("classification.tokens", unit="{token}")
+        self._cost = meter.create_counter("classification.cost", unit="USD", description="Estimated cost")
+        self._tickets = meter.create_counter("classification.tickets", description="Tickets classified")
+        self._tokens_saved = meter.create_histogram("classification.preprocess.tokens_saved", unit="{token}",
+                                                    description="Description tokens removed per ticket")
+        self._hedged_call = meter.create_histogram("classification.hedged_call.duration", unit="ms",
+                                                   description="Hedged call latency, first attempt to answer")
+
+    def request(self, waited_ms, latency_ms, retries, prompt_tokens, completion_tokens, cached_tokens, cost,
+                model, failed):
+        attributes = {'model': model or "unknown", 'failed': failed}
+        self._requests.add(1, attributes)
+        self._queue_wait.record(waited_ms, attributes)
+        if not failed:
+            self._latency.record(latency_ms, attributes)
+        if retries:
+            self._retries.add(retries, attributes)
+        for token_type, count in (('prompt', prompt_tokens - cached_tokens), ('cached', cached_tokens),
+                                  ('completion', completion_tokens)):
+            if count:
+                self._tokens.add(count, {**attributes, 'type': token_type})
+        if cost:
+            self._cost.add(cost, attributes)
+
+    def invocation(self, name, duration_ms, tickets):
+        self._invocation.record(duration_ms, {'handler': name})
+        self._tickets.add(tickets, {'handler': name})
+
+    def preprocessing(self, tokens_saved):
+        self._tokens_saved.record(tokens_saved)
+
+    def hedged_call(self, duration_ms, hedged, hedge_won, timed_out):
+        self._hedged_call.record(duration_ms, {'hedged': hedged, 'hedge_won': hedge_won, 'timed_out': timed_out})
+
+    def startup(self, name, duration_ms):
+        self._startup.record(duration_ms, {'handler': name})
+
+
+def get_opentelemetry_exporter():
+    """Exporter on the global OpenTelemetry meter, or None when opentelemetry is not installed.
+
+    With APPLICATIONINSIGHTS_CONNECTION_STRING set and azure-monitor-opentelemetry
+    installed, the meter provider is first configured to send to Application Insights.
+    """
+    try:
+        from opentelemetry import metrics as otel_metrics
+    except ImportError:
+        return None
+    if os.environ.get('APPLICATIONINSIGHTS_CONNECTION_STRING'):
+        try:
+            from azure.monitor.opentelemetry import configure_azure_monitor
+        except ImportError:
+            logging.warning("azure-monitor-opentelemetry is not installed; metrics stay in the OpenTelemetry "
+                            "meter provider configured for this process, if any")
+        else:
+            configure_azure_monitor()
+    return OpenTelemetryExporter(otel_metrics.get_meter("service-desk-tickets"))
+
+
+def prices_from_env():
+    """(input, cached input, output) USD per million tokens from OPENAI_PRICE_*_PER_1M, or None"""
+    names = ('OPENAI_PRICE_INPUT_PER_1M', 'OPENAI_PRICE_CACHED_INPUT_PER_1M', 'OPENAI_PRICE_OUTPUT_PER_1M')
+    if not os.environ.get(names[0]):
+        return None
+    input_price = float(os.environ[names[0]])
+    return (
+        input_price,
+        float(os.environ.get(names[1]) or input_price),
+        float(os.environ.get(names[2]) or 0.0),
+    )
+
+
+_shared_recorder = None
+_shared_recorder_lock = threading.Lock()
+
+
+def get_metrics_recorder():
+    """Process-wide recorder shared by every handler; CLASSIFY_METRICS_EXPORT=false keeps it local"""
+    global _shared_recorder
+    with _shared_recorder_lock:
+        if _shared_recorder is None:
+            export = os.environ.get('CLASSIFY_METRICS_EXPORT', 'true').lower() not in ('0', 'false', 'no')
+            _shared_recorder = MetricsRecorder(
+                prices=prices_from_env(),
+                exporter=get_opentelemetry_exporter() if export else None,
+            )
+        return _shared_recorder
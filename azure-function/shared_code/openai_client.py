@@ -0,0 +1,101 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+import openai
+
+from shared_code.cassette import get_cassette
+
+DEFAULT_TIMEOUT = 30.0
+CONNECT_TIMEOUT = 5.0
+DEFAULT_MAX_CONNECTIONS = 100
+KEEPALIVE_EXPIRY = 120.0
+
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _pool_options(max_connections, trust_env, asynchronous=False):
+    # Keep every connection alive between requests; churning them costs a TLS handshake each
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    options = {'limits': limits, 'timeout': httpx.Timeout(DEFAULT_TIMEOUT, connect=CONNECT_TIMEOUT),
+               'trust_env': trust_env}
+    cassette = get_cassette()
+    if cassette:
+        # Requests are recorded or replayed below the client, so retries, pacing and parsing run as usual
+        if asynchronous:
+            options['transport'] = cassette.async_transport(httpx.AsyncHTTPTransport(limits=limits, trust_env=trust_env))
+        else:
+            options['transport'] = cassette.transport(httpx.HTTPTransport(limits=limits, trust_env=trust_env))
+    return options
+
+
+def get_client(endpoint, api_key, api_version, max_connections=DEFAULT_MAX_CONNECTIONS, trust_env=True):
+    """Process-wide AzureOpenAI client for an endpoint, backed by a keep-alive pool.
+
+    The client is created once and reused for every ticket and invocation, so
+    TLS handshakes and connection setup happen once per connection rather
+    than once per request. httpx.Client is thread-safe. Retries are left to
+    the shared RateLimiter.
+    """
+    key = (endpoint, api_key, api_version)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = openai.AzureOpenAI(
+                api_key=api_key,
+                api_version=api_version,
+                azure_endpoint=endpoint,
+                max_retries=0,
+                http_client=httpx.Client(**_pool_options(max_connections, trust_env)),
+            )
+            _clients[key] = client
+        return client
+
+
+def get_async_client(endpoint, api_key, api_version, max_connections=DEFAULT_MAX_CONNECTIONS, trust_env=True):
+    """AsyncAzureOpenAI client shared by all tasks on the running event loop.
+
+    Async connections belong to the loop that opened them, so there is one
+    client per loop and endpoint rather than one per process.
+    """
+    loop = asyncio.get_running_loop()
+    key = (endpoint, api_key, api_version)
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = openai.AsyncAzureOpenAI(
+                api_key=api_key,
+                api_version=api_version,
+                azure_endpoint=endpoint,
+                max_retries=0,
+                http_client=httpx.AsyncClient(**_pool_options(max_connections, trust_env, asynchronous=True)),
+            )
+            clients[key] = client
+        return client
+
+
+async def close_async_clients():
+    """Close the clients of the running loop; call before the loop shuts down"""
+    with _lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+def get_client_from_env():
+    """Pooled client for the Function app, configured from the OPENAI_* settings"""
+    return get_client(
+        os.environ["OPENAI_ENDPOINT"],
+        os.environ["OPENAI_API_KEY"],
+        os.environ["OPENAI_API_VERSION"],
+        max_connections=int(os.environ.get('OPENAI_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS)),
+    )
@@ -0,0 +1,213 @@
+import functools
+import html
+import logging
+import os
+import re
+import threading
+
+from shared_code.metrics import get_metrics_recorder
+from shared_code.rate_limiter import estimate_tokens
+
+# Enough for the opening of any ticket; the rest rarely changes the category
+DEFAULT_MAX_TOKENS = 512
+DEFAULT_ENCODING = 'o200k_base'
+# Bump whenever the cleaning rules change so cached answers are not reused
+PREPROCESS_VERSION = "2"
+
+_SCRIPT_OR_STYLE = re.compile(r"<(script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_BLOCK_TAG = re.compile(r"<\s*(?:br|/p|/div|/li|/tr|/h[1-6])\b[^>]*>", re.IGNORECASE)
+_TAG = re.compile(r"</?[a-zA-Z][^<>]*>")
+_QUOTED_LINE = re.compile(r"^[ \t]*>.*(?:\n|$)", re.MULTILINE)
+# Everything after the start of a forwarded or quoted earlier message is dropped
+_REPLY_HEADER = re.compile(
+    r"^[ \t]*(?:-{2,}[ \t]*(?:Original|Forwarded) Message[ \t]*-{2,}"
+    r"|On\b[^\n]{0,200}\bwrote:"
+    r"|From:[^\n]*\n[ \t]*(?:Sent|Date):"
+    r"|_{10,}[ \t]*$)",
+    re.MULTILINE | re.IGNORECASE,
+)
+# A sign-off line starts the signature, which runs to the end
+_SIGN_OFF = re.compile(
+    r"^[ \t]*(?:--[ \t]*$"
+    r"|(?:kind|best|warm|many)?[ \t]*regards\b"
+    r"|(?:many )?thanks(?: and regards| in advance)?[ \t]*[,.!]?[ \t]*$"
+    r"|sent from my \w+)",
+    re.MULTILINE | re.IGNORECASE,
+)
+# Confidentiality notices and external-sender banners, up to the end of their paragraph
+_DISCLAIMER = re.compile(
+    r"(?:this (?:e-?mail|message)(?: and any (?:files|attachments)[^\n.]*)? (?:is|are|may be|contains?) "
+    r"(?:confidential|privileged|intended)"
+    r"|caution: this (?:e-?mail|message) (?:originated|was sent)"
+    r"|disclaimer:)"
+    r"[^\n]*(?:\n(?![ \t]*\n)[^\n]*)*",
+    re.IGNORECASE,
+)
+# Words one of which every _DISCLAIMER match contains; most tickets have none, so the regex is skipped
+_DISCLAIMER_WORDS = ('confidential', 'privileged', 'intended', 'originated', 'was sent', 'disclaimer')
+_WHITESPACE = re.compile(r"\s+")
+# A signature cut needs this much text before it, so a short "Thanks" ticket is kept
+_MIN_BODY_CHARS = 20
+# Characters per budgeted token scanned by the regexes; text past that would be cut anyway
+_SCAN_CHARS_PER_TOKEN = 8
+# Appended to a cut description; its tokens come out of the budget
+_TRUNCATION_MARKER = " ..."
+_TRUNCATION_MARKER_TOKENS = 2
+
+
+def clean_description(text):
+    """Strip HTML, quoted replies, signatures and disclaimers, and collapse whitespace"""
+    if '<' in text:
+        text = _SCRIPT_OR_STYLE.sub(" ", text)
+        text = _BLOCK_TAG.sub("\n", text)
+        text = _TAG.sub(" ", text)
+    if '&' in text:
+        text = html.unescape(text)
+    text = text.replace('\r\n', '\n')
+    match = _REPLY_HEADER.search(text)
+    if match and match.start() >= _MIN_BODY_CHARS:
+        text = text[:match.start()]
+    text = _QUOTED_LINE.sub("", text)
+    lowered = text.lower()
+    if any(word in lowered for word in _DISCLAIMER_WORDS):
+        text = _DISCLAIMER.sub(" ", text)
+    for match in _SIGN_OFF.finditer(text):
+        if match.start() >= _MIN_BODY_CHARS:
+            text = text[:match.start()]
+            break
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model):
+    """tiktoken encoding for `model` (or the default one), or None when tiktoken is unavailable"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(DEFAULT_ENCODING)
+        except KeyError:
+            # Deployment names are often not model names; counting is close enough with the default
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        # tiktoken downloads its encoding files on first use
+        logging.warning(f"Could not load a tokenizer, estimating description tokens instead: {e}")
+        return None
+
+
+def has_tokenizer(model=None):
+    """Whether tokens for `model` are counted exactly rather than estimated"""
+    return _encoding(model) is not None
+
+
+def count_tokens(text, model=None):
+    """Tokens in `text` for `model`, counted with tiktoken when it is installed, otherwise estimated"""
+    encoding = _encoding(model)
+    return len(encoding.encode(text)) if encoding else estimate_tokens(text)
+
+
+class DescriptionPreprocessor:
+    """Cleans ticket descriptions and cuts them to a token budget before they go into a prompt.
+
+    Tokens are counted with tiktoken when it is installed, otherwise with the
+    ~4 characters per token estimate. With a MetricsRecorder, the tokens
+    before and after preprocessing are recorded for every ticket.
+    """
+
+    def __init__(self, max_tokens=DEFAULT_MAX_TOKENS, clean=True, model=None, metrics=None):
+        self.max_tokens = max_tokens
+        self.clean = clean
+        self.model = model
+        self.metrics = metrics
+
+    @property
+    def version(self):
+        """Identifies what this preprocessor does to a description, for cache keys"""
+        encoding = _encoding(self.model)
+        counter = encoding.name if encoding else "estimate"
+        return f"{PREPROCESS_VERSION}-clean{int(self.clean)}-{self.max_tokens}-{counter}"
+
+    def count_tokens(self, text):
+        return count_tokens(text, self.model)
+
+    def truncate(self, text):
+        """Cut text to max_tokens, at a word boundary when there is one"""
+        encoding = _encoding(self.model)
+        budget = max(self.max_tokens - _TRUNCATION_MARKER_TOKENS, 1)
+        if encoding:
+            tokens = encoding.encode(text)
+            if len(tokens) <= self.max_tokens:
+                return text
+            text = encoding.decode(tokens[:budget])
+        else:
+            if estimate_tokens(text) <= self.max_tokens:
+                return text
+            text = text[:(budget - 1) * 4]
+        head, _, _ = text.rpartition(' ')
+        return (head or text) + _TRUNCATION_MARKER
+
+    def __call__(self, description):
+        if not description:
+            return description
+        text = description
+        if self.max_tokens:
+            # Long pasted logs are cut before cleaning, so the regexes don't scan text that is dropped
+            text = text[:self.max_tokens * _SCAN_CHARS_PER_TOKEN]
+        scanned = len(text)
+        if self.clean:
+            text = clean_description(text)
+        if self.max_tokens:
+            text = self.truncate(text)
+        if self.metrics:
+            # Only the scanned text is tokenized; the dropped rest of a long description is estimated
+            before = self.count_tokens(description[:scanned])
+            if scanned < len(description):
+                before += estimate_tokens(description[scanned:])
+            self.metrics.record_preprocessing(before, self.count_tokens(text))
+        return text
+
+
+_shared_preprocessor = None
+_shared_configured = False
+_shared_lock = threading.Lock()
+
+
+def set_preprocessor(preprocessor):
+    """Use `preprocessor` (None turns preprocessing off) for every prompt built in this process"""
+    global _shared_preprocessor, _shared_configured
+    with _shared_lock:
+        _shared_preprocessor = preprocessor
+        _shared_configured = True
+
+
+def get_preprocessor():
+    """Process-wide preprocessor configured from the environment, unless set_preprocessor was called.
+
+    CLASSIFY_PREPROCESS=false turns it off; CLASSIFY_MAX_DESCRIPTION_TOKENS
+    sets the budget (0 for no limit).
+    """
+    global _shared_preprocessor, _shared_configured
+    with _shared_lock:
+        if not _shared_configured:
+            if os.environ.get('CLASSIFY_PREPROCESS', 'true').lower() not in ('0', 'false', 'no'):
+                _shared_preprocessor = DescriptionPreprocessor(
+                    max_tokens=int(os.environ.get('CLASSIFY_MAX_DESCRIPTION_TOKENS', DEFAULT_MAX_TOKENS)),
+                    model=os.environ.get('OPENAI_MODEL'),
+                    metrics=get_metrics_recorder(),
+                )
+            _shared_configured = True
+        return _shared_preprocessor
+
+
+def preprocess_version():
+    """Version of the preprocessing in use, for cache keys; changes with its settings"""
+    preprocessor = get_preprocessor()
+    return preprocessor.version if preprocessor else "off"
+
+
+def prepare_description(description):
+    """The description as it should appear in a prompt"""
+    preprocessor = get_preprocessor()
+    return preprocessor(description) if preprocessor else description
@@ -0,0 +1,173 @@
+import hashlib
+import itertools
+import logging
+import os
+import threading
+
+from shared_code.categories import CATEGORIES, CATEGORY_CODES, NON_CATEGORY_VALUES
+from shared_code.preprocess import clean_description, count_tokens, prepare_description
+from shared_code.readers import TicketFileReader
+
+# Bump whenever the prompt wording or layout changes so cached answers are not reused
+PROMPT_VERSION = "2"
+
+# Azure OpenAI caches prompts from this many tokens, then in steps of PROMPT_CACHE_INCREMENT
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_INCREMENT = 128
+DEFAULT_MAX_EXAMPLES = 20
+# Characters kept from each few-shot example description
+EXAMPLE_MAX_CHARS = 400
+
+SYSTEM_MESSAGE = "You are a helpful assistant that classifies service desk tickets into predefined categories."
+
+
+def _instructions(codes):
+    if codes:
+        numbered = "\n".join(f"{code}. {category}" for code, category in CATEGORY_CODES.items())
+        return (f"Classify the service desk ticket in the next message into one of these numbered categories:\n"
+                f"{numbered}\n\nReply with the category number only.")
+    return (f"Classify the service desk ticket in the next message into one of these categories:\n"
+            f"{', '.join(CATEGORIES)}\n\nReply with the category name only.")
+
+
+class PromptLayout:
+    """Chat messages for one ticket, with everything static in a byte-stable prefix.
+
+    Azure OpenAI reuses the work on a prompt prefix it has seen recently,
+    reported as `cached_tokens` in the usage and billed at a discount, but
+    only for prompts of at least PROMPT_CACHE_MIN_TOKENS and only up to the
+    first byte that differs. So the system message carries the instructions,
+    the category list and any few-shot examples, and the ticket follows in
+    its own user message.
+
+    The static prefix is about 250 tokens, below the threshold. Few-shot
+    examples are the useful way to lengthen it. With `pad`, the prefix is
+    filled up to the threshold with a category reference list. That only
+    pays where cached tokens cost well under half the input price.
+    """
+
+    def __init__(self, examples=(), pad=False, codes=False, model=None):
+        self.codes = codes
+        parts = [SYSTEM_MESSAGE, _instructions(codes)]
+        if examples:
+            parts.append("Examples:\n\n" + "\n\n".join(
+                f"Ticket Description:\n{description}\n\nCategory:\n{self._answer(category)}"
+                for description, category in examples
+            ))
+        prefix = "\n\n".join(parts)
+        if pad:
+            prefix = self._pad(prefix, model)
+        self.prefix = prefix
+        self.prefix_tokens = count_tokens(prefix, model)
+        # Changes with the examples and padding as well as PROMPT_VERSION
+        self.version = f"{PROMPT_VERSION}-{hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:8]}"
+
+    def _answer(self, category):
+        if self.codes:
+            return next(code for code, name in CATEGORY_CODES.items() if name == category)
+        return category
+
+    def _pad(self, prefix, model):
+        # A little over the threshold, in case the service counts tokens differently
+        target = PROMPT_CACHE_MIN_TOKENS + PROMPT_CACHE_INCREMENT // 2
+        if count_tokens(prefix, model) >= target:
+            return prefix
+        lines = [prefix, "", "Category reference:"]
+        for code, category in itertools.cycle(CATEGORY_CODES.items()):
+            lines.append(f"{code}. {category}" if self.codes else f"- {category}")
+            if count_tokens("\n".join(lines), model) >= target:
+                break
+        return "\n".join(lines)
+
+    def messages(self, description):
+        return [
+            {"role": "system", "content": self.prefix},
+            {"role": "user", "content": f"Ticket Description:\n{prepare_description(description)}"},
+        ]
+
+
+def select_examples(rows, max_examples=DEFAULT_MAX_EXAMPLES, description_col="Description", category_col="Category"):
+    """Few-shot (description, category) pairs from classified rows, taking categories in turn.
+
+    Rows without a real category are skipped. Descriptions are cleaned and
+    cut to EXAMPLE_MAX_CHARS, so the examples stay short and byte-stable.
+    """
+    by_category = {}
+    for row in rows:
+        category = row.get(category_col)
+        description = clean_description(row.get(description_col) or "")[:EXAMPLE_MAX_CHARS]
+        if category in CATEGORIES and category not in NON_CATEGORY_VALUES and description:
+            by_category.setdefault(category, []).append(description)
+    examples = []
+    for batch in itertools.zip_longest(*by_category.values()):
+        for description, category in zip(batch, by_category):
+            if description is not None and len(examples) < max_examples:
+                examples.append((description, category))
+    return examples
+
+
+def load_examples(path, max_examples=DEFAULT_MAX_EXAMPLES):
+    """Few-shot examples from a classified export (CSV, JSON Lines or XLSX, possibly compressed)"""
+    with TicketFileReader(path) as reader:
+        return select_examples(reader, max_examples)
+
+
+_shared_layouts = None
+_shared_lock = threading.Lock()
+
+
+def _build_layouts(examples, pad, model):
+    layouts = {codes: PromptLayout(examples, pad=pad, codes=codes, model=model) for codes in (False, True)}
+    # Without examples the prefix is short by design; with them, say when they were not enough to be cached
+    shortest = min(layout.prefix_tokens for layout in layouts.values())
+    if examples and shortest < PROMPT_CACHE_MIN_TOKENS:
+        logging.warning(
+            f"The prompt prefix is {shortest} tokens with {len(examples)} few-shot examples, below the "
+            f"{PROMPT_CACHE_MIN_TOKENS} Azure OpenAI caches; add examples or turn on padding to get cached tokens"
+        )
+    return layouts
+
+
+def set_prompt_layouts(examples=(), pad=False, model=None):
+    """Use these examples and padding for every prompt built in this process"""
+    global _shared_layouts
+    layouts = _build_layouts(examples, pad, model)
+    with _shared_lock:
+        _shared_layouts = layouts
+
+
+def get_prompt_layout(codes=False):
+    """Process-wide layout configured from the environment, unless set_prompt_layouts was called.
+
+    CLASSIFY_FEW_SHOT_PATH names a classified export to take up to
+    CLASSIFY_FEW_SHOT_EXAMPLES examples from; CLASSIFY_PROMPT_PADDING=true
+    pads the prefix to the caching threshold.
+    """
+    global _shared_layouts
+    with _shared_lock:
+        if _shared_layouts is None:
+            path = os.environ.get('CLASSIFY_FEW_SHOT_PATH')
+            examples = ()
+            if path:
+                try:
+                    examples = load_examples(
+                        path, int(os.environ.get('CLASSIFY_FEW_SHOT_EXAMPLES', DEFAULT_MAX_EXAMPLES))
+                    )
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Could not load few-shot examples from {path}, prompting without them: {e}")
+            _shared_layouts = _build_layouts(
+                examples,
+                pad=os.environ.get('CLASSIFY_PROMPT_PADDING', 'false').lower() in ('1', 'true', 'yes'),
+                model=os.environ.get('OPENAI_MODEL'),
+            )
+        return _shared_layouts[codes]
+
+
+def prompt_version():
+    """Version of the prompt in use, for cache keys; changes with the examples and padding"""
+    return get_prompt_layout().version
+
+
+def build_messages(description):
+    """Chat messages asking for the category name of one ticket"""
+    return get_prompt_layout().messages(description)
@@ -0,0 +1,224 @@
+import asyncio
+import random
+import threading
+import time
+
+DEFAULT_REQUESTS_PER_MINUTE = 300
+DEFAULT_TOKENS_PER_MINUTE = 50000
+DEFAULT_MAX_RETRIES = 5
+MAX_BACKOFF_SECONDS = 60.0
+
+
+def estimate_tokens(text, max_tokens=0):
+    """Rough token estimate (~4 characters per token) used to budget requests"""
+    return len(text) // 4 + 1 + max_tokens
+
+
+def estimate_message_tokens(messages, max_tokens=0):
+    """estimate_tokens for a list of chat messages, with a few tokens of overhead per message"""
+    return sum(estimate_tokens(message['content']) + 3 for message in messages) + max_tokens
+
+
+def is_rate_limit_error(error):
+    """True for a 429 from either the 1.x (status_code) or 0.28 (http_status) SDK"""
+    status = getattr(error, 'status_code', None) or getattr(error, 'http_status', None)
+    return status == 429
+
+
+def is_server_error(error):
+    """True for a 5xx, a timeout or a connection failure: errors another deployment may not have"""
+    status = getattr(error, 'status_code', None) or getattr(error, 'http_status', None)
+    if status:
+        return status >= 500
+    return (isinstance(error, (ConnectionError, TimeoutError))
+            or type(error).__name__ in ('APIConnectionError', 'APITimeoutError', 'Timeout'))
+
+
+def error_headers(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers is None:
+        headers = getattr(error, 'headers', None)
+    return headers or {}
+
+
+def _header_number(headers, name):
+    value = headers.get(name) if headers else None
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(headers):
+    """Read retry-after-ms / retry-after from a response, in seconds"""
+    retry_after_ms = _header_number(headers, 'retry-after-ms')
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000.0
+    return _header_number(headers, 'retry-after')
+
+
+class _Bucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def rate(self):
+        return self.capacity / 60.0
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount):
+        deficit = min(amount, self.capacity) - self.level
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def observe_remaining(self, remaining):
+        # The deployment's real quota is larger than configured: use the headroom
+        if remaining > self.capacity:
+            self.capacity = remaining
+        self.level = min(self.capacity, remaining)
+
+
+class RateLimiter:
+    """Token bucket that budgets both requests/min and tokens/min.
+
+    Callers reserve capacity before each request and sleep for the returned
+    delay, so waiting callers are served in arrival order. The buckets are
+    corrected from the x-ratelimit-remaining-* headers of every response, and
+    a 429 pauses all callers for the retry-after period. Safe to share between
+    threads and asyncio tasks in one process. With a MetricsRecorder, every
+    request's queue wait, latency, retries and token usage are recorded.
+    """
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 max_retries=DEFAULT_MAX_RETRIES, metrics=None):
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self._requests = _Bucket(requests_per_minute)
+        self._tokens = _Bucket(tokens_per_minute)
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        # Successful requests and the time they took, excluding waits
+        self.completed = 0
+        self.request_seconds = 0.0
+
+    def reserve(self, tokens):
+        """Take one request and `tokens` tokens; return the seconds to wait first"""
+        with self._lock:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            delay = max(
+                self._blocked_until - now,
+                self._requests.wait_for(1),
+                self._tokens.wait_for(tokens),
+            )
+            self._requests.level -= 1
+            self._tokens.level -= tokens
+            return max(delay, 0.0)
+
+    def capacity_for(self, tokens):
+        """(seconds before a request of `tokens` could start, requests of that size the buckets hold now)"""
+        with self._lock:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            wait = max(
+                self._blocked_until - now,
+                self._requests.wait_for(1),
+                self._tokens.wait_for(tokens),
+            )
+            available = min(self._requests.level, self._tokens.level / max(tokens, 1))
+            return max(wait, 0.0), max(available, 0.0)
+
+    def update_from_headers(self, headers):
+        remaining_requests = _header_number(headers, 'x-ratelimit-remaining-requests')
+        remaining_tokens = _header_number(headers, 'x-ratelimit-remaining-tokens')
+        with self._lock:
+            now = time.monotonic()
+            if remaining_requests is not None:
+                self._requests.refill(now)
+                self._requests.observe_remaining(remaining_requests)
+            if remaining_tokens is not None:
+                self._tokens.refill(now)
+                self._tokens.observe_remaining(remaining_tokens)
+
+    def on_rate_limited(self, headers, attempt):
+        """Record a 429 and return the jittered delay before the next attempt"""
+        retry_after = retry_after_seconds(headers)
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, 1.0)
+        else:
+            delay = random.uniform(0, min(MAX_BACKOFF_SECONDS, 2.0 ** attempt))
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            self._requests.level = min(self._requests.level, 0.0)
+        return delay
+
+    def _record(self, seconds):
+        with self._lock:
+            self.completed += 1
+            self.request_seconds += seconds
+
+    def average_request_seconds(self):
+        return self.request_seconds / self.completed if self.completed else 0.0
+
+    def _report(self, queued_since, started, attempt, result=None, failed=False):
+        if not self.metrics:
+            return
+        now = time.monotonic()
+        # Queue wait covers limiter delays, 429 responses and back-off before the final attempt
+        self.metrics.record_request(
+            started - queued_since, now - started, attempt,
+            usage=getattr(result, 'usage', None), model=getattr(result, 'model', None), failed=failed,
+        )
+
+    def call(self, request, estimated_tokens):
+        """Run request() -> (result, headers) under the limiter, retrying 429s"""
+        queued_since = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            delay = self.reserve(estimated_tokens)
+            if delay:
+                time.sleep(delay)
+            started = time.monotonic()
+            try:
+                result, headers = request()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    self._report(queued_since, started, attempt, failed=True)
+                    raise
+                time.sleep(self.on_rate_limited(error_headers(e), attempt))
+                continue
+            self._record(time.monotonic() - started)
+            self._report(queued_since, started, attempt, result)
+            self.update_from_headers(headers)
+            return result
+
+    async def call_async(self, request, estimated_tokens):
+        """Async variant of call(); request() must return an awaitable"""
+        queued_since = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            delay = self.reserve(estimated_tokens)
+            if delay:
+                await asyncio.sleep(delay)
+            started = time.monotonic()
+            try:
+                result, headers = await request()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    self._report(queued_since, started, attempt, failed=True)
+                    raise
+                await asyncio.sleep(self.on_rate_limited(error_headers(e), attempt))
+                continue
+            self._record(time.monotonic() - started)
+            self._report(queued_since, started, attempt, result)
+            self.update_from_headers(headers)
+            return result
+
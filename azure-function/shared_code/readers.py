@@ -0,0 +1,381 @@
+import codecs
+import csv
+import gzip
+import io
+import itertools
+import json
+import shutil
+import tempfile
+import zlib
+
+from shared_code.streaming import CsvStreamReader
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+XLSX_MAGIC = b"PK\x03\x04"
+# Content-Encoding values the endpoints accept, and the compression each stands for
+CONTENT_ENCODINGS = {'': None, 'identity': None, 'gzip': 'gzip', 'x-gzip': 'gzip', 'zstd': 'zstd'}
+# Output files with these extensions are written compressed
+COMPRESSED_EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+# XLSX uploads are kept in memory up to this size, then spooled to a temporary file
+XLSX_SPOOL_BYTES = 32 * 1024 * 1024
+_WHITESPACE = b" \t\r\n\xef\xbb\xbf"
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd-compressed input needs the zstandard package") from None
+    return zstandard
+
+
+def _openpyxl():
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("XLSX input needs the openpyxl package") from None
+    return openpyxl
+
+
+def detect_compression(head):
+    """'gzip' or 'zstd' from the first bytes of a file, or None if it isn't compressed"""
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if head.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+
+def detect_format(head):
+    """'xlsx', 'jsonl' or 'csv' from the first (decompressed) bytes of an export"""
+    if head.startswith(XLSX_MAGIC):
+        return 'xlsx'
+    if head.lstrip(_WHITESPACE).startswith(b"{"):
+        return 'jsonl'
+    return 'csv'
+
+
+def content_encoding_compression(content_encoding):
+    """Compression named by a Content-Encoding header; raises ValueError for one that isn't supported"""
+    encoding = (content_encoding or "").strip().lower()
+    if encoding not in CONTENT_ENCODINGS:
+        raise ValueError(f"Unsupported Content-Encoding: {content_encoding}")
+    return CONTENT_ENCODINGS[encoding]
+
+
+def _field_value(value):
+    # Rows hold text, as they would if the export were a CSV
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+class Decompressor:
+    """Incremental gzip or zstd decompression; concatenated members or frames are read as one stream"""
+
+    def __init__(self, compression):
+        self.compression = compression
+        self._obj = self._new()
+        self._started = False
+
+    def _new(self):
+        if self.compression == 'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return _zstandard().ZstdDecompressor().decompressobj()
+
+    def close(self):
+        """Raise ValueError if the stream ended part way through a member or frame"""
+        if not self._obj.eof and self._started:
+            raise ValueError(f"Truncated {self.compression} stream")
+
+    def decompress(self, data):
+        output = []
+        while data:
+            self._started = True
+            output.append(self._obj.decompress(data))
+            if not self._obj.eof:
+                break
+            data = self._obj.unused_data
+            self._obj = self._new()
+            self._started = False
+        return b"".join(output)
+
+
+class JsonlStreamReader:
+    """Incremental reader for JSON Lines (one object per line) with the CsvStreamReader interface.
+
+    `fieldnames` are the keys of the first object. Later objects missing a
+    key get None for it, like csv.DictReader, and keys the first object
+    didn't have are dropped.
+    """
+
+    def __init__(self, encoding='utf-8-sig'):
+        self.fieldnames = None
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._partial = ""
+
+    def feed(self, data):
+        lines = (self._partial + self._decoder.decode(data)).split("\n")
+        self._partial = lines.pop()
+        return self.parse_lines(lines)
+
+    def close(self):
+        lines = [self._partial + self._decoder.decode(b"", final=True)]
+        self._partial = ""
+        return self.parse_lines(lines)
+
+    def parse_lines(self, lines):
+        rows = []
+        for line in lines:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if self.fieldnames is None:
+                self.fieldnames = list(record)
+            rows.append({name: _field_value(record[name]) if name in record else None
+                         for name in self.fieldnames})
+        return rows
+
+
+class XlsxStreamReader:
+    """Reader for an XLSX workbook's first sheet with the CsvStreamReader interface.
+
+    A workbook is a zip archive with its index at the end, so the upload is
+    kept (spooled to a temporary file beyond XLSX_SPOOL_BYTES) until close().
+    The sheet is then read a row at a time in openpyxl's read-only mode.
+    """
+
+    def __init__(self):
+        self.fieldnames = None
+        self._file = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_BYTES)
+
+    def feed(self, data):
+        self._file.write(data)
+        return []
+
+    def close(self):
+        self._file.seek(0)
+        return self.read(self._file)
+
+    def read(self, file):
+        """Set `fieldnames` from the header row and return an iterator over the other rows"""
+        try:
+            workbook = _openpyxl().load_workbook(file, read_only=True, data_only=True)
+        except Exception:
+            self._file.close()
+            raise
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            workbook.close()
+            self._file.close()
+            return iter(())
+        self.fieldnames = [_field_value(name) for name in header]
+        return self._iter_rows(workbook, rows)
+
+    def _iter_rows(self, workbook, rows):
+        try:
+            for values in rows:
+                if all(value is None for value in values):
+                    continue
+                yield {name: _field_value(value) for name, value in zip(self.fieldnames, values)}
+        finally:
+            workbook.close()
+            self._file.close()
+
+
+class TicketStreamReader:
+    """Incremental reader for ticket exports in any supported format.
+
+    Compression (gzip or zstd) and then the format (CSV, JSON Lines or XLSX)
+    are recognised from the first bytes, so a ServiceNow export can be sent
+    as it was downloaded. A Content-Encoding header is checked against what
+    is supported; the data itself decides. Otherwise behaves like
+    CsvStreamReader: feed() and close() return parsed rows, and `fieldnames`
+    is set once the header has been read.
+    """
+
+    def __init__(self, content_encoding=None):
+        content_encoding_compression(content_encoding)
+        self.compression = None
+        self.format = None
+        self._sniffed = False
+        self._decompressor = None
+        self._reader = None
+        self._raw = b""
+        self._head = b""
+
+    @property
+    def fieldnames(self):
+        return self._reader.fieldnames if self._reader else None
+
+    def feed(self, data):
+        if not self._sniffed:
+            # Buffer until there are enough bytes to recognise the compression
+            self._raw += data
+            if len(self._raw) < len(ZSTD_MAGIC):
+                return []
+            data = self._start_decompression()
+        elif self._decompressor:
+            data = self._decompressor.decompress(data)
+        return self._parse(data)
+
+    def close(self):
+        rows = self._parse(b"" if self._sniffed else self._start_decompression(), final=True)
+        if self._decompressor:
+            self._decompressor.close()
+        return itertools.chain(rows, self._reader.close())
+
+    def _start_decompression(self):
+        data, self._raw = self._raw, b""
+        self._sniffed = True
+        self.compression = detect_compression(data)
+        if self.compression:
+            self._decompressor = Decompressor(self.compression)
+            data = self._decompressor.decompress(data)
+        return data
+
+    def _parse(self, data, final=False):
+        if self._reader is None:
+            # Likewise for the format, once decompressed
+            self._head += data
+            if not final and len(self._head.lstrip(_WHITESPACE)) < len(XLSX_MAGIC):
+                return []
+            data, self._head = self._head, b""
+            self._start(detect_format(data))
+        return self._reader.feed(data)
+
+    def _start(self, input_format):
+        self.format = input_format
+        if input_format == 'xlsx':
+            self._reader = XlsxStreamReader()
+        elif input_format == 'jsonl':
+            self._reader = JsonlStreamReader()
+        else:
+            self._reader = CsvStreamReader()
+
+    def iter_rows(self, chunks):
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        yield from self.close()
+
+    async def aiter_rows(self, chunks):
+        async for chunk in chunks:
+            for row in self.feed(chunk):
+                yield row
+        for row in self.close():
+            yield row
+
+
+class TicketFileReader:
+    """csv.DictReader-like reader for a ticket export on disk, in any format TicketStreamReader reads.
+
+    CSV and JSON Lines are decompressed and parsed as they are read, so a
+    large compressed export is never held in memory or written out
+    uncompressed. A compressed XLSX workbook is decompressed to a temporary
+    file first, because reading one means seeking about in it. Use as a
+    context manager, or call close().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.compression = detect_compression(f.read(len(ZSTD_MAGIC)))
+        if self.compression == 'gzip':
+            binary = gzip.open(path, 'rb')
+        elif self.compression == 'zstd':
+            raw = open(path, 'rb')
+            binary = io.BufferedReader(_zstandard().ZstdDecompressor().stream_reader(
+                raw, read_across_frames=True, closefd=True
+            ))
+        else:
+            binary = open(path, 'rb')
+        self._file = binary
+        try:
+            self._open(binary)
+        except Exception:
+            self._file.close()
+            raise
+
+    def _open(self, binary):
+        self.format = detect_format(binary.peek(64)[:64])
+        if self.format == 'xlsx':
+            xlsx = XlsxStreamReader()
+            if self.compression:
+                # Spooled like an upload; a decompressing stream can't seek back
+                self._file = xlsx._file
+                try:
+                    shutil.copyfileobj(binary, self._file)
+                finally:
+                    binary.close()
+                self._file.seek(0)
+            self._rows = xlsx.read(self._file)
+            self.fieldnames = xlsx.fieldnames
+            return
+        self._file = io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+        if self.format == 'jsonl':
+            jsonl = JsonlStreamReader()
+            self._rows = (row for line in self._file for row in jsonl.parse_lines([line]))
+            first_row = next(self._rows, None)
+            self.fieldnames = jsonl.fieldnames
+            if first_row is not None:
+                self._rows = itertools.chain([first_row], self._rows)
+        else:
+            self._rows = csv.DictReader(self._file)
+            self.fieldnames = self._rows.fieldnames
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def compression_for_path(path):
+    """'gzip' for a .gz path, 'zstd' for .zst, otherwise None"""
+    for extension, compression in COMPRESSED_EXTENSIONS.items():
+        if path.lower().endswith(extension):
+            return compression
+    return None
+
+
+def open_output_file(path, mode='w', compression=None):
+    """Text file for csv.writer, gzip or zstd compressed when `compression` says so"""
+    if compression == 'gzip':
+        return gzip.open(path, mode + 't', newline='', encoding='utf-8')
+    if compression == 'zstd':
+        return _zstandard().open(path, mode + 't', newline='', encoding='utf-8')
+    return open(path, mode, newline='', encoding='utf-8')
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header allows a gzip-compressed response"""
+    return 'gzip' in {part.split(';')[0].strip().lower() for part in (accept_encoding or "").split(',')}
+
+
+def compress_body(body, accept_encoding):
+    """(body, Content-Encoding) for a response, gzip-compressed when the client accepts it"""
+    if accepts_gzip(accept_encoding):
+        return gzip.compress(body.encode('utf-8') if isinstance(body, str) else body, compresslevel=6), 'gzip'
+    return body, None
+
+
+def iter_gzip(texts):
+    """Gzip-compress a stream of text, yielding the compressed bytes as they are produced"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for text in texts:
+        data = compressor.compress(text.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,251 @@
+import base64
+import codecs
+import csv
+import io
+import json
+import os
+from urllib.parse import quote
+
+import httpx
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+BLOCK_SIZE = 4 * 1024 * 1024
+BLOB_API_VERSION = "2021-08-06"
+# Largest export classify_tickets answers in one response body; the result is built in memory
+DEFAULT_MAX_RESPONSE_BYTES = 32 * 1024 * 1024
+
+
+class CsvRecordSplitter:
+    """Splits a stream of CSV text into complete records.
+
+    A record ends at a newline that is outside quotes, so fields with quoted
+    newlines stay in one record. Escaped quotes ("") keep the quote count
+    even, which is all the parity check needs.
+    """
+
+    def __init__(self):
+        self._pending = []
+        self._quotes = 0
+        self._partial = ""
+
+    def feed(self, text):
+        records = []
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._pending.append(line + "\n")
+            self._quotes += line.count('"')
+            if self._quotes % 2 == 0:
+                records.append("".join(self._pending))
+                self._pending = []
+                self._quotes = 0
+        return records
+
+    def close(self):
+        record = "".join(self._pending) + self._partial
+        self._pending, self._quotes, self._partial = [], 0, ""
+        return [record] if record.strip() else []
+
+
+class CsvStreamReader:
+    """Incremental replacement for csv.DictReader over a stream of bytes.
+
+    Memory use is bounded by the largest record rather than the file size.
+    `fieldnames` is set once the header record has been read.
+    """
+
+    def __init__(self, encoding='utf-8-sig'):
+        self.fieldnames = None
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._splitter = CsvRecordSplitter()
+
+    def feed(self, data):
+        return self._rows(self._splitter.feed(self._decoder.decode(data)))
+
+    def close(self):
+        records = self._splitter.feed(self._decoder.decode(b"", final=True)) + self._splitter.close()
+        return self._rows(records)
+
+    def _rows(self, records):
+        rows = []
+        for record in records:
+            values = next(csv.reader([record]), [])
+            if not values:
+                continue
+            if self.fieldnames is None:
+                self.fieldnames = values
+                continue
+            row = dict(zip(self.fieldnames, values))
+            # Same short/long row handling as csv.DictReader
+            if len(values) > len(self.fieldnames):
+                row[None] = values[len(self.fieldnames):]
+            for name in self.fieldnames[len(values):]:
+                row[name] = None
+            rows.append(row)
+        return rows
+
+    def iter_rows(self, chunks):
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        yield from self.close()
+
+    async def aiter_rows(self, chunks):
+        async for chunk in chunks:
+            for row in self.feed(chunk):
+                yield row
+        for row in self.close():
+            yield row
+
+
+class CsvRowFormatter:
+    """Formats rows one at a time as CSV text"""
+
+    media_type = "text/csv"
+
+    def __init__(self, fieldnames):
+        self._buffer = io.StringIO()
+        self._writer = csv.DictWriter(self._buffer, fieldnames=fieldnames)
+
+    def _take(self):
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return text
+
+    def header(self):
+        self._writer.writeheader()
+        return self._take()
+
+    def row(self, row):
+        self._writer.writerow(row)
+        return self._take()
+
+
+class NdjsonRowFormatter:
+    """Formats rows one at a time as newline-delimited JSON"""
+
+    media_type = "application/x-ndjson"
+
+    def __init__(self, fieldnames):
+        self.fieldnames = fieldnames
+
+    def header(self):
+        return ""
+
+    def row(self, row):
+        return json.dumps({name: row.get(name) for name in self.fieldnames}, ensure_ascii=False) + "\n"
+
+
+def get_formatter(output_format, fieldnames):
+    """CSV (default) or NDJSON formatter for the ?format= query parameter"""
+    if (output_format or "csv").lower() == "ndjson":
+        return NdjsonRowFormatter(fieldnames)
+    return CsvRowFormatter(fieldnames)
+
+
+def iter_bytes(data, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Slice an in-memory body into chunks without copying it"""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size].tobytes()
+
+
+def iter_blob_chunks(blob_url, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream a blob from its SAS URL"""
+    with httpx.stream("GET", blob_url, timeout=60.0) as response:
+        response.raise_for_status()
+        yield from response.iter_bytes(chunk_size)
+
+
+def max_response_bytes():
+    """CLASSIFY_MAX_RESPONSE_BYTES: the largest export returned in a response body, 0 for no limit"""
+    return int(os.environ.get('CLASSIFY_MAX_RESPONSE_BYTES', DEFAULT_MAX_RESPONSE_BYTES))
+
+
+class ResponseTooLarge(ValueError):
+    """The result would be built in memory but is over max_response_bytes()"""
+
+    def __init__(self, max_bytes):
+        super().__init__(
+            f"The export is more than the {max_bytes} bytes returned in one response "
+            f"(CLASSIFY_MAX_RESPONSE_BYTES). Pass output_blob_url or submit it to /api/jobs"
+        )
+
+
+def buffer_rows(rows, max_bytes):
+    """List of rows, raising ResponseTooLarge as soon as their text passes max_bytes.
+
+    The rows are counted after decompression, so a small gzip or zstd upload
+    that expands past the limit is refused before any of it is classified.
+    """
+    buffered = []
+    size = 0
+    for row in rows:
+        # Field text plus a separator per field, about what the row takes in the CSV
+        size += len(row) + sum(len(value) for value in row.values() if isinstance(value, str))
+        if size > max_bytes:
+            raise ResponseTooLarge(max_bytes)
+        buffered.append(row)
+    return buffered
+
+
+def join_limited(texts, max_bytes):
+    """Join texts, raising ResponseTooLarge as soon as they pass max_bytes (0 for no limit)"""
+    parts = []
+    size = 0
+    for text in texts:
+        size += len(text)
+        if max_bytes and size > max_bytes:
+            raise ResponseTooLarge(max_bytes)
+        parts.append(text)
+    return "".join(parts)
+
+
+async def aiter_blob_chunks(blob_url, chunk_size=DEFAULT_CHUNK_SIZE):
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        async with client.stream("GET", blob_url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                yield chunk
+
+
+def _with_query(url, query):
+    return url + ("&" if "?" in url else "?") + query
+
+
+class BlockBlobWriter:
+    """Writes text to a block blob through its SAS URL, one 4 MB block at a time"""
+
+    def __init__(self, blob_url, content_type="text/csv"):
+        self.blob_url = blob_url
+        self.content_type = content_type
+        self._client = httpx.Client(timeout=60.0, headers={"x-ms-version": BLOB_API_VERSION})
+        self._buffer = bytearray()
+        self._block_ids = []
+
+    def write(self, text):
+        self._buffer.extend(text.encode('utf-8'))
+        if len(self._buffer) >= BLOCK_SIZE:
+            self._put_block()
+
+    def _put_block(self):
+        block_id = base64.b64encode(f"{len(self._block_ids):08d}".encode('ascii')).decode('ascii')
+        response = self._client.put(
+            _with_query(self.blob_url, f"comp=block&blockid={quote(block_id, safe='')}"),
+            content=bytes(self._buffer)
+        )
+        response.raise_for_status()
+        self._block_ids.append(block_id)
+        self._buffer.clear()
+
+    def close(self):
+        if self._buffer or not self._block_ids:
+            self._put_block()
+        block_list = "".join(f"<Latest>{block_id}</Latest>" for block_id in self._block_ids)
+        response = self._client.put(
+            _with_query(self.blob_url, "comp=blocklist"),
+            content=f'<?xml version="1.0" encoding="utf-8"?><BlockList>{block_list}</BlockList>',
+            headers={"x-ms-blob-content-type": self.content_type}
+        )
+        response.raise_for_status()
+        self._client.close()
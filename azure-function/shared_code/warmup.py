@@ -0,0 +1,31 @@
+import logging
+import os
+import threading
+import time
+
+
+def warm_up(client):
+    """Open a pooled connection to the endpoint so DNS, TCP and TLS are done before the first ticket.
+
+    Lists the resource's models, which uses no tokens. An error response still
+    leaves the connection in the pool. Returns the seconds taken.
+    """
+    started = time.perf_counter()
+    try:
+        client.models.list()
+    except Exception as e:
+        logging.warning(f"Warm-up request failed: {e}")
+    elapsed = time.perf_counter() - started
+    logging.info(f"Warmed up the Azure OpenAI connection in {elapsed * 1000:.0f} ms")
+    return elapsed
+
+
+def warm_up_on_load_enabled():
+    """CLASSIFY_WARMUP_ON_LOAD=true warms the connection when a handler module is loaded"""
+    return os.environ.get('CLASSIFY_WARMUP_ON_LOAD', '').lower() in ('1', 'true', 'yes')
+
+
+def start_warm_up(clients):
+    """Run warm_up for each client on a background thread, so loading the handler isn't held up"""
+    for client in clients:
+        threading.Thread(target=warm_up, args=(client,), daemon=True).start()
@@ -0,0 +1,12 @@
+import logging
+import azure.functions as func
+
+from shared_code.deployment_pool import get_deployment_pool
+from shared_code.warmup import warm_up
+
+
+def main(warmupContext: func.Context) -> None:
+    # Runs on each new instance before it takes traffic (Premium and Dedicated plans only)
+    logging.info('Warming up a new instance')
+    for client in get_deployment_pool().clients():
+        warm_up(client)
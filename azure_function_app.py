@@ -1,137 +1,244 @@
+import time
+
+# Module load time is logged once per worker; it is the cold-start cost every first request pays
+_load_started = time.perf_counter()
+
 import azure.functions as func
+import asyncio
 import logging
-import csv
 import os
 import io
-import tempfile
 import json
-import time
-from openai import AzureOpenAI
+import itertools
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Helpers shared with the Function app live in azure-function/shared_code
+FUNCTION_APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "azure-function")
+if FUNCTION_APP_DIR not in sys.path:
+    sys.path.append(FUNCTION_APP_DIR)
+
+from shared_code.batching import (
+    batch_items_error,
+    classify_descriptions,
+    classify_in_batch,
+    classify_rows_in_batches,
+)
+from shared_code.cache import get_classification_cache
+from shared_code.category_codes import (
+    build_code_messages,
+    category_codes_enabled,
+    category_from_reply,
+    code_request_options,
+)
+from shared_code.deployment_pool import get_deployment_pool
+from shared_code.hedging import get_hedged_caller
+from shared_code.jobs import (
+    DEFAULT_CHUNK_ROWS,
+    InMemoryJobStorage,
+    get_job_storage,
+    iter_job_result,
+    job_status,
+    record_poisoned_chunk,
+    run_chunk,
+    start_local_workers,
+    submit_job,
+)
+from shared_code.local_classifier import get_local_classifier
+from shared_code.metrics import get_metrics_recorder
+from shared_code.prompts import build_messages
+from shared_code.rate_limiter import estimate_message_tokens
+from shared_code.readers import TicketStreamReader, accepts_gzip, compress_body, iter_gzip
+from shared_code.streaming import (
+    BlockBlobWriter,
+    ResponseTooLarge,
+    aiter_blob_chunks,
+    buffer_rows,
+    get_formatter,
+    iter_blob_chunks,
+    iter_bytes,
+    join_limited,
+    max_response_bytes,
+)
+from shared_code.warmup import start_warm_up, warm_up, warm_up_on_load_enabled
+
+try:
+    # HTTP response streaming needs the azurefunctions-extensions-http-fastapi package
+    from azurefunctions.extensions.http.fastapi import JSONResponse, PlainTextResponse, Request, StreamingResponse
+except ImportError:
+    JSONResponse = PlainTextResponse = Request = StreamingResponse = None
 
 app = func.FunctionApp()
 
-# Define categories
-CATEGORIES = [
-    "NHSUK Spam/Marketing",
-    "NHSUK Profiles",
-    "NHSuk Unsupported Service",
-    "NHSUK Content Management Service",
-    "NHSUK Data Services - Directories",
-    "NHSUK Ratings & Reviews",
-    "NHSuk Generic Service",
-    "NHSUK Data Services - GDoS",
-    "NHSUK Personal Medical Query",
-    "NHSUK Find A Service",
-    "NHSUK Syndication",
-    "NHSUK Health Assessment Tools",
-    "NHSUK Internal Tech Request",
-    "NHSUK Find Your NHS Number",
-    "Z_Retired P0 & P5 Web Service",
-    "NBS Q-Flow Acct Mgmt",
-    "NSD Unsupported Service",
-    "NBS Patient Journey",
-    "NHSUK Give Us Feedback Form",
-    "NHSUK Campaigns",
-    "Patient Facing",
-    "Profile manager (GP Reg)",
-    "NHS App National Services",
-    "GeneralPracticeAnnualSelfDeclaration-eDec",
-    "NHSUK Authenticated Website",
-    "Post event message to GP",
-    "CSF – Junk NSD"
-]
-
-def classify_ticket(description, openai_client):
-    """Classify a ticket using Azure OpenAI"""
-    prompt = f"""
-Classify the following service desk ticket into one of these categories:
-{', '.join(CATEGORIES)}
-
-Ticket Description:
-{description}
-
-Category:
-"""
-    try:
-        response = openai_client.chat.completions.create(
-            model=os.environ["OPENAI_MODEL"],
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=20,
-            temperature=0
+# One deployment pool, cache and metrics recorder per worker process, shared by every invocation
+deployment_pool = get_deployment_pool()
+metrics_recorder = get_metrics_recorder()
+classification_cache = get_classification_cache()
+local_classifier = get_local_classifier()
+# Latency mode for classify_single: a deadline per ticket and a hedged duplicate for slow requests
+hedged_caller = get_hedged_caller()
+
+# Rows classified at once by the streaming endpoint
+STREAM_CONCURRENCY = int(os.environ.get('CLASSIFY_STREAM_CONCURRENCY', '8'))
+
+# Requests in flight at once for classify_batch, and the most items it takes per call
+BATCH_CONCURRENCY = int(os.environ.get('CLASSIFY_BATCH_CONCURRENCY', '8'))
+BATCH_MAX_ITEMS = int(os.environ.get('CLASSIFY_BATCH_MAX_ITEMS', '1000'))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix='classify_batch')
+
+# Ask for a category number with a 1-2 token reply instead of the full name
+USE_CATEGORY_CODES = category_codes_enabled()
+
+def classify_ticket(description, hedge=False):
+    """Classify a ticket using Azure OpenAI; `hedge` uses the latency mode when it is enabled"""
+    model = os.environ["OPENAI_MODEL"]
+    if classification_cache:
+        category = classification_cache.get(description, model)
+        if category:
+            return category
+    # Obvious tickets are answered in-process without an API call
+    category = local_classifier.classify(description) if local_classifier else None
+    if category:
+        return category
+
+    if USE_CATEGORY_CODES:
+        messages, options = build_code_messages(description), code_request_options(model)
+    else:
+        messages, options = build_messages(description), {'max_tokens': 20}
+
+    def request(deployment):
+        raw = deployment.client.chat.completions.with_raw_response.create(
+            model=deployment.model,
+            messages=messages,
+            temperature=0,
+            **options
+        )
+        return raw.parse(), raw.headers
+
+    async def request_async(deployment):
+        # Hedged attempts run as tasks, so the one that loses can be cancelled
+        raw = await deployment.async_client().chat.completions.with_raw_response.create(
+            model=deployment.model,
+            messages=messages,
+            temperature=0,
+            **options
         )
-        category = response.choices[0].message.content.strip()
+        return raw.parse(), raw.headers
+
+    try:
+        estimated_tokens = estimate_message_tokens(messages, max_tokens=options['max_tokens'])
+        if hedge and hedged_caller:
+            response = hedged_caller.call(request_async, estimated_tokens)
+        else:
+            response = deployment_pool.call(request, estimated_tokens)
+        category = category_from_reply(response.choices[0].message.content)
+        if classification_cache:
+            classification_cache.put(description, model, category)
         return category
     except Exception as e:
         logging.error(f"Error classifying ticket: {str(e)}")
         return "Classification Error"
 
+def classify_ticket_batch(descriptions):
+    """Classify several tickets in one request; bad or missing answers are retried one at a time"""
+    return classify_in_batch(descriptions, os.environ["OPENAI_MODEL"], deployment_pool, classify_ticket,
+                             classification_cache, local_classifier)
+
+def classify_rows(rows, batch_size=1):
+    """Yield each row with its Category set, sending up to batch_size tickets per request"""
+    return classify_rows_in_batches(rows, classify_ticket, classify_ticket_batch, batch_size)
+
 @app.route(route="classify_tickets", auth_level=func.AuthLevel.FUNCTION)
 def classify_tickets(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processing a request.')
+    started = time.monotonic()
     
     try:
-        # Get the request body
-        req_body = req.get_body()
-        
-        # Check if there's a file in the request
-        if not req_body:
-            return func.HttpResponse(
-                "Please pass a CSV file in the request body",
-                status_code=400
-            )
-        
-        # Create Azure OpenAI client
-        client = AzureOpenAI(
-            api_key=os.environ["OPENAI_API_KEY"],
-            api_version=os.environ["OPENAI_API_VERSION"],
-            azure_endpoint=os.environ["OPENAI_ENDPOINT"],
-            timeout=30.0
-        )
-        
-        # Process the CSV file
-        input_stream = io.StringIO(req_body.decode('utf-8'))
-        output_stream = io.StringIO()
-        
-        reader = csv.DictReader(input_stream)
+        # Stream the CSV from a blob SAS URL for very large files, otherwise from the body
+        blob_url = req.params.get('blob_url')
+        if blob_url:
+            chunks = iter_blob_chunks(blob_url)
+        else:
+            req_body = req.get_body()
+            
+            # Check if there's a file in the request
+            if not req_body:
+                return func.HttpResponse(
+                    "Please pass a CSV file in the request body",
+                    status_code=400
+                )
+            chunks = iter_bytes(req_body)
+
+        output_blob_url = req.params.get('output_blob_url')
+
+        # Parse the export incrementally rather than decoding it all up front; CSV, JSON Lines
+        # or XLSX, gzip or zstd compressed
+        try:
+            reader = TicketStreamReader(None if blob_url else req.headers.get('Content-Encoding'))
+        except ValueError as e:
+            return func.HttpResponse(str(e), status_code=415)
+        rows = reader.iter_rows(chunks)
+        first_row = next(rows, None)
         
         # Check for Description column
-        if 'Description' not in reader.fieldnames:
+        if not reader.fieldnames or 'Description' not in reader.fieldnames:
             return func.HttpResponse(
-                "CSV must contain a 'Description' column",
+                "The export must contain a 'Description' column",
                 status_code=400
             )
+        if first_row is not None:
+            rows = itertools.chain([first_row], rows)
             
-        fieldnames = reader.fieldnames + ['Category']
-        writer = csv.DictWriter(output_stream, fieldnames=fieldnames)
-        writer.writeheader()
+        # CSV by default, or NDJSON with ?format=ndjson
+        formatter = get_formatter(req.params.get('format'), reader.fieldnames + ['Category'])
+
+        # With ?output_blob_url= results go to the blob block by block, keeping memory flat
+        output = BlockBlobWriter(output_blob_url, formatter.media_type) if output_blob_url else io.StringIO()
+        output.write(formatter.header())
         
         # Get optional limit parameter
         limit = req.params.get('limit')
         limit = int(limit) if limit else None
-        
+        rows = itertools.islice(rows, limit) if limit else rows
+
+        # Without ?output_blob_url= the whole result is built in memory; larger exports are sent elsewhere
+        # before any row is classified
+        max_bytes = max_response_bytes()
+        if not output_blob_url and max_bytes:
+            try:
+                rows = buffer_rows(rows, max_bytes)
+            except ResponseTooLarge as e:
+                return func.HttpResponse(str(e), status_code=413)
+
+        # Optional multi-ticket prompts: up to batch_size tickets per request
+        batch_size = int(req.params.get('batch_size') or os.environ.get('CLASSIFY_BATCH_SIZE', '1'))
+
         count = 0
-        for row in reader:
-            # Check if we've reached the limit
-            if limit and count >= limit:
-                break
-                
-            description = row.get('Description', '')
-            if description:
-                category = classify_ticket(description, client)
-                # Add a small delay to avoid rate limits
-                time.sleep(0.5)
-            else:
-                category = "No Description"
-                
-            row['Category'] = category
-            writer.writerow(row)
+        for row in classify_rows(rows, batch_size):
+            output.write(formatter.row(row))
             count += 1
+        elapsed = time.monotonic() - started
+        metrics_recorder.record_invocation('classify_tickets', elapsed, count)
+        logging.info(f"Classified {count} tickets in {elapsed:.1f}s; totals for this worker: "
+                     f"{json.dumps(metrics_recorder.summary())}")
+
+        if output_blob_url:
+            output.close()
+            return func.HttpResponse(
+                json.dumps({"rows": count, "output_blob": output_blob_url.split('?')[0]}),
+                mimetype="application/json",
+                status_code=200
+            )
         
         # Return the processed CSV
+        # Compressed when the caller accepts gzip
+        body, content_encoding = compress_body(output.getvalue(), req.headers.get('Accept-Encoding'))
         return func.HttpResponse(
-            output_stream.getvalue(),
-            mimetype="text/csv",
-            status_code=200
+            body,
+            mimetype=formatter.media_type,
+            status_code=200,
+            headers={'Content-Encoding': content_encoding} if content_encoding else None
         )
             
     except Exception as e:
@@ -141,9 +248,78 @@ def classify_tickets(req: func.HttpRequest) -> func.HttpResponse:
             status_code=500
         )
 
+async def _prepend_row(first_row, rows):
+    if first_row is not None:
+        yield first_row
+    async for row in rows:
+        yield row
+
+async def stream_classified_rows(rows, formatter, limit=None):
+    """Yield formatted rows in input order as soon as each one is classified.
+
+    Up to STREAM_CONCURRENCY rows are classified at once on worker threads;
+    only those rows are held in memory.
+    """
+    loop = asyncio.get_running_loop()
+    pending = deque()
+    started = time.monotonic()
+
+    def classify_row(row):
+        description = row.get('Description', '')
+        return classify_ticket(description) if description else "No Description"
+
+    header = formatter.header()
+    if header:
+        yield header
+
+    count = 0
+    async for row in rows:
+        if limit and count >= limit:
+            break
+        count += 1
+        pending.append((row, loop.run_in_executor(None, classify_row, row)))
+        while pending and (len(pending) >= STREAM_CONCURRENCY or pending[0][1].done()):
+            done_row, future = pending.popleft()
+            done_row['Category'] = await future
+            yield formatter.row(done_row)
+
+    while pending:
+        done_row, future = pending.popleft()
+        done_row['Category'] = await future
+        yield formatter.row(done_row)
+    metrics_recorder.record_invocation('classify_tickets_stream', time.monotonic() - started, count)
+
+if StreamingResponse is not None:
+    @app.route(route="classify_tickets_stream", auth_level=func.AuthLevel.FUNCTION)
+    async def classify_tickets_stream(req: Request) -> StreamingResponse:
+        logging.info('Python HTTP trigger function processing a streaming request.')
+
+        # Rows are parsed as the body (or blob) arrives and returned as they finish
+        blob_url = req.query_params.get('blob_url')
+        chunks = aiter_blob_chunks(blob_url) if blob_url else req.stream()
+
+        try:
+            reader = TicketStreamReader(None if blob_url else req.headers.get('Content-Encoding'))
+        except ValueError as e:
+            return PlainTextResponse(str(e), status_code=415)
+        rows = reader.aiter_rows(chunks)
+        first_row = await anext(rows, None)
+        if not reader.fieldnames or 'Description' not in reader.fieldnames:
+            return PlainTextResponse("The export must contain a 'Description' column", status_code=400)
+
+        formatter = get_formatter(req.query_params.get('format'), reader.fieldnames + ['Category'])
+        limit = req.query_params.get('limit')
+        return StreamingResponse(
+            stream_classified_rows(
+                _prepend_row(first_row, rows), formatter, int(limit) if limit else None
+            ),
+            media_type=formatter.media_type
+        )
+
 @app.route(route="classify_single", auth_level=func.AuthLevel.FUNCTION)
 def classify_single(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processing a single ticket classification request.')
+    started = time.monotonic()
     
     try:
         # Get the request body
@@ -155,16 +331,9 @@ def classify_single(req: func.HttpRequest) -> func.HttpResponse:
                 status_code=400
             )
         
-        # Create Azure OpenAI client
-        client = AzureOpenAI(
-            api_key=os.environ["OPENAI_API_KEY"],
-            api_version=os.environ["OPENAI_API_VERSION"],
-            azure_endpoint=os.environ["OPENAI_ENDPOINT"],
-            timeout=30.0
-        )
-        
         description = req_body['description']
-        category = classify_ticket(description, client)
+        category = classify_ticket(description, hedge=True)
+        metrics_recorder.record_invocation('classify_single', time.monotonic() - started)
         
         # Return the category
         return func.HttpResponse(
@@ -178,4 +347,208 @@ def classify_single(req: func.HttpRequest) -> func.HttpResponse:
         return func.HttpResponse(
             f"Error processing request: {str(e)}",
             status_code=500
-        )
\ No newline at end of file
+        )
+
+@app.route(route="classify_batch", methods=["POST"], auth_level=func.AuthLevel.FUNCTION)
+def classify_batch(req: func.HttpRequest) -> func.HttpResponse:
+    """Classify a JSON array of {id, description} items, e.g. a page of SharePoint list items"""
+    logging.info('Python HTTP trigger function processing a batch classification request.')
+    started = time.monotonic()
+
+    try:
+        try:
+            items = req.get_json()
+        except ValueError:
+            items = None
+        error = batch_items_error(items, BATCH_MAX_ITEMS)
+        if error:
+            return func.HttpResponse(error, status_code=400)
+
+        # Optional multi-ticket prompts: up to batch_size tickets per request
+        batch_size = int(req.params.get('batch_size') or os.environ.get('CLASSIFY_BATCH_SIZE', '1'))
+        categories = classify_descriptions(
+            [item.get('description') or '' for item in items],
+            classify_ticket,
+            classify_ticket_batch,
+            batch_executor,
+            batch_size,
+        )
+        metrics_recorder.record_invocation('classify_batch', time.monotonic() - started, len(items))
+
+        return func.HttpResponse(
+            json.dumps([{"id": item['id'], "category": category} for item, category in zip(items, categories)]),
+            mimetype="application/json",
+            status_code=200
+        )
+
+    except Exception as e:
+        logging.error(f"Error: {str(e)}")
+        return func.HttpResponse(
+            f"Error processing request: {str(e)}",
+            status_code=500
+        )
+
+# Seconds a Logic App waits before polling a running job again
+JOB_RETRY_AFTER_SECONDS = "10"
+
+def _json_response(body, status_code=200, headers=None):
+    return func.HttpResponse(json.dumps(body), mimetype="application/json", status_code=status_code,
+                             headers=headers)
+
+def _job_url(req, job_id, action=None):
+    """Absolute URL of a job resource, keeping the function key so Logic Apps can poll it"""
+    base = req.url.split('?')[0].rstrip('/')
+    base = base[:base.index('/jobs') + len('/jobs')]
+    url = f"{base}/{job_id}" + (f"/{action}" if action else "")
+    code = req.params.get('code')
+    return f"{url}?code={code}" if code else url
+
+@app.route(route="jobs", methods=["POST"], auth_level=func.AuthLevel.FUNCTION)
+def submit_classification_job(req: func.HttpRequest) -> func.HttpResponse:
+    """Store the CSV as queued chunks and return 202 with the job's result URL"""
+    try:
+        blob_url = req.params.get('blob_url')
+        chunks = iter_blob_chunks(blob_url) if blob_url else iter_bytes(req.get_body())
+        try:
+            reader = TicketStreamReader(None if blob_url else req.headers.get('Content-Encoding'))
+        except ValueError as e:
+            return func.HttpResponse(str(e), status_code=415)
+        rows = reader.iter_rows(chunks)
+        first_row = next(rows, None)
+        if not reader.fieldnames or 'Description' not in reader.fieldnames:
+            return func.HttpResponse("The export must contain a 'Description' column", status_code=400)
+        if first_row is not None:
+            rows = itertools.chain([first_row], rows)
+
+        limit = req.params.get('limit')
+        rows = itertools.islice(rows, int(limit)) if limit else rows
+        chunk_rows = int(req.params.get('chunk_size') or os.environ.get('CLASSIFY_JOB_CHUNK_ROWS', DEFAULT_CHUNK_ROWS))
+        batch_size = int(req.params.get('batch_size') or os.environ.get('CLASSIFY_BATCH_SIZE', '1'))
+        storage = get_job_storage()
+        job = submit_job(storage, rows, reader.fieldnames, chunk_rows, batch_size)
+        logging.info(f"Submitted job {job['job_id']}: {job['rows']} rows in {job['chunks']} chunks")
+
+        if isinstance(storage, InMemoryJobStorage):
+            # No queue trigger fires for the in-memory stand-in, so work through the chunks here
+            start_local_workers(storage, classify_rows)
+
+        result_url = _job_url(req, job['job_id'], 'result')
+        # 202 + Location lets a Logic App HTTP action poll until the result is ready
+        return _json_response(
+            {
+                'job_id': job['job_id'],
+                'status': "queued",
+                'rows': job['rows'],
+                'chunks': job['chunks'],
+                'status_url': _job_url(req, job['job_id']),
+                'result_url': result_url,
+            },
+            status_code=202,
+            headers={'Location': result_url, 'Retry-After': JOB_RETRY_AFTER_SECONDS},
+        )
+    except Exception as e:
+        logging.error(f"Error: {str(e)}")
+        return func.HttpResponse(f"Error processing request: {str(e)}", status_code=500)
+
+@app.route(route="jobs/{job_id}", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
+def get_classification_job(req: func.HttpRequest) -> func.HttpResponse:
+    job = job_status(get_job_storage(), req.route_params.get('job_id'))
+    if job is None:
+        return func.HttpResponse("Job not found", status_code=404)
+    return _json_response(job)
+
+def _write_job_result(storage, job, output_blob_url):
+    """Write the merged CSV of a completed job to a blob; the JSON body to answer with"""
+    writer = BlockBlobWriter(output_blob_url, "text/csv")
+    for text in iter_job_result(storage, job):
+        writer.write(text)
+    writer.close()
+    return {'rows': job['rows'], 'output_blob': output_blob_url.split('?')[0]}
+
+if StreamingResponse is not None:
+    @app.route(route="jobs/{job_id}/result", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
+    async def get_classification_job_result(req: Request) -> StreamingResponse:
+        """Merged CSV of a completed job, 202 with its progress while chunks are still running, or 500 if one failed"""
+        storage = get_job_storage()
+        job = await asyncio.to_thread(job_status, storage, req.path_params.get('job_id'))
+        if job is None:
+            return PlainTextResponse("Job not found", status_code=404)
+        if job['status'] == "failed":
+            return JSONResponse(job, status_code=500)
+        if job['status'] != "completed":
+            return JSONResponse(
+                job, status_code=202, headers={'Location': str(req.url), 'Retry-After': JOB_RETRY_AFTER_SECONDS}
+            )
+
+        # With ?output_blob_url= the merged CSV goes to a blob instead of the response
+        output_blob_url = req.query_params.get('output_blob_url')
+        if output_blob_url:
+            return JSONResponse(await asyncio.to_thread(_write_job_result, storage, job, output_blob_url))
+
+        # Sent a chunk at a time, so a large result is never held in memory
+        if accepts_gzip(req.headers.get('Accept-Encoding')):
+            return StreamingResponse(iter_gzip(iter_job_result(storage, job)), media_type="text/csv",
+                                     headers={'Content-Encoding': 'gzip'})
+        return StreamingResponse(iter_job_result(storage, job), media_type="text/csv")
+else:
+    @app.route(route="jobs/{job_id}/result", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
+    def get_classification_job_result(req: func.HttpRequest) -> func.HttpResponse:
+        """Merged CSV of a completed job, 202 with its progress while chunks are still running, or 500 if one failed"""
+        storage = get_job_storage()
+        job = job_status(storage, req.route_params.get('job_id'))
+        if job is None:
+            return func.HttpResponse("Job not found", status_code=404)
+        if job['status'] == "failed":
+            return _json_response(job, status_code=500)
+        if job['status'] != "completed":
+            return _json_response(
+                job, status_code=202, headers={'Location': req.url, 'Retry-After': JOB_RETRY_AFTER_SECONDS}
+            )
+
+        # With ?output_blob_url= the merged CSV goes to a blob instead of the response
+        output_blob_url = req.params.get('output_blob_url')
+        if output_blob_url:
+            return _json_response(_write_job_result(storage, job, output_blob_url))
+
+        # Without response streaming the result is built in memory, up to CLASSIFY_MAX_RESPONSE_BYTES
+        max_bytes = max_response_bytes()
+        try:
+            text = join_limited(iter_job_result(storage, job), max_bytes)
+        except ResponseTooLarge:
+            return func.HttpResponse(
+                f"The job result is more than the {max_bytes} bytes returned in one response "
+                f"(CLASSIFY_MAX_RESPONSE_BYTES). Pass output_blob_url",
+                status_code=413
+            )
+        body, content_encoding = compress_body(text, req.headers.get('Accept-Encoding'))
+        return func.HttpResponse(body, mimetype="text/csv", status_code=200,
+                                 headers={'Content-Encoding': content_encoding} if content_encoding else None)
+
+@app.queue_trigger(arg_name="msg", queue_name="classify-chunks", connection="AzureWebJobsStorage")
+def classify_job_chunk(msg: func.QueueMessage) -> None:
+    """Queue worker: classify one chunk of a job; failures are retried, then go to the poison queue"""
+    message = json.loads(msg.get_body().decode('utf-8'))
+    started = time.monotonic()
+    count = run_chunk(get_job_storage(), message, classify_rows, msg.dequeue_count or 1)
+    metrics_recorder.record_invocation('classify_job_chunk', time.monotonic() - started, count)
+    logging.info(f"Classified {count} rows for chunk {message['chunk']} of job {message['job_id']}")
+
+@app.queue_trigger(arg_name="msg", queue_name="classify-chunks-poison", connection="AzureWebJobsStorage")
+def classify_job_chunk_poison(msg: func.QueueMessage) -> None:
+    """Fail the job of a chunk that used up its attempts, so pollers stop waiting for it"""
+    record_poisoned_chunk(get_job_storage(), json.loads(msg.get_body().decode('utf-8')))
+
+@app.warm_up_trigger('warmup')
+def warmup(warmup) -> None:
+    """Runs on each new instance before it takes traffic (Premium and Dedicated plans only)"""
+    logging.info('Warming up a new instance')
+    for client in deployment_pool.clients():
+        warm_up(client)
+
+# Open a connection while the worker loads, so the first request skips DNS and TLS setup
+if warm_up_on_load_enabled():
+    start_warm_up(deployment_pool.clients())
+
+_load_seconds = time.perf_counter() - _load_started
+metrics_recorder.record_startup('function_app', _load_seconds)
+logging.info(f"function_app loaded in {_load_seconds * 1000:.0f} ms")
@@ -0,0 +1,119 @@
+import json
+import os
+
+# Batch statuses after which nothing more will change
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+# Azure OpenAI accepts up to 100,000 requests (and 200 MB) per batch input file
+DEFAULT_MAX_REQUESTS_PER_FILE = 50000
+
+
+def request_line(custom_id, deployment, messages, options):
+    """One line of a batch input file: a chat completion request tagged with custom_id"""
+    return json.dumps({
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': '/chat/completions',
+        'body': {'model': deployment, 'messages': messages, **options},
+    }, ensure_ascii=False) + "\n"
+
+
+def upload_file(client, path):
+    """Upload a batch input file; returns its file id"""
+    with open(path, 'rb') as f:
+        return client.files.create(file=(os.path.basename(path), f), purpose='batch').id
+
+
+def create_batch(client, input_file_id, completion_window='24h'):
+    # openai 1.12 has no batches resource, so call the REST endpoint through the client
+    return client.post(
+        '/batches',
+        body={'input_file_id': input_file_id, 'endpoint': '/chat/completions',
+              'completion_window': completion_window},
+        cast_to=object,
+    )
+
+
+def get_batch(client, batch_id):
+    return client.get(f'/batches/{batch_id}', cast_to=object)
+
+
+def download_file(client, file_id, path):
+    """Save an output or error file, writing to a temporary name first so a partial download is never used"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(client.files.content(file_id).content)
+    os.replace(tmp_path, path)
+
+
+def iter_results(path):
+    """Yield (custom_id, reply content or None, usage or None) for each line of an output or error file"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get('response') or {}
+            body = response.get('body') or {}
+            if response.get('status_code') == 200 and body.get('choices'):
+                yield result['custom_id'], body['choices'][0]['message']['content'], body.get('usage')
+            else:
+                yield result['custom_id'], None, None
+
+
+class BatchRun:
+    """Sidecar state file of a Batch API run over one input CSV.
+
+    It records the input files written, and the file and batch ids as soon as
+    they are created, so an interrupted run resumes polling the batches it
+    already submitted instead of paying for them twice.
+    """
+
+    def __init__(self, input_path, output_path):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.path = output_path + ".batch.json"
+
+    def part_path(self, number, kind):
+        return f"{self.output_path}.batch-{number + 1:03d}-{kind}.jsonl"
+
+    def _fingerprint(self):
+        stat = os.stat(self.input_path)
+        return {'input_path': os.path.abspath(self.input_path), 'input_size': stat.st_size,
+                'input_mtime': stat.st_mtime}
+
+    def load(self, deployment):
+        """Return the saved state of a run over the same input and deployment, or None"""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get('fingerprint') != self._fingerprint() or state.get('deployment') != deployment:
+            return None
+        return state
+
+    def new_state(self, deployment, parts):
+        return {
+            'fingerprint': self._fingerprint(),
+            'deployment': deployment,
+            'parts': [{'input_path': path, 'requests': requests} for path, requests in parts],
+        }
+
+    def save(self, state):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def remove(self, state):
+        """Delete the state file and every local batch file of a finished run"""
+        for part in state['parts']:
+            for key in ('input_path', 'output_path', 'error_path'):
+                if part.get(key) and os.path.exists(part[key]):
+                    os.remove(part[key])
+        os.remove(self.path)
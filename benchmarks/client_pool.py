@@ -0,0 +1,94 @@
+"""Measure the per-ticket latency saved by reusing a pooled Azure OpenAI client.
+
+Classifies the same ticket N times, first building a new AzureOpenAI client
+for every ticket (the old behaviour) and then through the shared pooled
+client, and prints the latency of each.
+
+    python benchmarks/client_pool.py                # endpoint from config.ini
+    python benchmarks/client_pool.py --mock         # local stand-in server, no credentials
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import httpx
+import openai
+
+from classify_tickets import CONFIG_PATH, load_config
+from mock_openai import start_mock_server
+from shared_code.openai_client import get_client
+from shared_code.prompts import build_messages
+
+SAMPLE_DESCRIPTION = "I can't log in to the NHS App to see my GP record, it says my details don't match."
+
+
+def classify(client, openai_config):
+    response = client.chat.completions.create(
+        model=openai_config['model'],
+        messages=build_messages(SAMPLE_DESCRIPTION),
+        max_tokens=20,
+        temperature=0
+    )
+    return response.choices[0].message.content
+
+
+def new_client_per_ticket(openai_config):
+    client = openai.AzureOpenAI(
+        api_key=openai_config['api_key'],
+        api_version=openai_config['api_version'],
+        azure_endpoint=openai_config['endpoint'],
+        max_retries=0,
+        http_client=httpx.Client(timeout=30.0),
+    )
+    try:
+        return classify(client, openai_config)
+    finally:
+        client.close()
+
+
+def pooled_client(openai_config):
+    client = get_client(openai_config['endpoint'], openai_config['api_key'], openai_config['api_version'])
+    return classify(client, openai_config)
+
+
+def measure(label, fn, openai_config, tickets):
+    latencies = []
+    for _ in range(tickets):
+        start = time.perf_counter()
+        fn(openai_config)
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(f"{label:<24} mean {statistics.mean(latencies):7.1f} ms   "
+          f"p50 {statistics.median(latencies):7.1f} ms   max {max(latencies):7.1f} ms")
+    return statistics.mean(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickets', type=int, default=20, help="tickets per scenario (default 20)")
+    parser.add_argument('--mock', action='store_true', help="use a local stand-in server instead of config.ini")
+    parser.add_argument('--mock-latency', type=float, default=0.05, help="stand-in server latency in seconds")
+    args = parser.parse_args()
+
+    if args.mock:
+        server, openai_config = start_mock_server(args.mock_latency)
+    else:
+        server, openai_config = None, load_config(CONFIG_PATH)
+
+    # Warm DNS and the pool so the first measured request is not an outlier in either scenario
+    pooled_client(openai_config)
+
+    per_ticket = measure("new client per ticket", new_client_per_ticket, openai_config, args.tickets)
+    pooled = measure("pooled client", pooled_client, openai_config, args.tickets)
+    print(f"Saved {per_ticket - pooled:.1f} ms per ticket ({(per_ticket - pooled) / per_ticket:.0%})")
+
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
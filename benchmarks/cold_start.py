@@ -0,0 +1,116 @@
+"""Measure Function cold starts against the local mock Azure OpenAI server.
+
+Each handler is loaded in a fresh Python process, as it would be on a new
+worker. The report gives the module load time, the latency of the first
+classify_single request and the median of the requests after it. Every
+handler is run twice: cold, and after the warm-up trigger has opened a
+connection. The mock adds --connect-latency to each new connection to stand
+in for DNS and the TLS handshake, which a local server doesn't have.
+
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --connect-latency 0.2 --requests 50
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTION_APP_DIR = os.path.join(BASE_DIR, "azure-function")
+
+from mock_openai import MockServerProcess
+
+# azure-function/ is the deployed (function.json) app; azure_function_app.py the decorator app
+HANDLERS = ('classify_single', 'function_app')
+
+
+def _load(handler):
+    """Import the handler module; returns the classify_single entry point"""
+    if handler == 'classify_single':
+        sys.path.insert(0, FUNCTION_APP_DIR)
+        import classify_single
+        return classify_single.main
+    sys.path.insert(0, BASE_DIR)
+    import azure_function_app
+    return next(f.get_user_function() for f in azure_function_app.app.get_functions()
+                if f.get_function_name() == 'classify_single')
+
+
+def run_child(handler, warm, requests, openai_config):
+    """Load one handler in this process and time its first and following requests"""
+    os.environ.update({
+        'OPENAI_ENDPOINT': openai_config['endpoint'],
+        'OPENAI_API_KEY': openai_config['api_key'],
+        'OPENAI_API_VERSION': openai_config['api_version'],
+        'OPENAI_MODEL': openai_config['model'],
+        'CLASSIFICATION_CACHE_ENABLED': 'false',
+        'CLASSIFY_METRICS_EXPORT': 'false',
+    })
+    start = time.perf_counter()
+    main = _load(handler)
+    load_seconds = time.perf_counter() - start
+
+    import azure.functions as func
+    from shared_code.openai_client import get_client_from_env
+    from shared_code.warmup import warm_up
+
+    warm_up_seconds = warm_up(get_client_from_env()) if warm else None
+    latencies = []
+    for i in range(requests):
+        body = json.dumps({'description': f"Printer on floor {i} is out of toner"}).encode('utf-8')
+        start = time.perf_counter()
+        response = main(func.HttpRequest('POST', '/api/classify_single', body=body))
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"classify_single returned {response.status_code}: {response.get_body()[:200]}")
+    return {
+        'load_ms': round(load_seconds * 1000, 1),
+        'warm_up_ms': round(warm_up_seconds * 1000, 1) if warm_up_seconds is not None else None,
+        'first_ms': round(latencies[0] * 1000, 1),
+        'steady_p50_ms': round(statistics.median(latencies[1:]) * 1000, 1) if len(latencies) > 1 else None,
+    }
+
+
+def run_in_subprocess(handler, warm, requests, openai_config):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', handler, '--requests', str(requests),
+         '--openai-config', json.dumps(openai_config)] + (['--warm'] if warm else []),
+        capture_output=True, text=True, cwd=BASE_DIR,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{handler} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20, help="requests per run (default 20)")
+    parser.add_argument('--latency', type=float, default=0.05, help="mock request latency in seconds (default 0.05)")
+    parser.add_argument('--connect-latency', type=float, default=0.1,
+                        help="mock delay per new connection in seconds (default 0.1)")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--warm', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--openai-config', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.warm, args.requests, json.loads(args.openai_config))))
+        return
+
+    server = MockServerProcess(latency=args.latency, connect_latency=args.connect_latency)
+    print(f"{'handler':<18}{'warm-up':>9}{'load ms':>9}{'warm-up ms':>12}{'first ms':>10}{'steady p50 ms':>15}")
+    try:
+        for handler in HANDLERS:
+            for warm in (False, True):
+                result = run_in_subprocess(handler, warm, args.requests, server.openai_config)
+                print(f"{handler:<18}{'yes' if warm else 'no':>9}{result['load_ms']:>9}"
+                      f"{result['warm_up_ms'] or '-':>12}{result['first_ms']:>10}{result['steady_p50_ms'] or '-':>15}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
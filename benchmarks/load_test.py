@@ -0,0 +1,426 @@
+"""Load-test the classification paths against the local mock Azure OpenAI server.
+
+Each scenario runs in a fresh Python process. That process starts a mock
+server (mock_openai.py) with the scenario's latency, 429 rate and quota,
+writes a synthetic ServiceNow-shaped CSV, and drives classify_tickets.py or a
+Function handler from azure_function_app.py. The report gives tickets/sec,
+p50/p95/p99 per-ticket latency (including rate limiter waits and 429
+retries) and peak memory. Results are compared with benchmarks/baselines.json,
+and the exit status is 1 when a scenario regresses by more than --tolerance.
+
+--record saves every Azure OpenAI response of each scenario, with its
+latency, to a cassette file (azure-function/shared_code/cassette.py).
+--replay answers the same requests from the cassettes instead of a server,
+so runs need no network and see the same responses, 429s included.
+--latency-scale stretches or shrinks the recorded latencies; 0 leaves only
+the code's own overhead, which --profile breaks down per function. Replayed
+results have their own baselines.
+
+    python benchmarks/load_test.py                          # all scenarios
+    python benchmarks/load_test.py --scenario cli-1k --scenario function-classify_single
+    python benchmarks/load_test.py --scale 0.1              # smaller CSVs for a quick check
+    python benchmarks/load_test.py --save-baseline          # record these results as the baseline
+    python benchmarks/load_test.py --record benchmarks/cassettes
+    python benchmarks/load_test.py --replay benchmarks/cassettes --latency-scale 0 --profile /tmp/profiles
+"""
+import argparse
+import configparser
+import contextlib
+import cProfile
+import csv
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+sys.path.append(os.path.join(BASE_DIR, "azure-function"))
+
+from mock_openai import MockServerProcess
+from shared_code.cassette import RECORD, REPLAY, Cassette, set_cassette
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+DEFAULT_TOLERANCE = 0.25
+
+# Median latency and spread of the stand-in deployment, unless a scenario overrides them
+MOCK_DEFAULTS = {'latency': 0.05, 'latency_sigma': 0.5, 'seed': 0}
+
+SCENARIOS = {
+    'cli-1k': {'target': 'cli', 'tickets': 1000},
+    'cli-10k': {'target': 'cli', 'tickets': 10000},
+    # 5% random 429s plus a token quota the run will hit
+    'cli-throttled': {'target': 'cli', 'tickets': 1000,
+                      'mock': {'rate_429': 0.05, 'tokens_per_minute': 1200000}},
+    'function-classify_tickets': {'target': 'classify_tickets', 'tickets': 300},
+    'function-classify_single': {'target': 'classify_single', 'tickets': 300},
+    'function-classify_batch': {'target': 'classify_batch', 'tickets': 300},
+    # A slow tail (p99 about 10x the median), without and with hedged requests; compare their p95/p99
+    'single-slow-tail': {'target': 'classify_single', 'tickets': 300, 'mock': {'latency_sigma': 1.0}},
+    'single-slow-tail-hedged': {'target': 'classify_single', 'tickets': 300, 'mock': {'latency_sigma': 1.0},
+                                'env': {'CLASSIFY_HEDGE': 'true'}},
+}
+
+# [processing] settings for CLI scenarios; dedupe and the cache are off so every ticket reaches the mock
+CLI_PROCESSING = {
+    'concurrency': 16,
+    'requests_per_minute': 100000,
+    'tokens_per_minute': 10000000,
+    'max_tickets': 0,
+    'resume': False,
+    'checkpoint_interval': 1000,
+}
+
+# Items per classify_batch call, and tickets per Azure OpenAI request within it
+BATCH_PAGE_SIZE = 100
+BATCH_TICKETS_PER_REQUEST = 10
+
+# Stands in for the mock server's config when replaying; requests are matched without the host
+REPLAY_OPENAI_CONFIG = {'endpoint': 'http://replay.invalid/', 'api_key': 'replay', 'api_version': '2024-02-01',
+                        'model': 'mock'}
+
+_SUBJECTS = [
+    ("Can't log in to the NHS App", "I keep getting an error saying my details don't match when I log in to the NHS App."),
+    ("Find my NHS number", "Please can you tell me my NHS number, I need it for {thing}."),
+    ("Broken link", "The link on {page} goes to a page not found error."),
+    ("Update my GP surgery profile", "Our opening hours on {page} are wrong, please update them to 8am to 6pm."),
+    ("Covid pass", "My covid pass is not showing my {thing} from {date}."),
+    ("Complaint about service", "I waited {days} days for a reply and nobody has contacted me about reference {ref}."),
+    ("Website feedback", "The search on {page} doesn't find anything when I type {thing}."),
+    ("Buy cheap watches", "Best prices on watches and bags, visit our site now!!!"),
+]
+_PAGES = ["the conditions pages", "www.nhs.uk/services", "the pharmacy finder", "our practice profile"]
+_THINGS = ["a job application", "my booster vaccination", "travel", "registering with a dentist"]
+_GROUPS = ["NHS.UK Service Desk", "NHS App Support", "Profiles Team", "Content Team"]
+
+
+def write_tickets(path, count, seed=0):
+    """Write `count` synthetic ServiceNow-style tickets, with some blank and multi-line descriptions"""
+    rng = random.Random(seed)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Number', 'Opened', 'Short description', 'Description', 'Contact type', 'State',
+                         'Priority', 'Assignment group'])
+        for i in range(count):
+            subject, template = rng.choice(_SUBJECTS)
+            description = template.format(
+                thing=rng.choice(_THINGS), page=rng.choice(_PAGES), days=rng.randint(2, 30),
+                date=f"{rng.randint(1, 28)}/0{rng.randint(1, 9)}/2025", ref=f"CS{rng.randint(10 ** 6, 10 ** 7)}",
+            )
+            roll = rng.random()
+            if roll < 0.03:
+                description = ""
+            elif roll < 0.15:
+                description += f"\n\nKind regards,\n{rng.choice(['Sam', 'Alex', 'Jo'])} {rng.randint(1, 999)}"
+            writer.writerow([
+                f"CS{1000000 + i:07d}", f"2025-0{rng.randint(1, 3)}-{rng.randint(1, 28):02d} 09:00:00",
+                subject, description, rng.choice(['Email', 'Web', 'Phone']), 'New',
+                rng.choice(['3 - Moderate', '4 - Low']), rng.choice(_GROUPS),
+            ])
+
+
+def _timed(fn, latencies):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+
+def _timed_async(fn, latencies):
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+
+def run_cli(csv_path, workdir, openai_config, latencies):
+    """Run classify_tickets.main() over the CSV; returns the output categories"""
+    import classify_tickets
+
+    config = configparser.ConfigParser()
+    config['azure_openai'] = openai_config
+    config['processing'] = {key: str(value) for key, value in CLI_PROCESSING.items()}
+    config['cache'] = {'enabled': 'false'}
+    config['dedupe'] = {'enabled': 'false'}
+    config_path = os.path.join(workdir, "config.ini")
+    with open(config_path, 'w') as f:
+        config.write(f)
+
+    classify_tickets.CONFIG_PATH = config_path
+    classify_tickets.CSV_PATH = csv_path
+    classify_tickets.OUTPUT_PATH = os.path.join(workdir, "output.csv")
+    classify_tickets.classify_ticket_async = _timed_async(classify_tickets.classify_ticket_async, latencies)
+    classify_tickets.main()
+    with open(classify_tickets.OUTPUT_PATH, newline='', encoding='utf-8') as f:
+        return [row['Category'] for row in csv.DictReader(f)]
+
+
+def _function_app(openai_config):
+    os.environ.update({
+        'OPENAI_ENDPOINT': openai_config['endpoint'],
+        'OPENAI_API_KEY': openai_config['api_key'],
+        'OPENAI_API_VERSION': openai_config['api_version'],
+        'OPENAI_MODEL': openai_config['model'],
+        'OPENAI_REQUESTS_PER_MINUTE': str(CLI_PROCESSING['requests_per_minute']),
+        'OPENAI_TOKENS_PER_MINUTE': str(CLI_PROCESSING['tokens_per_minute']),
+        'CLASSIFICATION_CACHE_ENABLED': 'false',
+    })
+    import azure_function_app
+    return azure_function_app
+
+
+def _handler(app, name):
+    # @app.route registers the function on app.app rather than returning it
+    return next(f.get_user_function() for f in app.app.get_functions() if f.get_function_name() == name)
+
+
+def run_classify_tickets(csv_path, workdir, openai_config, latencies):
+    """POST the CSV to the classify_tickets handler; returns the output categories"""
+    import azure.functions as func
+
+    app = _function_app(openai_config)
+    app.classify_ticket = _timed(app.classify_ticket, latencies)
+    with open(csv_path, 'rb') as f:
+        body = f.read()
+    response = _handler(app, 'classify_tickets')(func.HttpRequest('POST', '/api/classify_tickets', body=body))
+    if response.status_code != 200:
+        raise RuntimeError(f"classify_tickets returned {response.status_code}: {response.get_body()[:200]}")
+    return [row['Category'] for row in csv.DictReader(response.get_body().decode('utf-8').splitlines())]
+
+
+def run_classify_single(csv_path, workdir, openai_config, latencies):
+    """Call the classify_single handler once per described ticket; returns the categories"""
+    import azure.functions as func
+
+    handler = _timed(_handler(_function_app(openai_config), 'classify_single'), latencies)
+    categories = []
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if not row['Description']:
+                continue
+            body = json.dumps({'description': row['Description']}).encode('utf-8')
+            response = handler(func.HttpRequest('POST', '/api/classify_single', body=body))
+            categories.append(json.loads(response.get_body())['category'] if response.status_code == 200
+                              else "Classification Error")
+    return categories
+
+
+def run_classify_batch(csv_path, workdir, openai_config, latencies):
+    """POST the tickets to the classify_batch handler a page at a time; returns the categories"""
+    import azure.functions as func
+
+    handler = _timed(_handler(_function_app(openai_config), 'classify_batch'), latencies)
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        items = [{'id': row['Number'], 'description': row['Description']} for row in csv.DictReader(f)]
+    categories = []
+    for start in range(0, len(items), BATCH_PAGE_SIZE):
+        page = items[start:start + BATCH_PAGE_SIZE]
+        response = handler(func.HttpRequest('POST', '/api/classify_batch', body=json.dumps(page).encode('utf-8'),
+                                            params={'batch_size': str(BATCH_TICKETS_PER_REQUEST)}))
+        if response.status_code != 200:
+            raise RuntimeError(f"classify_batch returned {response.status_code}: {response.get_body()[:200]}")
+        categories.extend(result['category'] for result in json.loads(response.get_body()))
+    return categories
+
+
+RUNNERS = {
+    'cli': run_cli,
+    'classify_tickets': run_classify_tickets,
+    'classify_single': run_classify_single,
+    'classify_batch': run_classify_batch,
+}
+
+
+def _peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in KB on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def cassette_path(directory, name, scale):
+    return os.path.join(directory, f"{name}-x{scale:g}.jsonl")
+
+
+def run_scenario(name, scale, cassette_mode=None, cassette_dir=None, latency_scale=1.0, profile_dir=None):
+    """Run one scenario in this process and return its metrics"""
+    scenario = SCENARIOS[name]
+    tickets = max(1, int(scenario['tickets'] * scale))
+    cassette = None
+    if cassette_mode:
+        cassette = Cassette(cassette_path(cassette_dir, name, scale), cassette_mode, latency_scale)
+        set_cassette(cassette)
+    server = None
+    if cassette_mode == REPLAY:
+        openai_config = REPLAY_OPENAI_CONFIG
+    else:
+        server = MockServerProcess(**{**MOCK_DEFAULTS, **scenario.get('mock', {})})
+        openai_config = server.openai_config
+    os.environ.update(scenario.get('env', {}))
+    latencies = []
+    profiler = cProfile.Profile() if profile_dir else None
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, "tickets.csv")
+        write_tickets(csv_path, tickets)
+        # The CLI prints a line per ticket; keep the report readable
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            if profiler:
+                profiler.enable()
+            categories = RUNNERS[scenario['target']](csv_path, workdir, openai_config, latencies)
+            if profiler:
+                profiler.disable()
+            elapsed = time.perf_counter() - start
+    if profiler:
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_dir, f"{name}.pstats"))
+    if server:
+        stats = server.stop()
+    else:
+        stats = {'requests': cassette.stats['replayed'], 'throttled': cassette.stats['throttled']}
+    if cassette:
+        stats['cassette_misses'] = cassette.stats['misses']
+        cassette.close()
+
+    latencies.sort()
+    return {
+        'tickets': len(categories),
+        'seconds': round(elapsed, 3),
+        'tickets_per_sec': round(len(categories) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        'peak_memory_mb': _peak_memory_mb(),
+        'errors': sum(1 for category in categories if category in ("Error", "Classification Error")),
+        'requests': stats['requests'],
+        'throttled': stats['throttled'],
+        **({'cassette_misses': stats['cassette_misses']} if 'cassette_misses' in stats else {}),
+    }
+
+
+def run_in_subprocess(name, scale, extra_args=()):
+    """Run a scenario in a fresh interpreter, so peak memory and module state are its own"""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', name, '--scale', str(scale), *extra_args],
+        capture_output=True, text=True, cwd=BASE_DIR,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{name} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def regressions(result, baseline, tolerance):
+    """Metrics that are worse than the baseline by more than `tolerance`"""
+    found = []
+    if baseline.get('tickets_per_sec') and result['tickets_per_sec'] < baseline['tickets_per_sec'] * (1 - tolerance):
+        found.append(f"tickets/sec {result['tickets_per_sec']} < {baseline['tickets_per_sec']}")
+    for key in ('p50_ms', 'p95_ms', 'p99_ms', 'peak_memory_mb'):
+        if baseline.get(key) and result.get(key) and result[key] > baseline[key] * (1 + tolerance):
+            found.append(f"{key} {result[key]} > {baseline[key]}")
+    return found
+
+
+def load_baselines():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable; default all)")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiply every scenario's ticket count")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f"allowed slowdown against the baseline (default {DEFAULT_TOLERANCE})")
+    parser.add_argument('--save-baseline', action='store_true', help=f"write the results to {BASELINE_PATH}")
+    cassettes = parser.add_mutually_exclusive_group()
+    cassettes.add_argument('--record', metavar='DIR', help="save each scenario's responses to a cassette in DIR")
+    cassettes.add_argument('--replay', metavar='DIR', help="answer requests from the cassettes in DIR, offline")
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help="multiply replayed latencies (default 1; 0 for no waiting)")
+    parser.add_argument('--profile', metavar='DIR', help="write a cProfile .pstats file per scenario to DIR")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    cassette_mode, cassette_dir = (RECORD, args.record) if args.record else (REPLAY, args.replay)
+    if cassette_dir:
+        cassette_dir = os.path.abspath(cassette_dir)
+    else:
+        cassette_mode = None
+    if args.child:
+        print(json.dumps(run_scenario(args.child, args.scale, cassette_mode, cassette_dir, args.latency_scale,
+                                      args.profile)))
+        return
+
+    extra_args = []
+    if cassette_mode:
+        extra_args += [f'--{cassette_mode}', cassette_dir, '--latency-scale', str(args.latency_scale)]
+    if args.profile:
+        extra_args += ['--profile', os.path.abspath(args.profile)]
+    if cassette_mode == RECORD:
+        os.makedirs(cassette_dir, exist_ok=True)
+
+    baselines = load_baselines()
+    failed = False
+    print(f"{'scenario':<36}{'tickets':>8}{'tickets/s':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'peak MB':>9}{'requests':>10}{'429s':>6}{'errors':>7}")
+    results = {}
+    for name in args.scenario or list(SCENARIOS):
+        path = cassette_path(cassette_dir, name, args.scale) if cassette_mode else None
+        if cassette_mode == RECORD and os.path.exists(path):
+            # Cassettes are appended to; start this scenario's afresh
+            os.remove(path)
+        if cassette_mode == REPLAY and not os.path.exists(path):
+            print(f"{name:<36}no cassette at {path}; run with --record first")
+            failed = True
+            continue
+        result = run_in_subprocess(name, args.scale, extra_args)
+        # Replayed runs are compared with replayed baselines at the same latency scale
+        if args.replay:
+            name = f"{name}@replay-x{args.latency_scale:g}"
+        results[name] = result
+        print(f"{name:<36}{result['tickets']:>8}{result['tickets_per_sec']:>11}{result['p50_ms']:>9}"
+              f"{result['p95_ms']:>9}{result['p99_ms']:>9}{result['peak_memory_mb'] or 0:>9.1f}"
+              f"{result['requests']:>10}{result['throttled']:>6}{result['errors']:>7}")
+        if result.get('cassette_misses'):
+            print(f"  {result['cassette_misses']} requests were not in the cassette; record it again")
+            failed = True
+        # Baselines only apply to runs of the same size
+        baseline = baselines.get(name)
+        if baseline and baseline['tickets'] == result['tickets'] and not args.save_baseline:
+            for regression in regressions(result, baseline, args.tolerance):
+                print(f"  REGRESSION: {regression}")
+                failed = True
+
+    if args.save_baseline:
+        baselines.update(results)
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baselines written to {BASELINE_PATH}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
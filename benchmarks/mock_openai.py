@@ -0,0 +1,422 @@
+"""Local stand-in for an Azure OpenAI deployment, used by the benchmarks.
+
+Answers chat completions (single ticket, category code and JSON batch
+prompts), embeddings requests and the model list used for warm-up. It
+also stands in for the files and batches endpoints of the Batch API: a
+batch completes --batch-seconds after it is created, answering every line
+as a chat completion. Latency follows a lognormal distribution
+around a median, a share of requests can be refused with 429 or fail with
+500, and requests/tokens per minute can be capped like a real deployment
+quota. Prompts that repeat a long enough prefix report cached_tokens.
+Run two with different settings to try a deployment pool.
+
+    python benchmarks/mock_openai.py --port 8766 --latency 0.2 --rate-429 0.05
+
+then point config.ini (or OPENAI_ENDPOINT) at http://127.0.0.1:8766/.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(BASE_DIR, "azure-function"))
+
+from shared_code.categories import CATEGORIES, CATEGORY_CODES
+
+EMBEDDING_DIMENSIONS = 64
+_WORD_RE = re.compile(r"[a-z]+")
+_DESCRIPTION_RE = re.compile(r"Ticket Description:\n(.*?)(?:\n\n(?:Category|Reply)|\Z)", re.S)
+# Like Azure OpenAI, prompt prefixes are cached from this many tokens, in steps of PROMPT_CACHE_INCREMENT
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_INCREMENT = 128
+_CODES = {category: code for code, category in CATEGORY_CODES.items()}
+
+
+class MockSettings:
+    """Behaviour of the stand-in server; changed on the server object while it runs"""
+
+    def __init__(self, latency=0.05, latency_sigma=0.0, rate_429=0.0, requests_per_minute=0,
+                 tokens_per_minute=0, connect_latency=0.0, batch_seconds=2.0, batch_error_rate=0.0, seed=None,
+                 rate_500=0.0):
+        self.latency = latency
+        # 0 gives a fixed latency; 0.5 puts p99 at about 3x the median
+        self.latency_sigma = latency_sigma
+        self.rate_429 = rate_429
+        # Share of requests answered with a 500, like a deployment having an outage
+        self.rate_500 = rate_500
+        # 0 means unlimited
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        # Extra delay on each new connection, standing in for DNS and the TLS handshake
+        self.connect_latency = connect_latency
+        # Batch API: seconds until a batch completes, and the share of its lines that fail
+        self.batch_seconds = batch_seconds
+        self.batch_error_rate = batch_error_rate
+        self.random = random.Random(seed)
+
+
+class _Quota:
+    """Sliding one-minute window of requests and tokens, as Azure OpenAI enforces them"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.window = deque()
+        self.tokens = 0
+        self.lock = threading.Lock()
+
+    def take(self, tokens):
+        """Return (retry_after_seconds or None, remaining requests, remaining tokens)"""
+        with self.lock:
+            now = time.monotonic()
+            while self.window and self.window[0][0] <= now - 60:
+                self.tokens -= self.window.popleft()[1]
+            rpm, tpm = self.settings.requests_per_minute, self.settings.tokens_per_minute
+            if (rpm and len(self.window) >= rpm) or (tpm and self.tokens + tokens > tpm):
+                retry_after = self.window[0][0] + 60 - now if self.window else 1.0
+                return max(retry_after, 0.01), 0, 0
+            self.window.append((now, tokens))
+            self.tokens += tokens
+            return None, (rpm - len(self.window)) if rpm else None, (tpm - self.tokens) if tpm else None
+
+
+def _category_for(text):
+    # The same ticket always gets the same category, so runs can be compared
+    digest = hashlib.md5(text.strip().lower().encode('utf-8')).digest()
+    return CATEGORIES[int.from_bytes(digest[:4], 'big') % len(CATEGORIES)]
+
+
+def _embedding(text):
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    for word in _WORD_RE.findall(text.lower()):
+        vector[int(hashlib.md5(word.encode('utf-8')).hexdigest(), 16) % EMBEDDING_DIMENSIONS] += 1.0
+    return vector
+
+
+def chat_reply(body):
+    """Answer a chat completion the way the classification prompts expect"""
+    prompt = body['messages'][-1]['content']
+    if (body.get('response_format') or {}).get('type') == 'json_object':
+        tickets = json.loads(prompt[prompt.rindex('Tickets:') + len('Tickets:'):])
+        return json.dumps({str(t['id']): _category_for(t['description']) for t in tickets})
+    match = _DESCRIPTION_RE.search(prompt)
+    category = _category_for(match.group(1) if match else prompt)
+    if any('category number' in message['content'] for message in body['messages']):
+        return _CODES[category]
+    return category
+
+
+def cached_prompt_tokens(body, prompt_tokens, seen_prefixes):
+    """Tokens of the prompt served from the cache: the leading messages, once they have been seen"""
+    if prompt_tokens < PROMPT_CACHE_MIN_TOKENS or len(body['messages']) < 2:
+        return 0
+    prefix = json.dumps(body['messages'][:-1], sort_keys=True)
+    digest = hashlib.sha256(prefix.encode('utf-8')).digest()
+    if digest not in seen_prefixes:
+        seen_prefixes.add(digest)
+        return 0
+    cached = min(len(prefix) // 4, prompt_tokens) // PROMPT_CACHE_INCREMENT * PROMPT_CACHE_INCREMENT
+    return cached if cached >= PROMPT_CACHE_MIN_TOKENS else 0
+
+
+def chat_completion(body, raw_size, seen_prefixes=None):
+    """Chat completion response for a request body of raw_size bytes"""
+    content = chat_reply(body)
+    usage = {'prompt_tokens': raw_size // 4, 'completion_tokens': len(content) // 4 + 1}
+    usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+    if seen_prefixes is not None:
+        usage['prompt_tokens_details'] = {
+            'cached_tokens': cached_prompt_tokens(body, usage['prompt_tokens'], seen_prefixes)
+        }
+    return {
+        'id': 'mock', 'object': 'chat.completion', 'created': 0, 'model': body.get('model', 'mock'),
+        'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+        'usage': usage,
+    }
+
+
+def run_batch(lines, settings):
+    """Answer the lines of a batch input file; returns (output lines, error lines)"""
+    output, errors = [], []
+    for number, line in enumerate(lines):
+        request = json.loads(line)
+        result = {'id': f"response-{number}", 'custom_id': request.get('custom_id'), 'error': None}
+        body = request.get('body') or {}
+        if not body.get('messages') or (settings.batch_error_rate
+                                        and settings.random.random() < settings.batch_error_rate):
+            result['response'] = {'status_code': 500, 'body': {'error': {'code': 'server_error',
+                                                                         'message': "Mock batch line failure"}}}
+            errors.append(result)
+            continue
+        result['response'] = {'status_code': 200, 'request_id': f"request-{number}",
+                              'body': chat_completion(body, len(line))}
+        output.append(result)
+    return output, errors
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        if self.server.settings.connect_latency:
+            time.sleep(self.server.settings.connect_latency)
+
+    def _send(self, status, payload, headers=()):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_bytes(self, data):
+        self.send_response(200)
+        self.send_header('content-type', 'application/octet-stream')
+        self.send_header('content-length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        server.count('requests')
+        path = self.path.split('?')[0].rstrip('/')
+        if '/files/' in path and path.endswith('/content'):
+            file = server.files.get(path.split('/')[-2])
+            if file is None:
+                self._send(404, {'error': {'code': 'notFound', 'message': "File not found"}})
+            else:
+                self._send_bytes(file['data'])
+            return
+        if '/batches/' in path:
+            batch = server.batch(path.split('/')[-1])
+            if batch is None:
+                self._send(404, {'error': {'code': 'notFound', 'message': "Batch not found"}})
+            else:
+                self._send(200, batch)
+            return
+        # The model list, which the warm-up request asks for
+        time.sleep(server.settings.latency)
+        self._send(200, {'object': 'list', 'data': [{'id': 'mock', 'object': 'model'}]})
+
+    def _upload_file(self, raw):
+        # multipart/form-data with "purpose" and "file" fields
+        message = BytesParser().parsebytes(
+            b'content-type: ' + self.headers['content-type'].encode('latin-1') + b'\r\n\r\n' + raw
+        )
+        fields = {part.get_param('name', header='content-disposition'): part for part in message.get_payload()}
+        file = self.server.add_file(fields['file'].get_payload(decode=True),
+                                    fields['file'].get_filename(), fields['purpose'].get_payload())
+        self._send(200, {key: value for key, value in file.items() if key != 'data'})
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get('content-length', 0)))
+        server = self.server
+        path = self.path.split('?')[0].rstrip('/')
+        if path.endswith('/files'):
+            server.count('requests')
+            self._upload_file(raw)
+            return
+        body = json.loads(raw or b'{}')
+        if path.endswith('/batches'):
+            server.count('requests')
+            batch = server.create_batch(body)
+            if batch is None:
+                self._send(404, {'error': {'code': 'notFound', 'message': "Input file not found"}})
+            else:
+                self._send(200, batch)
+            return
+        settings = server.settings
+        server.count('requests')
+
+        latency = settings.latency
+        if settings.latency_sigma:
+            latency *= math.exp(settings.random.gauss(0, settings.latency_sigma))
+        time.sleep(latency)
+
+        if settings.rate_500 and settings.random.random() < settings.rate_500:
+            server.count('failed')
+            self._send(500, {'error': {'code': 'InternalServerError', 'message': "The server had an error"}})
+            return
+
+        tokens = len(raw) // 4 + (body.get('max_tokens') or 0)
+        retry_after, remaining_requests, remaining_tokens = server.quota.take(tokens)
+        if retry_after is None and settings.rate_429 and settings.random.random() < settings.rate_429:
+            retry_after = 1.0
+        if retry_after is not None:
+            server.count('throttled')
+            self._send(429, {'error': {'code': '429', 'message': "Rate limit exceeded"}},
+                       [('retry-after-ms', str(int(retry_after * 1000))), ('retry-after', str(math.ceil(retry_after)))])
+            return
+
+        headers = []
+        if remaining_requests is not None:
+            headers.append(('x-ratelimit-remaining-requests', str(remaining_requests)))
+        if remaining_tokens is not None:
+            headers.append(('x-ratelimit-remaining-tokens', str(remaining_tokens)))
+        usage = {'prompt_tokens': len(raw) // 4, 'total_tokens': len(raw) // 4}
+        if '/embeddings' in self.path:
+            inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+            self._send(200, {
+                'object': 'list', 'model': body.get('model', 'mock'), 'usage': usage,
+                'data': [{'object': 'embedding', 'index': i, 'embedding': _embedding(text)}
+                         for i, text in enumerate(inputs)],
+            }, headers)
+            return
+
+        self._send(200, chat_completion(body, len(raw), server.prompt_cache), headers)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, settings, port=0):
+        super().__init__(('127.0.0.1', port), MockHandler)
+        self.settings = settings
+        self.quota = _Quota(settings)
+        self.stats = {'requests': 0, 'throttled': 0, 'failed': 0}
+        # Hashes of the prompt prefixes seen so far
+        self.prompt_cache = set()
+        self._stats_lock = threading.Lock()
+        self.files = {}
+        self.batches = {}
+        self._ids = itertools.count(1)
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def add_file(self, data, filename, purpose):
+        with self._stats_lock:
+            file_id = f"file-{next(self._ids)}"
+            self.files[file_id] = file = {
+                'id': file_id, 'object': 'file', 'bytes': len(data), 'created_at': int(time.time()),
+                'filename': filename, 'purpose': purpose, 'status': 'processed', 'data': data,
+            }
+        return file
+
+    def create_batch(self, body):
+        if body.get('input_file_id') not in self.files:
+            return None
+        with self._stats_lock:
+            batch_id = f"batch_{next(self._ids)}"
+            self.batches[batch_id] = {
+                'id': batch_id, 'object': 'batch', 'endpoint': body.get('endpoint'),
+                'input_file_id': body['input_file_id'], 'completion_window': body.get('completion_window'),
+                'status': 'validating', 'created_at': int(time.time()), 'output_file_id': None,
+                'error_file_id': None, 'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+                '_started': time.monotonic(),
+            }
+        return self.batch(batch_id)
+
+    def batch(self, batch_id):
+        """Current state of a batch, completing it once batch_seconds have passed"""
+        with self._stats_lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            elapsed = time.monotonic() - batch['_started']
+            if batch['status'] in ('validating', 'in_progress'):
+                lines = self.files[batch['input_file_id']]['data'].decode('utf-8').splitlines()
+                batch['request_counts']['total'] = len(lines)
+                batch['status'] = 'in_progress' if elapsed >= self.settings.batch_seconds / 4 else 'validating'
+                if elapsed >= self.settings.batch_seconds:
+                    output, errors = run_batch(lines, self.settings)
+                    batch['request_counts'].update(completed=len(output), failed=len(errors))
+                    batch['status'] = 'completed'
+                    for name, results in (('output_file_id', output), ('error_file_id', errors)):
+                        if results:
+                            file_id = f"file-{next(self._ids)}"
+                            data = "".join(json.dumps(result) + "\n" for result in results).encode('utf-8')
+                            self.files[file_id] = {'id': file_id, 'object': 'file', 'bytes': len(data),
+                                                   'purpose': 'batch_output', 'data': data}
+                            batch[name] = file_id
+            return {key: value for key, value in batch.items() if not key.startswith('_')}
+
+
+def start_mock_server(latency=0.05, port=0, **settings):
+    """Serve on a background thread; returns the server and an [azure_openai]-style config for it"""
+    server = MockServer(MockSettings(latency=latency, **settings), port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, {
+        'endpoint': f"http://127.0.0.1:{server.server_address[1]}/",
+        'api_key': 'mock-key',
+        'api_version': '2024-02-01',
+        'model': 'mock',
+    }
+
+
+def _serve(conn, settings):
+    server, openai_config = start_mock_server(**settings)
+    conn.send(openai_config)
+    conn.recv()
+    server.shutdown()
+    conn.send(server.stats)
+
+
+class MockServerProcess:
+    """start_mock_server in its own process, so the server doesn't compete with the code under test for the GIL"""
+
+    def __init__(self, **settings):
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(child_conn, settings), daemon=True)
+        self._process.start()
+        self.openai_config = self._conn.recv()
+
+    def stop(self):
+        """Shut the server down and return its request counts"""
+        self._conn.send('stop')
+        stats = self._conn.recv()
+        self._process.join()
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=0.05, help="median latency in seconds (default 0.05)")
+    parser.add_argument('--latency-sigma', type=float, default=0.0, help="lognormal spread of latency (default 0)")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="share of requests refused with 429")
+    parser.add_argument('--rate-500', type=float, default=0.0, help="share of requests failed with 500")
+    parser.add_argument('--requests-per-minute', type=int, default=0, help="request quota (default unlimited)")
+    parser.add_argument('--tokens-per-minute', type=int, default=0, help="token quota (default unlimited)")
+    parser.add_argument('--connect-latency', type=float, default=0.0,
+                        help="extra seconds per new connection, like DNS and TLS setup (default 0)")
+    parser.add_argument('--batch-seconds', type=float, default=2.0, help="seconds until a batch completes (default 2)")
+    parser.add_argument('--batch-error-rate', type=float, default=0.0, help="share of batch lines that fail")
+    args = parser.parse_args()
+
+    server, openai_config = start_mock_server(
+        args.latency, args.port, latency_sigma=args.latency_sigma, rate_429=args.rate_429, rate_500=args.rate_500,
+        requests_per_minute=args.requests_per_minute, tokens_per_minute=args.tokens_per_minute,
+        connect_latency=args.connect_latency, batch_seconds=args.batch_seconds,
+        batch_error_rate=args.batch_error_rate,
+    )
+    print(f"Mock Azure OpenAI listening on {openai_config['endpoint']}")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"Served: {server.stats}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Build the exemplar index for the embeddings backend from earlier "- Categorized.csv" output.
+
+Reads the [embeddings] section of config.ini, embeds every distinct labelled
+ticket through the embeddings deployment and writes the vectors to
+index_path as a memory-mapped .npy file, with their categories alongside in
+a .json file. Switch classify_tickets.py over with `backend = embeddings` in
+the [processing] section.
+
+    python build_embedding_index.py
+"""
+import asyncio
+import itertools
+import os
+
+from classify_tickets import (
+    CATEGORY_COL,
+    CONFIG_PATH,
+    DESCRIPTION_COL,
+    embed_descriptions_async,
+    load_config,
+    load_embedding_config,
+    load_processing_config,
+)
+from embedding_classifier import EmbeddingIndexWriter
+from shared_code.cache import normalize_description
+from shared_code.local_classifier import read_training_examples
+from shared_code.openai_client import close_async_clients, get_async_client
+from shared_code.rate_limiter import RateLimiter
+
+
+async def build_index(examples, openai_config, processing_config, embedding_config):
+    concurrency = processing_config['concurrency']
+    client = get_async_client(
+        openai_config['endpoint'],
+        openai_config['api_key'],
+        openai_config['api_version'],
+        max_connections=concurrency
+    )
+    limiter = RateLimiter(
+        requests_per_minute=processing_config['requests_per_minute'],
+        tokens_per_minute=processing_config['tokens_per_minute'],
+        max_retries=processing_config['max_retries'],
+    )
+    writer = EmbeddingIndexWriter(embedding_config['index_path'], len(examples), embedding_config['model'])
+    batch_size = embedding_config['batch_size']
+    batches = [examples[i:i + batch_size] for i in range(0, len(examples), batch_size)]
+    try:
+        # Requests run `concurrency` at a time; results are written in order
+        for start in range(0, len(batches), concurrency):
+            window = batches[start:start + concurrency]
+            results = await asyncio.gather(*[
+                embed_descriptions_async([d for d, _ in batch], embedding_config, client, limiter)
+                for batch in window
+            ])
+            for batch, embeddings in zip(window, results):
+                writer.add(embeddings, [category for _, category in batch])
+            print(f"Embedded {len(writer.labels)}/{len(examples)} tickets")
+    finally:
+        await close_async_clients()
+    writer.close()
+
+
+def main():
+    openai_config = load_config(CONFIG_PATH)
+    processing_config = load_processing_config(CONFIG_PATH)
+    embedding_config = load_embedding_config(CONFIG_PATH)
+    missing = [path for path in embedding_config['training_files'] if not os.path.exists(path)]
+    if missing:
+        print(f"Error: training files not found: {missing}")
+        return
+
+    # One exemplar per distinct description; the latest label wins
+    distinct = {}
+    for description, category in read_training_examples(
+            embedding_config['training_files'], DESCRIPTION_COL, CATEGORY_COL):
+        if description.strip():
+            distinct[normalize_description(description)] = (description, category)
+    examples = list(distinct.values())
+    if not examples:
+        print("Error: no classified tickets to index")
+        return
+
+    print(f"Indexing {len(examples)} distinct tickets with {embedding_config['model']}")
+    asyncio.run(build_index(examples, openai_config, processing_config, embedding_config))
+    counts = itertools.groupby(sorted(category for _, category in examples))
+    print(f"Wrote {embedding_config['index_path']}: "
+          + ", ".join(f"{category} ({len(list(group))})" for category, group in counts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import json
+import os
+
+
+class RunCheckpoint:
+    """Sidecar progress file that lets a CLI run resume after a crash.
+
+    Every commit flushes and fsyncs the output file, then atomically records
+    how many input rows have been written and the output size at that point.
+    On restart the output is cut back to that size (dropping any half-written
+    rows) and the already classified input rows are skipped.
+    """
+
+    def __init__(self, input_path, output_path):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.path = output_path + ".progress.json"
+
+    def _fingerprint(self):
+        stat = os.stat(self.input_path)
+        return {'input_path': os.path.abspath(self.input_path), 'input_size': stat.st_size,
+                'input_mtime': stat.st_mtime}
+
+    def load(self):
+        """Return the saved progress of an unfinished run over the same input, or None"""
+        if not os.path.exists(self.path) or not os.path.exists(self.output_path):
+            return None
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get('complete') or state.get('fingerprint') != self._fingerprint():
+            return None
+        if os.path.getsize(self.output_path) < state['output_offset']:
+            return None
+        return state
+
+    def truncate_output(self, state):
+        with open(self.output_path, 'r+b') as f:
+            f.truncate(state['output_offset'])
+
+    def commit(self, rows_done, outfile, complete=False):
+        outfile.flush()
+        os.fsync(outfile.fileno())
+        self._save({
+            'fingerprint': self._fingerprint(),
+            'rows_done': rows_done,
+            'output_offset': outfile.tell(),
+            'complete': complete,
+        })
+
+    def mark_complete(self):
+        with open(self.path, encoding='utf-8') as f:
+            state = json.load(f)
+        state['complete'] = True
+        self._save(state)
+
+    def _save(self, state):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
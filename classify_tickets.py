@@ -1,46 +1,110 @@
+import asyncio
 import csv
 import configparser
-import openai
+import itertools
 import time
 import os
+import shutil
+import sys
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from batch_api import (
+    DEFAULT_MAX_REQUESTS_PER_FILE,
+    TERMINAL_STATUSES,
+    BatchRun,
+    create_batch,
+    download_file,
+    get_batch,
+    iter_results,
+    request_line,
+    upload_file,
+)
+from checkpoint import RunCheckpoint
+from incremental import IncrementalState
+from near_duplicates import DEFAULT_NUM_PERM, DEFAULT_THRESHOLD, NearDuplicateIndex
+from shards import iter_shard_rows, shard_offsets
 
 # Use absolute paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_PATH = os.path.join(BASE_DIR, "config.ini")
 CSV_PATH = os.path.join(BASE_DIR, "NHS.UK ServiceNow Cases Q1 2025.csv")
 OUTPUT_PATH = os.path.join(BASE_DIR, "NHS.UK ServiceNow Cases Q1 2025 - Categorized.csv")
+
+# Helpers shared with the Function app live in azure-function/shared_code
+FUNCTION_APP_DIR = os.path.join(BASE_DIR, "azure-function")
+if FUNCTION_APP_DIR not in sys.path:
+    sys.path.append(FUNCTION_APP_DIR)
+
+from shared_code.batching import (
+    DEFAULT_BATCH_TOKEN_BUDGET,
+    batch_max_tokens,
+    build_batch_messages,
+    estimate_batch_tokens,
+    parse_batch_response,
+)
+from shared_code.cache import DEFAULT_MAX_ENTRIES, DEFAULT_TTL_DAYS, ClassificationCache
+from shared_code.categories import CATEGORIES_VERSION, NON_CATEGORY_VALUES
+from shared_code.category_codes import build_code_messages, category_from_reply, code_request_options
+from shared_code.deployment_pool import DEFAULT_EJECT_AFTER, DEFAULT_EJECT_SECONDS, Deployment, DeploymentPool
+from shared_code.local_classifier import DEFAULT_THRESHOLD as DEFAULT_LOCAL_THRESHOLD, LocalClassifier
+from shared_code.metrics import MetricsRecorder
+from shared_code.openai_client import close_async_clients, get_async_client, get_client
+from shared_code.preprocess import (
+    DEFAULT_MAX_TOKENS as DEFAULT_DESCRIPTION_TOKENS,
+    DescriptionPreprocessor,
+    has_tokenizer,
+    preprocess_version,
+    set_preprocessor,
+)
+from shared_code.prompts import DEFAULT_MAX_EXAMPLES, build_messages, load_examples, prompt_version, set_prompt_layouts
+from shared_code.readers import TicketFileReader, compression_for_path, open_output_file
+from shared_code.rate_limiter import (
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    DEFAULT_TOKENS_PER_MINUTE,
+    RateLimiter,
+    estimate_message_tokens,
+    estimate_tokens,
+)
+
 DESCRIPTION_COL = "Description"
 CATEGORY_COL = "Category"
+CACHE_PATH = os.path.join(BASE_DIR, "classification_cache.sqlite")
+LOCAL_MODEL_PATH = os.path.join(BASE_DIR, "local_classifier.json")
+EMBEDDING_INDEX_PATH = os.path.join(BASE_DIR, "embedding_index.npy")
+INCREMENTAL_STATE_PATH = os.path.join(BASE_DIR, "incremental_state.sqlite")
+DEFAULT_MAX_TICKETS = 20
+DEFAULT_CONCURRENCY = 8
+DEFAULT_CHECKPOINT_INTERVAL = 100
+DEFAULT_BATCH_POLL_INTERVAL = 60
+# Input limit of the text-embedding-3 and ada-002 models
+DEFAULT_EMBEDDING_INPUT_TOKENS = 8191
+
+
+def load_files_config(path):
+    """Input export and output file from the optional [files] section, relative to this directory.
 
-CATEGORIES = [
-    "NHSUK Spam/Marketing",
-    "NHSUK Profiles",
-    "NHSuk Unsupported Service",
-    "NHSUK Content Management Service",
-    "NHSUK Data Services - Directories",
-    "NHSUK Ratings & Reviews",
-    "NHSuk Generic Service",
-    "NHSUK Data Services - GDoS",
-    "NHSUK Personal Medical Query",
-    "NHSUK Find A Service",
-    "NHSUK Syndication",
-    "NHSUK Health Assessment Tools",
-    "NHSUK Internal Tech Request",
-    "NHSUK Find Your NHS Number",
-    "Z_Retired P0 & P5 Web Service",
-    "NBS Q-Flow Acct Mgmt",
-    "NSD Unsupported Service",
-    "NBS Patient Journey",
-    "NHSUK Give Us Feedback Form",
-    "NHSUK Campaigns",
-    "Patient Facing",
-    "Profile manager (GP Reg)",
-    "NHS App National Services",
-    "GeneralPracticeAnnualSelfDeclaration-eDec",
-    "NHSUK Authenticated Website",
-    "Post event message to GP",
-    "CSF – Junk NSD"
-]
+    The input may be a CSV, JSON Lines or XLSX export, gzip or zstd
+    compressed. An output path ending in .gz or .zst is written compressed.
+    """
+    config = configparser.ConfigParser()
+    config.read(path)
+    return {
+        'input': os.path.join(BASE_DIR, config.get('files', 'input', fallback=CSV_PATH)),
+        'output': os.path.join(BASE_DIR, config.get('files', 'output', fallback=OUTPUT_PATH)),
+    }
+
+def open_output(path, mode='w'):
+    """Text file for writing output rows, compressed as its extension says"""
+    return open_output_file(path, mode, compression_for_path(path))
+
+def temporary_output_path(path):
+    """Name to write a replacement output under, keeping a compression extension last"""
+    root, extension = os.path.splitext(path)
+    if compression_for_path(path):
+        return root + ".tmp" + extension
+    return path + ".tmp"
 
 def load_config(path):
     print(f"Loading configuration from: {path}")
@@ -69,92 +133,1238 @@ def load_config(path):
     print(f"Config loaded: {safe_config}")
     return config_section
 
-def classify_ticket(description, openai_config):
-    prompt = f"""
-Classify the following service desk ticket into one of these categories:
-{', '.join(CATEGORIES)}
+def load_processing_config(path):
+    """Read the optional [processing] section of config.ini"""
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    processing_config = {
+        'concurrency': config.getint('processing', 'concurrency', fallback=DEFAULT_CONCURRENCY),
+        'requests_per_minute': config.getint('processing', 'requests_per_minute', fallback=DEFAULT_REQUESTS_PER_MINUTE),
+        'tokens_per_minute': config.getint('processing', 'tokens_per_minute', fallback=DEFAULT_TOKENS_PER_MINUTE),
+        'max_retries': config.getint('processing', 'max_retries', fallback=DEFAULT_MAX_RETRIES),
+        'batch_size': config.getint('processing', 'batch_size', fallback=1),
+        'batch_token_budget': config.getint('processing', 'batch_token_budget', fallback=DEFAULT_BATCH_TOKEN_BUDGET),
+        # 0 processes the whole export
+        'max_tickets': config.getint('processing', 'max_tickets', fallback=DEFAULT_MAX_TICKETS),
+        'resume': config.getboolean('processing', 'resume', fallback=True),
+        'checkpoint_interval': config.getint('processing', 'checkpoint_interval', fallback=DEFAULT_CHECKPOINT_INTERVAL),
+        'error_retries': config.getint('processing', 'error_retries', fallback=1),
+        # "chat" (Azure OpenAI chat completions), "embeddings" (nearest centroid)
+        # or "batch" (offline, through the Azure OpenAI Batch API)
+        'backend': config.get('processing', 'backend', fallback='chat'),
+        # Above 1, whole-export runs are split into byte-range shards classified in parallel processes
+        'processes': config.getint('processing', 'processes', fallback=1),
+        # With [deployment:*] sections: consecutive 429s/5xx before a deployment is ejected, and for how long
+        'eject_after': config.getint('processing', 'eject_after', fallback=DEFAULT_EJECT_AFTER),
+        'eject_seconds': config.getfloat('processing', 'eject_seconds', fallback=DEFAULT_EJECT_SECONDS),
+    }
+    if processing_config['backend'] not in ('chat', 'embeddings', 'batch'):
+        raise ValueError("backend in [processing] must be chat, embeddings or batch")
+    for key in ('concurrency', 'requests_per_minute', 'tokens_per_minute', 'batch_size', 'checkpoint_interval',
+                'processes'):
+        if processing_config[key] < 1:
+            raise ValueError(f"{key} in [processing] must be at least 1")
+
+    print(f"Processing config: {processing_config}")
+    return processing_config
+
+def load_cache_config(path):
+    """Read the optional [cache] section of config.ini"""
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    cache_config = {
+        'enabled': config.getboolean('cache', 'enabled', fallback=True),
+        'path': os.path.join(BASE_DIR, config.get('cache', 'path', fallback=CACHE_PATH)),
+        'ttl_days': config.getfloat('cache', 'ttl_days', fallback=DEFAULT_TTL_DAYS),
+        'max_entries': config.getint('cache', 'max_entries', fallback=DEFAULT_MAX_ENTRIES),
+        'warm_from_output': config.getboolean('cache', 'warm_from_output', fallback=True),
+    }
+    print(f"Cache config: {cache_config}")
+    return cache_config
+
+def open_cache(cache_config):
+    """Open the classification cache, or None if it is disabled"""
+    if not cache_config['enabled']:
+        return None
+
+    return ClassificationCache(
+        path=cache_config['path'],
+        ttl_days=cache_config['ttl_days'],
+        max_entries=cache_config['max_entries'],
+    )
+
+def output_classifier_path(output_path):
+    return output_path + ".classifier"
+
+def warm_cache(cache, cache_config, model, output_path, classifier, chat_classifier):
+    """Warm the cache from the previous output file, if this chat model wrote it.
 
-Ticket Description:
-{description}
+    The output records the classifier_id that produced it. Outputs of the
+    embeddings backend, the local classifier or another prompt aren't chat
+    answers, so they are not loaded under the chat model's key. The record
+    is then removed until this run completes.
+    """
+    record_path = output_classifier_path(output_path)
+    previous = None
+    if os.path.exists(record_path):
+        with open(record_path, encoding='utf-8') as f:
+            previous = f.read().strip()
+        os.remove(record_path)
+    # The output file is truncated below, so harvest its categories first
+    if (cache and cache_config['warm_from_output'] and classifier == chat_classifier == previous
+            and os.path.exists(output_path)):
+        added = cache.warm_from_csv(output_path, model, DESCRIPTION_COL, CATEGORY_COL)
+        print(f"Warmed cache with {added} classifications from {output_path}")
 
-Category:
-"""
+def record_output_classifier(output_path, classifier):
+    """Note which classifier wrote a completed output, for warm_cache on the next run"""
+    with open(output_classifier_path(output_path), 'w', encoding='utf-8') as f:
+        f.write(classifier + "\n")
+
+def load_deployments_config(path, openai_config, processing_config, shards=1):
+    """Read the optional [deployment:<name>] sections of config.ini; without any, [azure_openai] is the only one.
+
+    Each section may set endpoint, api_key, api_version, model, weight,
+    requests_per_minute and tokens_per_minute; missing values come from
+    [azure_openai] and [processing]. Quotas set in a section are split
+    between `shards` processes, as [processing] ones already are.
+    """
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    sections = [name for name in config.sections() if name.startswith('deployment:')]
+    deployments = []
+    for section in sections or [None]:
+        settings = config[section] if section else {}
+        deployment = {
+            'name': section.split(':', 1)[1].strip() if section else None,
+            'endpoint': settings.get('endpoint', openai_config['endpoint']),
+            'api_key': settings.get('api_key', openai_config['api_key']),
+            'api_version': settings.get('api_version', openai_config['api_version']),
+            'model': settings.get('model', openai_config['model']),
+            'weight': float(settings.get('weight', 1.0)),
+        }
+        for key in ('requests_per_minute', 'tokens_per_minute'):
+            deployment[key] = (max(1, int(settings[key]) // shards) if key in settings
+                               else processing_config[key])
+        deployments.append(deployment)
+
+    if sections:
+        print(f"Deployments: {[(d['name'], d['endpoint'], d['model'], d['weight']) for d in deployments]}")
+    return deployments
+
+def open_deployment_pool(deployments, processing_config, metrics=None):
+    """DeploymentPool over the configured deployments, with connections for `concurrency` requests each"""
+    return DeploymentPool(
+        [Deployment(max_connections=processing_config['concurrency'], **deployment) for deployment in deployments],
+        max_retries=processing_config['max_retries'],
+        metrics=metrics,
+        eject_after=processing_config['eject_after'],
+        eject_seconds=processing_config['eject_seconds'],
+    )
+
+def build_ticket_request(description, openai_config):
+    """Chat messages and completion options for one ticket; [azure_openai] category_codes asks for a number only"""
+    if openai_config.getboolean('category_codes', fallback=False):
+        return build_code_messages(description), code_request_options(openai_config['model'])
+    return build_messages(description), {'max_tokens': 20}
+
+def classify_ticket(description, openai_config):
+    messages, options = build_ticket_request(description, openai_config)
     print(f"Connecting to Azure OpenAI at: {openai_config['endpoint']}")
     print(f"Using model: {openai_config['model']}")
     
     try:
-        client = openai.AzureOpenAI(
-            api_key=openai_config['api_key'],
-            api_version=openai_config['api_version'],
-            azure_endpoint=openai_config['endpoint'],
-            timeout=30.0  # Add a 30-second timeout
+        client = get_client(
+            openai_config['endpoint'],
+            openai_config['api_key'],
+            openai_config['api_version']
         )
         
         print("Sending request to Azure OpenAI...")
         response = client.chat.completions.create(
             model=openai_config['model'],
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=20,
-            temperature=0
+            messages=messages,
+            temperature=0,
+            **options
         )
-        category = response.choices[0].message.content.strip()
-        return category
+        return category_from_reply(response.choices[0].message.content)
     except Exception as e:
         print(f"Connection error details: {str(e)}")
         raise
 
+def load_dedupe_config(path):
+    """Read the optional [dedupe] section of config.ini"""
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    dedupe_config = {
+        'enabled': config.getboolean('dedupe', 'enabled', fallback=True),
+        'threshold': config.getfloat('dedupe', 'threshold', fallback=DEFAULT_THRESHOLD),
+        'num_perm': config.getint('dedupe', 'num_perm', fallback=DEFAULT_NUM_PERM),
+    }
+    print(f"Dedupe config: {dedupe_config}")
+    return dedupe_config
+
+def load_local_classifier_config(path):
+    """Read the optional [local_classifier] section of config.ini"""
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    training_files = config.get('local_classifier', 'training_files', fallback=load_files_config(path)['output'])
+    local_config = {
+        'enabled': config.getboolean('local_classifier', 'enabled', fallback=False),
+        'model_path': config.get('local_classifier', 'model_path', fallback=LOCAL_MODEL_PATH),
+        'threshold': config.getfloat('local_classifier', 'threshold', fallback=DEFAULT_LOCAL_THRESHOLD),
+        'training_files': [
+            os.path.join(BASE_DIR, name.strip()) for name in training_files.splitlines() if name.strip()
+        ],
+    }
+    print(f"Local classifier config: {local_config}")
+    return local_config
+
+def open_local_classifier(local_config):
+    """Load the trained local classifier, or None if it is disabled or not trained yet"""
+    if not local_config['enabled']:
+        return None
+    if not os.path.exists(local_config['model_path']):
+        print(f"Local classifier model not found at {local_config['model_path']}; "
+              f"run train_local_classifier.py first. Sending every ticket to Azure OpenAI.")
+        return None
+    return LocalClassifier.load(local_config['model_path'], local_config['threshold'])
+
+def load_embedding_config(path):
+    """Read the optional [embeddings] section of config.ini"""
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    training_files = config.get('embeddings', 'training_files', fallback=load_files_config(path)['output'])
+    embedding_config = {
+        'model': config.get('embeddings', 'model', fallback='text-embedding-3-small'),
+        'index_path': config.get('embeddings', 'index_path', fallback=EMBEDDING_INDEX_PATH),
+        'mode': config.get('embeddings', 'mode', fallback='centroid'),
+        'batch_size': config.getint('embeddings', 'batch_size', fallback=256),
+        'max_input_tokens': config.getint('embeddings', 'max_input_tokens', fallback=DEFAULT_EMBEDDING_INPUT_TOKENS),
+        'agreement_sample': config.getint('embeddings', 'agreement_sample', fallback=50),
+        'training_files': [
+            os.path.join(BASE_DIR, name.strip()) for name in training_files.splitlines() if name.strip()
+        ],
+    }
+    if embedding_config['batch_size'] < 1:
+        raise ValueError("batch_size in [embeddings] must be at least 1")
+    if embedding_config['max_input_tokens'] < 16:
+        raise ValueError("max_input_tokens in [embeddings] must be at least 16")
+    print(f"Embedding config: {embedding_config}")
+    return embedding_config
+
+def open_embedding_index(embedding_config):
+    """Load the exemplar index built by build_embedding_index.py"""
+    from embedding_classifier import EmbeddingIndex
+
+    index = EmbeddingIndex.load(embedding_config['index_path'], embedding_config['mode'])
+    if index.model != embedding_config['model']:
+        raise ValueError(f"{embedding_config['index_path']} was built with {index.model}, "
+                         f"not {embedding_config['model']}; rebuild it with build_embedding_index.py")
+    print(f"Loaded embedding index: {len(index.labels)} tickets in {len(index.classes)} categories")
+    return index
+
+def load_batch_config(path, model):
+    """Read the optional [batch] section of config.ini, used with backend = batch"""
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    batch_config = {
+        # A Global Batch deployment; its quota is separate from the real-time deployment's
+        'deployment': config.get('batch', 'deployment', fallback=model),
+        'completion_window': config.get('batch', 'completion_window', fallback='24h'),
+        'poll_interval': config.getfloat('batch', 'poll_interval', fallback=DEFAULT_BATCH_POLL_INTERVAL),
+        # false submits or checks the batches once and exits; run again later to collect the results
+        'wait': config.getboolean('batch', 'wait', fallback=True),
+        'max_requests_per_file': config.getint('batch', 'max_requests_per_file',
+                                               fallback=DEFAULT_MAX_REQUESTS_PER_FILE),
+    }
+    print(f"Batch config: {batch_config}")
+    return batch_config
+
+def write_batch_files(batch_run, openai_config, processing_config, batch_config, cache=None):
+    """Write one request line per distinct uncached description; returns the new run state.
+
+    Lines are tagged with the position of the first input row that has the
+    description, which is how results are joined back onto the CSV.
+    """
+    deployment = batch_config['deployment']
+    parts = []
+    seen = set()
+    batch_file = None
+    with TicketFileReader(batch_run.input_path) as reader:
+        rows = itertools.islice(reader, processing_config['max_tickets'] or None)
+        for position, row in enumerate(rows):
+            description = row.get(DESCRIPTION_COL)
+            if not description or description in seen or (cache and cache.get(description, deployment)):
+                continue
+            seen.add(description)
+            if batch_file is None or parts[-1][1] >= batch_config['max_requests_per_file']:
+                if batch_file:
+                    batch_file.close()
+                parts.append([batch_run.part_path(len(parts), 'input'), 0])
+                batch_file = open(parts[-1][0], 'w', encoding='utf-8')
+            messages, options = build_ticket_request(description, openai_config)
+            batch_file.write(request_line(f"row-{position}", deployment, messages, {'temperature': 0, **options}))
+            parts[-1][1] += 1
+    if batch_file:
+        batch_file.close()
+    print(f"Wrote {sum(requests for _, requests in parts)} requests to {len(parts)} batch input files")
+    return batch_run.new_state(deployment, parts)
+
+def run_batches(client, batch_run, state, batch_config):
+    """Submit the parts that have no batch yet, then poll until every batch has finished.
+
+    Ids and statuses are saved as soon as they are known. Returns False if
+    [batch] wait is off and batches are still running.
+    """
+    for part in state['parts']:
+        if not part.get('input_file_id'):
+            part['input_file_id'] = upload_file(client, part['input_path'])
+            batch_run.save(state)
+        if not part.get('batch_id'):
+            batch = create_batch(client, part['input_file_id'], batch_config['completion_window'])
+            part['batch_id'], part['status'] = batch['id'], batch['status']
+            batch_run.save(state)
+            print(f"Submitted batch {part['batch_id']} with {part['requests']} requests")
+
+    while True:
+        for number, part in enumerate(state['parts']):
+            if part['status'] in TERMINAL_STATUSES:
+                continue
+            batch = get_batch(client, part['batch_id'])
+            counts = batch.get('request_counts') or {}
+            print(f"Batch {part['batch_id']}: {batch['status']} "
+                  f"({counts.get('completed', 0)} completed, {counts.get('failed', 0)} failed "
+                  f"of {counts.get('total', part['requests'])})")
+            if batch['status'] in TERMINAL_STATUSES:
+                # Expired and cancelled batches still return the results they finished
+                for file_key, path_key, kind in (('output_file_id', 'output_path', 'output'),
+                                                 ('error_file_id', 'error_path', 'errors')):
+                    if batch.get(file_key):
+                        part[path_key] = batch_run.part_path(number, kind)
+                        download_file(client, batch[file_key], part[path_key])
+                if batch['status'] == 'failed':
+                    print(f"Batch {part['batch_id']} failed: {batch.get('errors')}")
+            part['status'] = batch['status']
+            batch_run.save(state)
+
+        if all(part['status'] in TERMINAL_STATUSES for part in state['parts']):
+            return True
+        if not batch_config['wait']:
+            return False
+        time.sleep(batch_config['poll_interval'])
+
+def classify_with_batch_api(csv_path, output_path, openai_config, processing_config, batch_config, cache=None):
+    """Classify the input through the Azure OpenAI Batch API and write the output CSV.
+
+    Rerunning after an interruption picks up the submitted batches from the
+    BatchRun state file. Requests that fail in the batch are written as
+    "Error"; a later run resubmits only those, since the others are cached.
+    Returns the number of rows written, or None while batches are running.
+    """
+    batch_run = BatchRun(csv_path, output_path)
+    deployment = batch_config['deployment']
+    state = batch_run.load(deployment)
+    if state:
+        print(f"Resuming Batch API run from {batch_run.path}")
+    else:
+        state = write_batch_files(batch_run, openai_config, processing_config, batch_config, cache)
+        batch_run.save(state)
+
+    client = get_client(openai_config['endpoint'], openai_config['api_key'], openai_config['api_version'])
+    if not run_batches(client, batch_run, state, batch_config):
+        print(f"Batches are still running; run again to collect the results (state in {batch_run.path})")
+        return None
+
+    # {input row position: category} for every answered request
+    results = {}
+    prompt_tokens = completion_tokens = 0
+    for part in state['parts']:
+        for path_key in ('output_path', 'error_path'):
+            if not part.get(path_key):
+                continue
+            for custom_id, content, usage in iter_results(part[path_key]):
+                category = "Error"
+                if content is not None:
+                    try:
+                        category = category_from_reply(content)
+                    except ValueError:
+                        pass
+                    prompt_tokens += (usage or {}).get('prompt_tokens', 0)
+                    completion_tokens += (usage or {}).get('completion_tokens', 0)
+                results[int(custom_id.split('-', 1)[1])] = category
+
+    categories = {}
+    count = 0
+    tmp_path = temporary_output_path(output_path)
+    with TicketFileReader(csv_path) as reader, open_output(tmp_path) as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames + [CATEGORY_COL])
+        writer.writeheader()
+        for position, row in enumerate(itertools.islice(reader, processing_config['max_tickets'] or None)):
+            description = row.get(DESCRIPTION_COL)
+            if not description:
+                category = "No Description"
+            elif position in results:
+                category = categories[description] = results[position]
+            else:
+                # Repeats of a submitted description, or answered from the cache when the files were written
+                category = categories.get(description) or (cache and cache.get(description, deployment)) or "Error"
+            row[CATEGORY_COL] = category
+            writer.writerow(row)
+            count += 1
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(tmp_path, output_path)
+    if cache:
+        cache.put_many(categories.items(), deployment)
+
+    failed = sum(1 for category in results.values() if category == "Error")
+    print(f"Batch API answered {len(results) - failed} of {len(results)} requests "
+          f"({prompt_tokens} prompt, {completion_tokens} completion tokens)")
+    batch_run.remove(state)
+    return count
+
+def load_metrics_config(path):
+    """Read the optional [metrics] section of config.ini"""
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    prices = None
+    if config.has_option('metrics', 'input_price'):
+        input_price = config.getfloat('metrics', 'input_price')
+        prices = (
+            input_price,
+            config.getfloat('metrics', 'cached_input_price', fallback=input_price),
+            config.getfloat('metrics', 'output_price', fallback=0.0),
+        )
+    log_path = config.get('metrics', 'log_path', fallback='')
+    metrics_config = {
+        'enabled': config.getboolean('metrics', 'enabled', fallback=True),
+        # USD per million (input, cached input, output) tokens; None uses the built-in price list
+        'prices': prices,
+        'log_path': os.path.join(BASE_DIR, log_path) if log_path else None,
+    }
+    print(f"Metrics config: {metrics_config}")
+    return metrics_config
+
+def open_metrics(metrics_config):
+    if not metrics_config['enabled']:
+        return None
+    return MetricsRecorder(prices=metrics_config['prices'], log_path=metrics_config['log_path'])
+
+def load_preprocess_config(path):
+    """Read the optional [preprocess] section of config.ini"""
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    preprocess_config = {
+        'enabled': config.getboolean('preprocess', 'enabled', fallback=True),
+        # Strip HTML, quoted replies, signatures and disclaimers
+        'clean': config.getboolean('preprocess', 'clean', fallback=True),
+        # Description tokens kept per ticket; 0 keeps them all
+        'max_tokens': config.getint('preprocess', 'max_tokens', fallback=DEFAULT_DESCRIPTION_TOKENS),
+    }
+    print(f"Preprocess config: {preprocess_config}")
+    return preprocess_config
+
+def open_preprocessor(preprocess_config, model, metrics=None):
+    """Apply the [preprocess] settings to every prompt this process builds; call before opening the cache"""
+    preprocessor = None
+    if preprocess_config['enabled']:
+        preprocessor = DescriptionPreprocessor(
+            max_tokens=preprocess_config['max_tokens'],
+            clean=preprocess_config['clean'],
+            model=model,
+            metrics=metrics,
+        )
+    set_preprocessor(preprocessor)
+
+def load_prompt_config(path):
+    """Read the optional [prompt] section of config.ini"""
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    examples_file = config.get('prompt', 'examples_file', fallback='')
+    prompt_config = {
+        # A classified export to take few-shot examples from, one category after another
+        'examples_file': os.path.join(BASE_DIR, examples_file) if examples_file else None,
+        'max_examples': config.getint('prompt', 'max_examples', fallback=DEFAULT_MAX_EXAMPLES),
+        # Fill the static prompt prefix up to the size Azure OpenAI starts caching at
+        'pad_to_cache_threshold': config.getboolean('prompt', 'pad_to_cache_threshold', fallback=False),
+    }
+    print(f"Prompt config: {prompt_config}")
+    return prompt_config
+
+def open_prompt_layout(prompt_config, model):
+    """Apply the [prompt] settings to every prompt this process builds; call before opening the cache"""
+    examples = ()
+    if prompt_config['examples_file']:
+        examples = load_examples(prompt_config['examples_file'], prompt_config['max_examples'])
+        print(f"Loaded {len(examples)} few-shot examples from {prompt_config['examples_file']}")
+    set_prompt_layouts(examples, pad=prompt_config['pad_to_cache_threshold'], model=model)
+
+def load_incremental_config(path):
+    """Read the optional [incremental] section of config.ini"""
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    state_path = config.get('incremental', 'state_path', fallback='')
+    incremental_config = {
+        'enabled': config.getboolean('incremental', 'enabled', fallback=False),
+        # ServiceNow case number, and the timestamp ServiceNow moves on every change
+        'key_column': config.get('incremental', 'key_column', fallback='Number'),
+        'updated_column': config.get('incremental', 'updated_column', fallback='Updated'),
+        'state_path': os.path.join(BASE_DIR, state_path) if state_path else INCREMENTAL_STATE_PATH,
+    }
+    print(f"Incremental config: {incremental_config}")
+    return incremental_config
+
+def classifier_id(openai_config, embedding_config=None, local=False):
+    """Identifies what produced a category; results from another classifier are not reused"""
+    if embedding_config:
+        return f"embeddings/{embedding_config['model']}/{embedding_config['mode']}/{CATEGORIES_VERSION}"
+    chat = f"{openai_config['model']}/{prompt_version()}/{preprocess_version()}/{CATEGORIES_VERSION}"
+    # Some tickets are answered by the local classifier instead of the model
+    return f"local+{chat}" if local else chat
+
+async def classify_ticket_async(description, openai_config, pool):
+    """Classify a ticket on the deployment the shared DeploymentPool picks"""
+    messages, options = build_ticket_request(description, openai_config)
+
+    async def request(deployment):
+        raw = await deployment.async_client().chat.completions.with_raw_response.create(
+            model=deployment.model,
+            messages=messages,
+            temperature=0,
+            **options
+        )
+        return raw.parse(), raw.headers
+
+    response = await pool.call_async(request, estimate_message_tokens(messages, max_tokens=options['max_tokens']))
+    return category_from_reply(response.choices[0].message.content)
+
+async def classify_batch_async(tickets, openai_config, pool):
+    """Classify (id, description) pairs in one request; returns {id: category} for valid answers"""
+    messages = build_batch_messages(tickets)
+
+    async def request(deployment):
+        raw = await deployment.async_client().chat.completions.with_raw_response.create(
+            model=deployment.model,
+            messages=messages,
+            max_tokens=batch_max_tokens(len(tickets)),
+            temperature=0,
+            response_format={"type": "json_object"}
+        )
+        return raw.parse(), raw.headers
+
+    response = await pool.call_async(request, estimate_batch_tokens(tickets))
+    return parse_batch_response(response.choices[0].message.content, [ticket_id for ticket_id, _ in tickets])
+
+def embedding_input_truncator(embedding_config):
+    """Cuts a description to the embedding model's input limit.
+
+    Without tiktoken the ~4 characters per token estimate can undercount
+    dense text such as pasted logs, so only half the limit is used.
+    """
+    model = embedding_config['model']
+    max_tokens = embedding_config.get('max_input_tokens', DEFAULT_EMBEDDING_INPUT_TOKENS)
+    if not has_tokenizer(model):
+        max_tokens //= 2
+    return DescriptionPreprocessor(max_tokens=max_tokens, clean=False, model=model).truncate
+
+async def embed_descriptions_async(descriptions, embedding_config, client, limiter):
+    """Embed many descriptions in one embeddings request, returned in input order"""
+    truncate = embedding_input_truncator(embedding_config)
+    descriptions = [truncate(d) for d in descriptions]
+
+    async def request():
+        raw = await client.embeddings.with_raw_response.create(
+            model=embedding_config['model'],
+            input=descriptions,
+        )
+        return raw.parse(), raw.headers
+
+    response = await limiter.call_async(request, sum(estimate_tokens(d) for d in descriptions))
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+async def _classify_description(description, index, openai_config, pool, semaphore, cache):
+    if not description:
+        print(f"Ticket {index + 1}: no description found")
+        return "No Description"
+
+    if cache:
+        category = cache.get(description, openai_config['model'])
+        if category:
+            print(f"Ticket {index + 1} classified as: {category} (cached)")
+            return category
+
+    async with semaphore:
+        try:
+            category = await classify_ticket_async(description, openai_config, pool)
+            print(f"Ticket {index + 1} classified as: {category}")
+        except Exception as e:
+            print(f"Error classifying ticket {index + 1}: {e}")
+            return "Error"
+
+    if cache:
+        cache.put(description, openai_config['model'], category)
+    return category
+
+class TicketBatcher:
+    """Packs tickets into multi-ticket requests for classify_rows_async.
+
+    submit() returns a future for one ticket. Queued tickets are sent once the
+    batch reaches `max_batch_size` or `token_budget`, or earlier through flush().
+    Entries missing or malformed in a batched answer are retried one at a time.
+    """
+
+    def __init__(self, openai_config, pool, semaphore, cache, max_batch_size, token_budget):
+        self.openai_config = openai_config
+        self.pool = pool
+        self.semaphore = semaphore
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+        self.token_budget = token_budget
+        self.batches = 0
+        self.retried = 0
+        self._queued = []
+        self._tasks = set()
+
+    def submit(self, index, description):
+        future = asyncio.get_running_loop().create_future()
+        category = None
+        if not description:
+            category = "No Description"
+        elif self.cache:
+            category = self.cache.get(description, self.openai_config['model'])
+        if category:
+            future.set_result(category)
+            return future
+
+        tickets = [(i + 1, d) for i, d, _ in self._queued] + [(index + 1, description)]
+        if self._queued and estimate_batch_tokens(tickets) > self.token_budget:
+            self.flush()
+        self._queued.append((index, description, future))
+        if len(self._queued) >= self.max_batch_size:
+            self.flush()
+        return future
+
+    def is_queued(self, future):
+        return any(queued is future for _, _, queued in self._queued)
+
+    def flush(self):
+        if not self._queued:
+            return
+        batch, self._queued = self._queued, []
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        tickets = [(index + 1, description) for index, description, _ in batch]
+        async with self.semaphore:
+            try:
+                results = await classify_batch_async(tickets, self.openai_config, self.pool)
+                self.batches += 1
+            except Exception as e:
+                print(f"Error classifying batch of {len(batch)} tickets: {e}")
+                results = {}
+
+        retries = []
+        for index, description, future in batch:
+            category = results.get(index + 1)
+            if category:
+                print(f"Ticket {index + 1} classified as: {category} (batched)")
+                if self.cache:
+                    self.cache.put(description, self.openai_config['model'], category)
+                future.set_result(category)
+            else:
+                retries.append((index, description, future))
+
+        self.retried += len(retries)
+        categories = await asyncio.gather(*[
+            _classify_description(description, index, self.openai_config, self.pool, self.semaphore, self.cache)
+            for index, description, _ in retries
+        ])
+        for (_, _, future), category in zip(retries, categories):
+            future.set_result(category)
+
+async def classify_rows_async(rows, openai_config, processing_config, cache=None, dedupe=None, start=0,
+                              local=None, metrics=None, deployments=None):
+    """Classify rows with up to `concurrency` requests in flight.
+
+    Yields (row, category) pairs in input order. At most 2 * concurrency
+    requests' worth of rows are buffered, so a slow ticket holds back the
+    output but not memory. Request pacing, 429 retries and failover are left
+    to the shared DeploymentPool.
+
+    With a NearDuplicateIndex, only the first ticket of each cluster is sent
+    to the model; later members reuse its result. With batch_size > 1,
+    tickets are sent batch_size at a time through a TicketBatcher. With a
+    LocalClassifier, tickets it is confident about never reach the model.
+    `start` is the input position of the first row, used in progress output.
+    Requests are recorded in `metrics`, a MetricsRecorder, if given, and
+    spread over `deployments` (from load_deployments_config by default).
+    """
+    concurrency = processing_config['concurrency']
+    batch_size = processing_config['batch_size']
+    if deployments is None:
+        deployments = load_deployments_config(CONFIG_PATH, openai_config, processing_config)
+    pool = open_deployment_pool(deployments, processing_config, metrics)
+    semaphore = asyncio.Semaphore(concurrency)
+    batcher = None
+    if batch_size > 1:
+        batcher = TicketBatcher(openai_config, pool, semaphore, cache,
+                                batch_size, processing_config['batch_token_budget'])
+    window = concurrency * batch_size * 2
+    pending = deque()
+    representatives = {}
+
+    async def next_result():
+        done_row, done_task = pending.popleft()
+        if batcher and batcher.is_queued(done_task):
+            batcher.flush()
+        return done_row, await done_task
+
+    try:
+        for index, row in enumerate(rows, start):
+            description = row.get(DESCRIPTION_COL) or ""
+            local_category = local.classify(description) if local and description else None
+            cluster_id, is_new = None, True
+            if dedupe and description and not local_category:
+                cluster_id, is_new = dedupe.assign(description)
+            if local_category:
+                print(f"Ticket {index + 1} classified as: {local_category} (local)")
+                task = asyncio.get_running_loop().create_future()
+                task.set_result(local_category)
+            elif not is_new:
+                task = representatives[cluster_id]
+            elif batcher:
+                task = batcher.submit(index, description)
+            else:
+                task = asyncio.create_task(_classify_description(
+                    description, index, openai_config, pool, semaphore, cache
+                ))
+            if is_new and cluster_id is not None:
+                representatives[cluster_id] = task
+            pending.append((row, task))
+
+            while pending and (len(pending) >= window or pending[0][1].done()):
+                yield await next_result()
+
+        if batcher:
+            batcher.flush()
+        while pending:
+            yield await next_result()
+    finally:
+        for _, task in pending:
+            task.cancel()
+        await close_async_clients()
+        if batcher and batcher.batches:
+            print(f"Sent {batcher.batches} batched requests; {batcher.retried} tickets retried individually")
+        if len(pool.deployments) > 1:
+            print(f"Deployments: {pool.stats()}")
+        if local:
+            stats = local.stats()
+            saved = stats['local'] * pool.average_request_seconds()
+            print(f"Local classifier: {stats}; about {saved:.1f}s of Azure OpenAI request time saved")
+
+async def classify_rows_embeddings_async(rows, openai_config, processing_config, embedding_config, index, start=0,
+                                         metrics=None):
+    """Classify rows against an EmbeddingIndex instead of the chat model.
+
+    Descriptions are embedded `batch_size` at a time, with up to
+    `concurrency` embedding requests in flight, and each batch is scored in
+    one matrix product. Yields (row, category) pairs in input order.
+    """
+    concurrency = processing_config['concurrency']
+    client = get_async_client(
+        openai_config['endpoint'],
+        openai_config['api_key'],
+        openai_config['api_version'],
+        max_connections=concurrency
+    )
+    limiter = RateLimiter(
+        requests_per_minute=processing_config['requests_per_minute'],
+        tokens_per_minute=processing_config['tokens_per_minute'],
+        max_retries=processing_config['max_retries'],
+        metrics=metrics,
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def classify_chunk(chunk):
+        described = [i for i, (_, row) in enumerate(chunk) if row.get(DESCRIPTION_COL)]
+        categories = ["No Description"] * len(chunk)
+        if not described:
+            return categories
+        async with semaphore:
+            try:
+                embeddings = await embed_descriptions_async(
+                    [chunk[i][1][DESCRIPTION_COL] for i in described], embedding_config, client, limiter
+                )
+            except Exception as e:
+                print(f"Error embedding tickets {chunk[0][0] + 1}-{chunk[-1][0] + 1}: {e}")
+                for i in described:
+                    categories[i] = "Error"
+                return categories
+        for i, (category, _) in zip(described, index.classify(embeddings)):
+            categories[i] = category
+        return categories
+
+    numbered = enumerate(rows, start)
+    pending = deque()
+    try:
+        while True:
+            chunk = list(itertools.islice(numbered, embedding_config['batch_size']))
+            if chunk:
+                pending.append((chunk, asyncio.create_task(classify_chunk(chunk))))
+            while pending and (not chunk or len(pending) >= concurrency * 2 or pending[0][1].done()):
+                done_chunk, task = pending.popleft()
+                for (number, row), category in zip(done_chunk, await task):
+                    print(f"Ticket {number + 1} classified as: {category}")
+                    yield row, category
+            if not chunk:
+                break
+    finally:
+        for _, task in pending:
+            task.cancel()
+        await close_async_clients()
+
+async def classify_csv_async(results, writer, outfile, processing_config, checkpoint=None, start=0):
+    """Write (row, category) results, committing a checkpoint every checkpoint_interval rows"""
+    count = 0
+    interval = processing_config['checkpoint_interval']
+    async for row, category in results:
+        row[CATEGORY_COL] = category
+        writer.writerow(row)
+        count += 1
+        if checkpoint and count % interval == 0:
+            checkpoint.commit(start + count, outfile)
+    if checkpoint:
+        checkpoint.commit(start + count, outfile)
+    return count
+
+async def _collect_categories(results):
+    return [category async for _, category in results]
+
+def open_backend(openai_config, processing_config, cache=None, metrics=None, shards=1):
+    """Set up the configured backend; returns (classify_rows, dedupe, embedding_config, index, classifier).
+
+    `classifier` is the classifier_id of the backend.
+
+    `classify_rows(rows, start=0, retry=False)` returns the async (row, category)
+    results of the backend. Failed tickets retried with retry=True go straight
+    back to the model, skipping near-duplicate grouping and the local classifier.
+    """
+    dedupe_config = load_dedupe_config(CONFIG_PATH)
+    dedupe = None
+    if dedupe_config['enabled']:
+        dedupe = NearDuplicateIndex(dedupe_config['threshold'], dedupe_config['num_perm'])
+    local = open_local_classifier(load_local_classifier_config(CONFIG_PATH))
+    deployments = load_deployments_config(CONFIG_PATH, openai_config, processing_config, shards)
+    embedding_config = index = None
+    if processing_config['backend'] == 'embeddings':
+        embedding_config = load_embedding_config(CONFIG_PATH)
+        index = open_embedding_index(embedding_config)
+
+    def classify_rows(rows, start=0, retry=False):
+        if index is not None:
+            return classify_rows_embeddings_async(
+                rows, openai_config, processing_config, embedding_config, index, start, metrics
+            )
+        if retry:
+            return classify_rows_async(rows, openai_config, processing_config, cache, metrics=metrics,
+                                       deployments=deployments)
+        return classify_rows_async(rows, openai_config, processing_config, cache, dedupe, start, local, metrics,
+                                   deployments)
+
+    return classify_rows, dedupe, embedding_config, index, classifier_id(openai_config, embedding_config, local)
+
+def shard_output_path(output_path, number, shards):
+    return f"{output_path}.shard-{number + 1:03d}-of-{shards:03d}.csv"
+
+def classify_shard(csv_path, output_path, number, shards, start, end, fieldnames):
+    """Classify the input rows in bytes [start, end) into the shard's own output file.
+
+    Runs in a worker process with its own event loop, client and backend;
+    the concurrency and rate limits in [processing] are split evenly between
+    the shards. The paths are passed in rather than read from the module,
+    which a spawned worker imports afresh. Each shard output is checkpointed
+    separately, so a rerun picks every shard up where it stopped. Returns
+    (rows in the shard output, rows classified by this call).
+    """
+    openai_config = load_config(CONFIG_PATH)
+    processing_config = load_processing_config(CONFIG_PATH)
+    for key in ('concurrency', 'requests_per_minute', 'tokens_per_minute'):
+        processing_config[key] = max(1, processing_config[key] // shards)
+    # The parent process has already warmed the cache from the previous output
+    cache_config = load_cache_config(CONFIG_PATH)
+    open_prompt_layout(load_prompt_config(CONFIG_PATH), openai_config['model'])
+    metrics = open_metrics(load_metrics_config(CONFIG_PATH))
+    open_preprocessor(load_preprocess_config(CONFIG_PATH), openai_config['model'], metrics)
+    cache = open_cache(cache_config)
+    classify_rows, dedupe, _, _, _ = open_backend(openai_config, processing_config, cache, metrics, shards)
+
+    shard_path = shard_output_path(output_path, number, shards)
+    checkpoint = RunCheckpoint(csv_path, shard_path)
+    state = checkpoint.load() if processing_config['resume'] else None
+    if state:
+        checkpoint.truncate_output(state)
+        print(f"Resuming shard {number + 1} after {state['rows_done']} tickets")
+    skip = state['rows_done'] if state else 0
+
+    try:
+        with open(shard_path, 'a' if state else 'w', newline='', encoding='utf-8') as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=fieldnames + [CATEGORY_COL])
+            rows = itertools.islice(iter_shard_rows(csv_path, start, end, fieldnames), skip, None)
+            count = asyncio.run(classify_csv_async(
+                classify_rows(rows, skip), writer, outfile, processing_config, checkpoint, skip
+            ))
+    finally:
+        if cache:
+            cache.close()
+        if metrics:
+            metrics.close()
+    if dedupe:
+        print(f"Shard {number + 1} near-duplicate clusters: {dedupe.stats()}")
+    if metrics:
+        print(f"Shard {number + 1} {metrics.format_summary(count)}")
+    return skip + count, count
+
+def classify_sharded(csv_path, output_path, fieldnames, processes, outfile):
+    """Classify the input in `processes` shards in parallel and append their outputs to outfile in order.
+
+    Returns (rows written, rows classified by this run).
+    """
+    offsets = shard_offsets(csv_path, processes)
+    shards = len(offsets) - 1
+    print(f"Classifying {csv_path} in {shards} shards across {processes} processes")
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = list(pool.map(
+            classify_shard, [csv_path] * shards, [output_path] * shards, range(shards), [shards] * shards,
+            offsets[:-1], offsets[1:], [fieldnames] * shards
+        ))
+
+    # Shard outputs have no header, so they concatenate into the original row order
+    for number in range(shards):
+        with open(shard_output_path(output_path, number, shards), newline='', encoding='utf-8') as shard_file:
+            shutil.copyfileobj(shard_file, outfile)
+    for number in range(shards):
+        shard_path = shard_output_path(output_path, number, shards)
+        os.remove(shard_path)
+        os.remove(RunCheckpoint(csv_path, shard_path).path)
+    return sum(rows for rows, _ in results), sum(count for _, count in results)
+
+def requeue_errors(classify_rows, output_path):
+    """Re-classify output rows that failed with "Error" and rewrite the output file.
+
+    `classify_rows(rows)` returns the (row, category) results of the backend
+    in use. Returns the number of rows that were fixed.
+    """
+    with TicketFileReader(output_path) as reader:
+        failed = [
+            (position, row) for position, row in enumerate(reader)
+            if row.get(CATEGORY_COL) == "Error"
+        ]
+    if not failed:
+        return 0
+
+    print(f"\nRe-queueing {len(failed)} tickets that failed with Error...")
+    categories = asyncio.run(_collect_categories(classify_rows([row for _, row in failed])))
+    fixed = {
+        position: category
+        for (position, _), category in zip(failed, categories)
+        if category != "Error"
+    }
+    if not fixed:
+        return 0
+
+    tmp_path = temporary_output_path(output_path)
+    with TicketFileReader(output_path) as reader, open_output(tmp_path) as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
+        writer.writeheader()
+        for position, row in enumerate(reader):
+            if position in fixed:
+                row[CATEGORY_COL] = fixed[position]
+            writer.writerow(row)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(tmp_path, output_path)
+    return len(fixed)
+
+async def record_incremental_async(results, state, incremental_config, classifier, processing_config, untracked):
+    """Store (row, category) results in the incremental state; returns (count, rows that failed with Error).
+
+    Rows without a case number can't be tracked; their categories go into
+    `untracked`, keyed by description, for this run's output only.
+    """
+    key_col, updated_col = incremental_config['key_column'], incremental_config['updated_column']
+    count = 0
+    failed = []
+    async for row, category in results:
+        key = (row.get(key_col) or "").strip()
+        if key:
+            state.record(key, (row.get(updated_col) or "").strip(), classifier, category)
+        else:
+            untracked[row.get(DESCRIPTION_COL) or ""] = category
+        if category == "Error":
+            failed.append(row)
+        count += 1
+        if count % processing_config['checkpoint_interval'] == 0:
+            state.commit()
+    state.commit()
+    return count, failed
+
+def merge_incremental_output(csv_path, output_path, state, incremental_config, classifier, untracked):
+    """Rewrite the output with this export's tickets and their categories, then older tickets not in it.
+
+    Tickets of the export without a result for their current version (past
+    max_tickets) keep their row from the previous output, if they had one.
+    Tickets with no case number are written with their category from
+    `untracked`. Returns the number of those left out because this run did
+    not classify them.
+    """
+    key_col, updated_col = incremental_config['key_column'], incremental_config['updated_column']
+    written = set()
+    unnumbered = 0
+    tmp_path = temporary_output_path(output_path)
+    with TicketFileReader(csv_path) as reader, open_output(tmp_path) as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames + [CATEGORY_COL], extrasaction='ignore')
+        writer.writeheader()
+        for row in reader:
+            key = (row.get(key_col) or "").strip()
+            if not key:
+                category = untracked.get(row.get(DESCRIPTION_COL) or "")
+                if category:
+                    row[CATEGORY_COL] = category
+                    writer.writerow(row)
+                else:
+                    unnumbered += 1
+                continue
+            category = state.get(key, (row.get(updated_col) or "").strip(), classifier)
+            if category and key not in written:
+                row[CATEGORY_COL] = category
+                writer.writerow(row)
+                written.add(key)
+
+        if os.path.exists(output_path):
+            with TicketFileReader(output_path) as previous:
+                for row in previous:
+                    key = (row.get(key_col) or "").strip()
+                    if key and key not in written:
+                        writer.writerow(row)
+                        written.add(key)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(tmp_path, output_path)
+    return unnumbered
+
+def classify_incremental(csv_path, output_path, classify_rows, processing_config, incremental_config, classifier):
+    """Classify only the new and changed tickets of the export and merge them into the output.
+
+    Tickets are keyed by case number. One is sent to the model when the
+    IncrementalState has no answer for its current updated timestamp, or the
+    last answer was Error. Results are committed to the state as they
+    arrive, so an interrupted run picks up where it stopped. Returns the
+    number of tickets classified.
+    """
+    key_col, updated_col = incremental_config['key_column'], incremental_config['updated_column']
+    state = IncrementalState(incremental_config['state_path'])
+    try:
+        with TicketFileReader(csv_path) as reader:
+            missing = [col for col in (DESCRIPTION_COL, key_col, updated_col) if col not in reader.fieldnames]
+            if missing:
+                raise ValueError(f"Column(s) {missing} not found in the export. Available columns: {reader.fieldnames}")
+            # Tickets with no case number can't be tracked, so they are classified on every run
+            changed = (
+                row for row in reader
+                if not (row.get(key_col) or "").strip()
+                or not state.is_current(
+                    row[key_col].strip(), (row.get(updated_col) or "").strip(), classifier
+                )
+            )
+            rows = itertools.islice(changed, processing_config['max_tickets'] or None)
+            untracked = {}
+            count, failed = asyncio.run(record_incremental_async(
+                classify_rows(rows), state, incremental_config, classifier, processing_config, untracked
+            ))
+
+        for _ in range(processing_config['error_retries']):
+            if not failed:
+                break
+            print(f"\nRe-queueing {len(failed)} tickets that failed with Error...")
+            _, failed = asyncio.run(record_incremental_async(
+                classify_rows(failed, retry=True), state, incremental_config, classifier, processing_config,
+                untracked
+            ))
+
+        unnumbered = merge_incremental_output(csv_path, output_path, state, incremental_config, classifier, untracked)
+        if unnumbered:
+            print(f"Left out {unnumbered} tickets with no {key_col} that this run did not classify")
+        print(f"Incremental state: {state.stats()}")
+    finally:
+        state.close()
+    return count
+
+def report_agreement(output_path, openai_config, processing_config, sample_size):
+    """Compare the first classified output rows with the chat backend's answers"""
+    with TicketFileReader(output_path) as reader:
+        sample = list(itertools.islice(
+            (row for row in reader
+             if row.get(DESCRIPTION_COL) and row.get(CATEGORY_COL) not in NON_CATEGORY_VALUES),
+            sample_size
+        ))
+    if not sample:
+        return
+
+    print(f"\nChecking {len(sample)} tickets against the chat backend...")
+    chat_categories = asyncio.run(_collect_categories(
+        classify_rows_async([dict(row) for row in sample], openai_config, processing_config)
+    ))
+    disagreements = Counter(
+        (row[CATEGORY_COL], chat_category)
+        for row, chat_category in zip(sample, chat_categories)
+        if row[CATEGORY_COL] != chat_category
+    )
+    agreement = 1 - sum(disagreements.values()) / len(sample)
+    print(f"Embedding backend agrees with the chat backend on {agreement:.1%} of {len(sample)} tickets")
+    for (embedding_category, chat_category), count in disagreements.most_common(5):
+        print(f"  {count} x embeddings: {embedding_category} / chat: {chat_category}")
+
 def main():
     try:
+        files_config = load_files_config(CONFIG_PATH)
+        csv_path, output_path = files_config['input'], files_config['output']
         print(f"Starting ticket classification process...")
-        print(f"CSV file: {CSV_PATH}")
-        print(f"Output file: {OUTPUT_PATH}")
+        print(f"CSV file: {csv_path}")
+        print(f"Output file: {output_path}")
         
         # Check if the CSV file exists
-        if not os.path.exists(CSV_PATH):
-            print(f"Error: CSV file does not exist at {CSV_PATH}")
+        if not os.path.exists(csv_path):
+            print(f"Error: CSV file does not exist at {csv_path}")
             return
             
         openai_config = load_config(CONFIG_PATH)
+        processing_config = load_processing_config(CONFIG_PATH)
+        if processing_config['backend'] == 'batch':
+            # Offline backfills: the Batch API answers within the completion window
+            batch_config = load_batch_config(CONFIG_PATH, openai_config['model'])
+            if load_incremental_config(CONFIG_PATH)['enabled']:
+                print("Incremental runs need the chat or embeddings backend; submitting the whole export")
+            open_prompt_layout(load_prompt_config(CONFIG_PATH), batch_config['deployment'])
+            open_preprocessor(load_preprocess_config(CONFIG_PATH), batch_config['deployment'])
+            cache_config = load_cache_config(CONFIG_PATH)
+            cache = open_cache(cache_config)
+            classifier = classifier_id({**openai_config, 'model': batch_config['deployment']})
+            warm_cache(cache, cache_config, batch_config['deployment'], output_path, classifier, classifier)
+            start = time.time()
+            count = classify_with_batch_api(csv_path, output_path, openai_config, processing_config, batch_config,
+                                            cache)
+            if count is not None:
+                record_output_classifier(output_path, classifier)
+                print(f"\nClassification complete. Processed {count} tickets in {time.time() - start:.1f}s.")
+                print(f"Results written to: {output_path}")
+            if cache:
+                print(f"Cache stats: {cache.stats()}")
+                cache.close()
+            return
 
-        with open(CSV_PATH, newline='', encoding='utf-8') as infile, \
-             open(OUTPUT_PATH, 'w', newline='', encoding='utf-8') as outfile:
-            reader = csv.DictReader(infile)
-            
-            # Verify Description column exists
-            if DESCRIPTION_COL not in reader.fieldnames:
-                print(f"Error: '{DESCRIPTION_COL}' column not found in CSV. Available columns: {reader.fieldnames}")
-                return
+        open_prompt_layout(load_prompt_config(CONFIG_PATH), openai_config['model'])
+        metrics = open_metrics(load_metrics_config(CONFIG_PATH))
+        open_preprocessor(load_preprocess_config(CONFIG_PATH), openai_config['model'], metrics)
+        cache_config = load_cache_config(CONFIG_PATH)
+        cache = open_cache(cache_config)
+        classify_rows, dedupe, embedding_config, index, classifier = open_backend(
+            openai_config, processing_config, cache, metrics
+        )
+        warm_cache(cache, cache_config, openai_config['model'], output_path, classifier, classifier_id(openai_config))
+        incremental_config = load_incremental_config(CONFIG_PATH)
+        if incremental_config['enabled']:
+            # Only new and changed tickets are classified; the output is merged rather than rewritten
+            start = time.time()
+            count = classify_incremental(
+                csv_path, output_path, classify_rows, processing_config, incremental_config, classifier
+            )
+            elapsed = time.time() - start
+        else:
+            reader = TicketFileReader(csv_path)
+            # Shards are byte ranges of a plain CSV
+            shardable = reader.format == 'csv' and not reader.compression
+            sharded = processing_config['processes'] > 1 and not processing_config['max_tickets'] and shardable
+            if processing_config['processes'] > 1 and not shardable:
+                export = " ".join(filter(None, (reader.compression, reader.format)))
+                print(f"Only an uncompressed CSV can be split into shards; classifying the {export} export "
+                      f"in one process")
+
+            # Resume an interrupted run over the same input instead of starting again. A compressed
+            # output can't be cut back to a checkpoint, so it is written in one go.
+            checkpoint = None if compression_for_path(output_path) else RunCheckpoint(csv_path, output_path)
+            state = checkpoint.load() if checkpoint and processing_config['resume'] and not sharded else None
+            if state:
+                checkpoint.truncate_output(state)
+                print(f"Resuming after {state['rows_done']} tickets already written to {output_path}")
+            skip = state['rows_done'] if state else 0
+            max_tickets = processing_config['max_tickets'] or None
+
+            with reader, open_output(output_path, 'a' if state else 'w') as outfile:
+                # Verify Description column exists
+                if DESCRIPTION_COL not in (reader.fieldnames or []):
+                    print(f"Error: '{DESCRIPTION_COL}' column not found in the export. "
+                          f"Available columns: {reader.fieldnames}")
+                    return
                 
-            fieldnames = reader.fieldnames + [CATEGORY_COL]
-            writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-            writer.writeheader()
+                fieldnames = reader.fieldnames + [CATEGORY_COL]
+                writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+                if not state:
+                    writer.writeheader()
             
-            count = 0
-            for row in reader:
-                if count >= 20:
-                    break
-                    
-                print(f"\nProcessing ticket {count + 1}/20...")
-                description = row.get(DESCRIPTION_COL, "")
-                if description:
-                    print(f"Description: {description[:100]}..." if len(description) > 100 else f"Description: {description}")
-                    try:
-                        category = classify_ticket(description, openai_config)
-                        print(f"Classified as: {category}")
-                    except Exception as e:
-                        print(f"Error classifying ticket: {e}")
-                        category = "Error"
-                    time.sleep(1)  # avoid rate limits
+                start = time.time()
+                if sharded:
+                    # Shards resume from their own checkpoints; the merged output is committed as a whole
+                    rows_done, count = classify_sharded(
+                        csv_path, output_path, reader.fieldnames, processing_config['processes'], outfile
+                    )
+                    if checkpoint:
+                        checkpoint.commit(rows_done, outfile)
                 else:
-                    print("No description found")
-                    category = "No Description"
-                    
-                row[CATEGORY_COL] = category
-                writer.writerow(row)
-                count += 1
-                
-        print(f"\nClassification complete. Processed {count} tickets.")
-        print(f"Results written to: {OUTPUT_PATH}")
+                    rows = itertools.islice(reader, skip, max_tickets)
+                    count = asyncio.run(classify_csv_async(
+                        classify_rows(rows, skip), writer, outfile, processing_config, checkpoint, skip
+                    ))
+                elapsed = time.time() - start
+
+            for _ in range(processing_config['error_retries']):
+                fixed = requeue_errors(lambda rows: classify_rows(rows, retry=True), output_path)
+                if not fixed:
+                    break
+                print(f"Re-classified {fixed} tickets that had failed")
+            if checkpoint:
+                checkpoint.mark_complete()
+
+        record_output_classifier(output_path, classifier)
+        rate = count / elapsed if elapsed else 0.0
+        print(f"\nClassification complete. Processed {count} tickets in {elapsed:.1f}s ({rate:.1f} tickets/sec).")
+        print(f"Results written to: {output_path}")
+        if dedupe:
+            print(f"Near-duplicate clusters: {dedupe.stats()}")
+        # Sharded runs print a summary per worker process instead
+        if metrics and metrics.requests:
+            print(metrics.format_summary(count))
+        if metrics:
+            metrics.close()
+        if index is not None and embedding_config['agreement_sample']:
+            # Not through the cache: it must be the chat model's own answer
+            report_agreement(output_path, openai_config, processing_config, embedding_config['agreement_sample'])
+        if cache:
+            print(f"Cache stats: {cache.stats()}")
+            cache.close()
         
     except Exception as e:
         print(f"Unexpected error: {str(e)}")
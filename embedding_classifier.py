@@ -0,0 +1,106 @@
+import json
+import os
+
+import numpy as np
+
+DEFAULT_EMBEDDING_BATCH_SIZE = 256
+# Index rows compared at once in nearest mode, bounding the score matrix
+SCAN_ROWS = 65536
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class EmbeddingIndex:
+    """Labelled ticket embeddings used as a nearest-centroid classifier.
+
+    Exemplar vectors live in a memory-mapped .npy file next to a JSON file
+    holding their categories. In "centroid" mode each category is the mean
+    of its exemplars; in "nearest" mode a ticket takes the category of its
+    most similar exemplar. Either way a whole batch of tickets is scored
+    with one cosine-similarity matrix product.
+    """
+
+    def __init__(self, vectors, labels, model, mode='centroid'):
+        if mode not in ('centroid', 'nearest'):
+            raise ValueError(f"Unknown embedding mode: {mode}")
+        self.vectors = vectors
+        self.labels = labels
+        self.model = model
+        self.mode = mode
+        self.classes = sorted(set(labels))
+        class_index = {category: k for k, category in enumerate(self.classes)}
+        self._label_ids = np.fromiter((class_index[label] for label in labels), dtype=np.int32, count=len(labels))
+        if mode == 'centroid':
+            centroids = np.zeros((len(self.classes), vectors.shape[1]), dtype=np.float32)
+            np.add.at(centroids, self._label_ids, vectors)
+            self._centroids = _normalize(centroids)
+
+    def classify(self, embeddings):
+        """Return (category, cosine similarity) for each row of `embeddings`"""
+        queries = _normalize(np.asarray(embeddings, dtype=np.float32))
+        if self.mode == 'centroid':
+            scores = queries @ self._centroids.T
+            best = scores.argmax(axis=1)
+            best_scores = scores[np.arange(len(queries)), best]
+            return [(self.classes[k], float(score)) for k, score in zip(best, best_scores)]
+
+        best_rows = np.zeros(len(queries), dtype=np.int64)
+        best_scores = np.full(len(queries), -np.inf, dtype=np.float32)
+        for start in range(0, len(self.vectors), SCAN_ROWS):
+            scores = queries @ np.asarray(self.vectors[start:start + SCAN_ROWS]).T
+            rows = scores.argmax(axis=1)
+            row_scores = scores[np.arange(len(queries)), rows]
+            better = row_scores > best_scores
+            best_rows[better] = rows[better] + start
+            best_scores[better] = row_scores[better]
+        return [
+            (self.classes[self._label_ids[row]], float(score))
+            for row, score in zip(best_rows, best_scores)
+        ]
+
+    @staticmethod
+    def _labels_path(path):
+        return os.path.splitext(path)[0] + ".json"
+
+    @classmethod
+    def load(cls, path, mode='centroid'):
+        with open(cls._labels_path(path), encoding='utf-8') as f:
+            meta = json.load(f)
+        vectors = np.load(path, mmap_mode='r')
+        if len(vectors) != len(meta['labels']):
+            raise ValueError(f"{path} holds {len(vectors)} vectors for {len(meta['labels'])} labels")
+        return cls(vectors, meta['labels'], meta['model'], mode)
+
+
+class EmbeddingIndexWriter:
+    """Writes an EmbeddingIndex of `count` rows batch by batch into a memory-mapped .npy"""
+
+    def __init__(self, path, count, model):
+        self.path = path
+        self.count = count
+        self.model = model
+        self.labels = []
+        self._tmp_path = path + ".tmp.npy"
+        self._vectors = None
+
+    def add(self, embeddings, labels):
+        embeddings = _normalize(np.asarray(embeddings, dtype=np.float32))
+        if self._vectors is None:
+            self._vectors = np.lib.format.open_memmap(
+                self._tmp_path, mode='w+', dtype=np.float32, shape=(self.count, embeddings.shape[1])
+            )
+        self._vectors[len(self.labels):len(self.labels) + len(embeddings)] = embeddings
+        self.labels.extend(labels)
+
+    def close(self):
+        if self._vectors is None or len(self.labels) != self.count:
+            raise ValueError(f"expected {self.count} embeddings, got {len(self.labels)}")
+        self._vectors.flush()
+        self._vectors = None
+        os.replace(self._tmp_path, self.path)
+        with open(EmbeddingIndex._labels_path(self.path), 'w', encoding='utf-8') as f:
+            json.dump({'model': self.model, 'labels': self.labels}, f, ensure_ascii=False)
@@ -0,0 +1,68 @@
+import sqlite3
+import time
+
+# Categories that are retried on the next incremental run instead of kept
+RETRY_CATEGORIES = ("Error",)
+
+
+class IncrementalState:
+    """SQLite record of the tickets an incremental run has classified.
+
+    Each case number is stored with the updated timestamp it had when it was
+    classified (its watermark), the classifier that answered and the
+    category. A ticket is current, and is not sent again, while its
+    watermark and the classifier are unchanged. Timestamps are compared as
+    exported, so any date format works and a back-dated edit still counts as
+    a change.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tickets ("
+            " case_number TEXT PRIMARY KEY,"
+            " updated TEXT NOT NULL,"
+            " classifier TEXT NOT NULL,"
+            " category TEXT NOT NULL,"
+            " classified REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, case_number, updated, classifier):
+        """The category stored for this version of the ticket, or None if it has changed since"""
+        row = self._conn.execute(
+            "SELECT updated, classifier, category FROM tickets WHERE case_number = ?", (case_number,)
+        ).fetchone()
+        if row is None or row[0] != updated or row[1] != classifier:
+            return None
+        return row[2]
+
+    def is_current(self, case_number, updated, classifier):
+        """True if the ticket has an answer that doesn't need classifying again"""
+        return self.get(case_number, updated, classifier) not in (None,) + RETRY_CATEGORIES
+
+    def record(self, case_number, updated, classifier, category):
+        """Store a result; call commit() to make it durable"""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO tickets (case_number, updated, classifier, category, classified)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (case_number, updated, classifier, category, time.time())
+        )
+
+    def commit(self):
+        self._conn.commit()
+
+    def stats(self):
+        total, retry = self._conn.execute(
+            f"SELECT COUNT(*), COUNT(CASE WHEN category IN ({','.join('?' * len(RETRY_CATEGORIES))})"
+            " THEN 1 END) FROM tickets",
+            RETRY_CATEGORIES
+        ).fetchone()
+        return {'tickets': total, 'to_retry': retry}
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
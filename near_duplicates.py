@@ -0,0 +1,116 @@
+import hashlib
+import random
+import re
+
+DEFAULT_THRESHOLD = 0.7
+DEFAULT_NUM_PERM = 128
+
+# Mersenne prime used for the MinHash permutations
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Details that vary between otherwise identical tickets
+_EMAIL = re.compile(r"\S+@\S+")
+_URL = re.compile(r"https?://\S+|www\.\S+")
+_NUMBER = re.compile(r"\d+")
+_WORD = re.compile(r"[a-z#]+")
+
+
+def _shingles(description):
+    text = description.lower()
+    text = _EMAIL.sub(" email ", text)
+    text = _URL.sub(" url ", text)
+    text = _NUMBER.sub("#", text)
+    words = _WORD.findall(text)
+    if len(words) < 2:
+        return set(words) or {text.strip()}
+    return {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+def _choose_bands(num_perm, threshold):
+    """Pick the band layout whose LSH threshold (1/b)^(1/r) is closest to `threshold`"""
+    layouts = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    return min(layouts, key=lambda layout: abs((1.0 / layout[0]) ** (1.0 / layout[1]) - threshold))
+
+
+class NearDuplicateIndex:
+    """MinHash LSH index that groups near-duplicate ticket descriptions.
+
+    Descriptions are reduced to word bigrams after masking emails, URLs and
+    numbers, so tickets that differ only in names, dates or reference numbers
+    land in the same cluster. Candidates from the LSH bands are confirmed by
+    their estimated Jaccard similarity before being treated as duplicates.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, num_perm=DEFAULT_NUM_PERM, seed=1):
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("threshold must be between 0 and 1")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = _choose_bands(num_perm, threshold)
+        rng = random.Random(seed)
+        self._permutations = [
+            (rng.randint(1, _PRIME - 1), rng.randint(0, _PRIME - 1)) for _ in range(num_perm)
+        ]
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = []
+        self.duplicates = 0
+
+    @property
+    def clusters(self):
+        return len(self._signatures)
+
+    def signature(self, description):
+        hashes = [
+            int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+            for shingle in _shingles(description)
+        ]
+        return tuple(
+            min(((a * h + b) % _PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._permutations
+        )
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def similarity(self, first, second):
+        return sum(1 for x, y in zip(first, second) if x == y) / self.num_perm
+
+    def find(self, signature):
+        """Return the id of a matching cluster, or None"""
+        best_id, best_score = None, self.threshold
+        seen = set()
+        for band, key in self._band_keys(signature):
+            for cluster_id in self._buckets[band].get(key, ()):
+                if cluster_id in seen:
+                    continue
+                seen.add(cluster_id)
+                score = self.similarity(signature, self._signatures[cluster_id])
+                if score >= best_score:
+                    best_id, best_score = cluster_id, score
+        return best_id
+
+    def add(self, signature):
+        """Register a new cluster with `signature` as its representative"""
+        cluster_id = len(self._signatures)
+        self._signatures.append(signature)
+        for band, key in self._band_keys(signature):
+            self._buckets[band].setdefault(key, []).append(cluster_id)
+        return cluster_id
+
+    def assign(self, description):
+        """Return (cluster_id, is_new) for a description"""
+        signature = self.signature(description)
+        cluster_id = self.find(signature)
+        if cluster_id is not None:
+            self.duplicates += 1
+            return cluster_id, False
+        return self.add(signature), True
+
+    def stats(self):
+        return {
+            'clusters': self.clusters,
+            'api_calls_saved': self.duplicates,
+            'threshold': self.threshold,
+        }
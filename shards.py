@@ -0,0 +1,68 @@
+import csv
+
+# Bytes read at a time while scanning for record boundaries
+SCAN_BYTES = 1 << 20
+
+
+def shard_offsets(path, shards):
+    """Byte offsets splitting the data rows of a CSV file into up to `shards` ranges.
+
+    Returns [header_end, ..., file_size]; consecutive offsets bound one shard
+    and every offset falls on a record boundary. A newline only ends a record
+    when an even number of quote characters come before it, so newlines
+    inside quoted fields never split a row ("" escapes keep the count even).
+    Neither byte occurs inside a multi-byte UTF-8 character, so the scan
+    works on raw bytes.
+    """
+    with open(path, 'rb') as f:
+        size = f.seek(0, 2)
+        f.seek(0)
+        # The first target finds the end of the header row
+        targets = iter([size * k // shards for k in range(shards)])
+        target = next(targets)
+        offsets = []
+        pos, odd = 0, 0
+        while target is not None:
+            buf = f.read(SCAN_BYTES)
+            if not buf:
+                break
+            i = 0
+            while target is not None and target < pos + len(buf):
+                start = max(target - pos, i)
+                odd ^= buf.count(b'"', i, start) & 1
+                i = start
+                end = buf.find(b'\n', i)
+                if end == -1:
+                    break
+                odd ^= buf.count(b'"', i, end) & 1
+                i = end + 1
+                if odd:
+                    continue
+                boundary = pos + i
+                if not offsets or boundary > offsets[-1]:
+                    offsets.append(boundary)
+                target = next(targets, None)
+            odd ^= buf.count(b'"', i) & 1
+            pos += len(buf)
+
+    # A header without a trailing newline leaves no data rows at all
+    offsets = offsets or [size]
+    if offsets[-1] < size:
+        offsets.append(size)
+    return offsets
+
+
+def _iter_lines(f, end):
+    pos = f.tell()
+    for line in f:
+        if pos >= end:
+            return
+        pos += len(line)
+        yield line.decode('utf-8')
+
+
+def iter_shard_rows(path, start, end, fieldnames):
+    """Yield the rows stored in bytes [start, end) of a CSV file as dicts keyed by `fieldnames`"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        yield from csv.DictReader(_iter_lines(f, end), fieldnames=fieldnames)
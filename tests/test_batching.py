@@ -0,0 +1,45 @@
+import json
+from types import SimpleNamespace
+
+from shared_code.batching import classify_in_batch, classify_rows_in_batches
+
+
+class FakePool:
+    """Answers a batched request for the first ticket only"""
+
+    def __init__(self):
+        self.requests = 0
+
+    def call(self, request, estimated_tokens):
+        self.requests += 1
+        content = json.dumps({"1": "NHSUK Profiles"})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def test_missing_answers_are_retried_one_at_a_time():
+    pool = FakePool()
+    retried = []
+
+    def classify_one(description):
+        retried.append(description)
+        return "NHSUK Spam/Marketing"
+
+    categories = classify_in_batch(["update my profile", "buy backlinks"], "gpt-4o-mini", pool, classify_one)
+
+    assert pool.requests == 1
+    assert categories == ["NHSUK Profiles", "NHSUK Spam/Marketing"]
+    assert retried == ["buy backlinks"]
+
+
+def test_rows_without_a_description_are_not_sent():
+    sent = []
+
+    def classify_many(descriptions):
+        sent.append(descriptions)
+        return ["NHSUK Profiles"] * len(descriptions)
+
+    rows = [{'Description': "update my profile"}, {'Description': None}, {'Description': "change my address"}]
+    classified = list(classify_rows_in_batches(rows, lambda description: "NHSUK Profiles", classify_many, 5))
+
+    assert sent == [["update my profile", "change my address"]]
+    assert [row['Category'] for row in classified] == ["NHSUK Profiles", "No Description", "NHSUK Profiles"]
@@ -0,0 +1,45 @@
+import asyncio
+from types import SimpleNamespace
+
+import classify_tickets
+from shared_code.rate_limiter import RateLimiter
+from shared_code.preprocess import count_tokens
+
+
+class FakeEmbeddingsClient:
+    """Stands in for AsyncAzureOpenAI; rejects any input over the model's limit like the service does"""
+
+    def __init__(self, max_tokens, model):
+        self.max_tokens = max_tokens
+        self.model = model
+        self.inputs = []
+        self.embeddings = SimpleNamespace(with_raw_response=SimpleNamespace(create=self.create))
+
+    async def create(self, model, input):
+        for text in input:
+            if count_tokens(text, self.model) > self.max_tokens:
+                raise ValueError(f"input is longer than {self.max_tokens} tokens")
+        self.inputs.extend(input)
+        data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+        # Out of order, as the service may return them
+        response = SimpleNamespace(data=data[::-1])
+        return SimpleNamespace(parse=lambda: response, headers={})
+
+
+def test_input_over_the_limit_is_cut():
+    embedding_config = {'model': 'text-embedding-3-small', 'max_input_tokens': 100}
+    client = FakeEmbeddingsClient(100, embedding_config['model'])
+    limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=1000000, max_retries=0)
+    long_description = "password reset failed for the user account " * 200
+    descriptions = ["printer offline", long_description, "vpn drops"]
+
+    embeddings = asyncio.run(
+        classify_tickets.embed_descriptions_async(descriptions, embedding_config, client, limiter)
+    )
+
+    assert len(embeddings) == 3
+    assert client.inputs[0] == "printer offline"
+    assert client.inputs[2] == "vpn drops"
+    assert client.inputs[1].endswith(" ...")
+    assert long_description.startswith(client.inputs[1][:-len(" ...")])
+    assert embeddings[1] == [float(len(client.inputs[1]))]
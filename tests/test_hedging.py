@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import pytest
+
+from shared_code.deployment_pool import Deployment, DeploymentPool
+from shared_code.hedging import DeadlineExceeded, HedgedCaller
+
+
+class RecordingMetrics:
+    def __init__(self):
+        self.calls = []
+
+    def record_hedged_call(self, seconds, hedged, hedge_won, timed_out=False):
+        self.calls.append({'hedged': hedged, 'hedge_won': hedge_won, 'timed_out': timed_out})
+
+
+def _deployment(name):
+    return Deployment(f"https://{name}.example.com/", "key", "2024-02-01", "gpt-4o-mini", name=name,
+                      requests_per_minute=600, tokens_per_minute=1000000)
+
+
+def test_hedge_to_the_other_deployment_wins():
+    slow, fast = _deployment("slow"), _deployment("fast")
+    pool = DeploymentPool([slow, fast])
+    metrics = RecordingMetrics()
+    caller = HedgedCaller(pool, initial_delay=0.05, deadline=5, metrics=metrics)
+    # The first attempt goes to the slow deployment
+    pool._choose = lambda tokens, tried: (fast if slow in tried else slow, 0)
+    used = []
+
+    async def request(deployment):
+        used.append(deployment.name)
+        await asyncio.sleep(2 if deployment is slow else 0.01)
+        return deployment.name, {}
+
+    started = time.monotonic()
+    assert caller.call(request, 10) == "fast"
+    assert time.monotonic() - started < 1
+    assert used == ["slow", "fast"]
+    assert metrics.calls == [{'hedged': True, 'hedge_won': True, 'timed_out': False}]
+    # The cancelled first attempt is timed too, up to its cancellation
+    assert len(caller._latencies) == 2 and max(caller._latencies) >= 0.05
+
+
+def test_deadline_while_the_first_attempt_is_queued():
+    only = _deployment("only")
+    pool = DeploymentPool([only])
+    metrics = RecordingMetrics()
+    caller = HedgedCaller(pool, initial_delay=0.05, deadline=0.3, metrics=metrics)
+    # The rate limiter holds every attempt back for longer than the deadline
+    pool._choose = lambda tokens, tried: (only, 5)
+    used = []
+
+    async def request(deployment):
+        used.append(deployment.name)
+        return deployment.name, {}
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        caller.call(request, 10)
+    assert time.monotonic() - started < 1
+    assert used == []
+    assert metrics.calls == [{'hedged': True, 'hedge_won': False, 'timed_out': True}]
+    # Both queued attempts count as slow, so the hedge delay doesn't shrink
+    assert len(caller._latencies) == 2 and min(caller._latencies) >= 0.2
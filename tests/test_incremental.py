@@ -0,0 +1,37 @@
+import csv
+
+import classify_tickets
+
+
+def test_rows_with_missing_key_or_timestamp(tmp_path):
+    export = tmp_path / "export.csv"
+    export.write_text(
+        "Number,Updated,Description\n"
+        "CS1,2025-01-01,forgot my password\n"
+        "CS2\n"
+        ",2025-01-02,printer jammed\n"
+        "CS3,,vpn drops\n"
+    )
+    output = tmp_path / "output.csv"
+    incremental_config = {'key_column': "Number", 'updated_column': "Updated",
+                          'state_path': str(tmp_path / "state.sqlite")}
+    processing_config = {'max_tickets': 0, 'error_retries': 0, 'checkpoint_interval': 100}
+    sent = []
+
+    async def classify_rows(rows, retry=False):
+        for row in rows:
+            sent.append(row['Number'])
+            yield row, "Password Reset" if row.get('Description') else "No Description"
+
+    for _ in range(2):
+        classify_tickets.classify_incremental(
+            str(export), str(output), classify_rows, processing_config, incremental_config, "test"
+        )
+
+    # Only the row without a case number is sent again
+    assert sent == ["CS1", "CS2", "", "CS3", ""]
+    with open(output, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [(row['Number'], row['Category']) for row in rows] == [
+        ("CS1", "Password Reset"), ("CS2", "No Description"), ("", "Password Reset"), ("CS3", "Password Reset"),
+    ]
@@ -0,0 +1,44 @@
+import pytest
+
+from shared_code.jobs import InMemoryJobStorage, drain_queue, iter_job_result, job_status, submit_job
+
+
+def _classify_rows(rows, batch_size):
+    for row in rows:
+        row['Category'] = "Password Reset"
+        yield row
+
+
+def test_job_record_exists_while_chunks_are_queued():
+    storage = InMemoryJobStorage()
+    seen = []
+
+    def rows():
+        for i in range(5):
+            seen.append(job_status(storage, storage.names("")[0].split("/")[0]))
+            yield {'Number': str(i), 'Description': "forgot password"}
+
+    job = submit_job(storage, rows(), ['Number', 'Description'], chunk_rows=2)
+
+    assert [status['status'] for status in seen] == ["submitting"] * 5
+    assert job['chunks'] == 3
+    assert job_status(storage, job['job_id'])['status'] == "queued"
+    drain_queue(storage, _classify_rows)
+    assert job_status(storage, job['job_id'])['status'] == "completed"
+    assert "".join(iter_job_result(storage, job)).count("Password Reset") == 5
+
+
+def test_failed_submission_is_recorded():
+    storage = InMemoryJobStorage()
+
+    def rows():
+        yield {'Number': "1", 'Description': "forgot password"}
+        raise ValueError("upload cut off")
+
+    with pytest.raises(ValueError):
+        submit_job(storage, rows(), ['Number', 'Description'], chunk_rows=1)
+
+    job_id = storage.names("")[0].split("/")[0]
+    status = job_status(storage, job_id)
+    assert status['status'] == "failed"
+    assert "upload cut off" in status['error']
@@ -0,0 +1,23 @@
+import csv
+import gzip
+import io
+
+from shared_code.local_classifier import match_rule, read_training_examples
+
+
+def test_training_examples_from_gzipped_csv(tmp_path):
+    text = io.StringIO()
+    writer = csv.DictWriter(text, fieldnames=["Description", "Category"])
+    writer.writeheader()
+    writer.writerow({"Description": "forgot my password", "Category": "Password Reset"})
+    writer.writerow({"Description": "printer jammed", "Category": "Error"})
+    path = tmp_path / "out.csv.gz"
+    path.write_bytes(gzip.compress(text.getvalue().encode("utf-8")))
+
+    assert list(read_training_examples([str(path)])) == [("forgot my password", "Password Reset")]
+
+
+def test_spam_rule_leaves_ambiguous_words_to_the_model():
+    assert match_rule("We offer SEO services and backlinks for your site") == "NHSUK Spam/Marketing"
+    assert match_rule("How do I unsubscribe from the NHS App appointment emails?") is None
+    assert match_rule("I was sent a crypto scam text pretending to be the NHS") is None
@@ -0,0 +1,24 @@
+from shared_code.preprocess import DescriptionPreprocessor
+
+
+class RecordingMetrics:
+    def __init__(self):
+        self.recorded = []
+
+    def record_preprocessing(self, tokens_before, tokens_after):
+        self.recorded.append((tokens_before, tokens_after))
+
+
+def test_long_description_is_counted_without_tokenizing_all_of_it():
+    metrics = RecordingMetrics()
+    preprocessor = DescriptionPreprocessor(max_tokens=50, metrics=metrics)
+    counted = []
+    preprocessor.count_tokens = lambda text: counted.append(len(text)) or len(text) // 4
+
+    description = "disk full on the reporting server " * 10000
+    text = preprocessor(description)
+
+    assert text.endswith(" ...")
+    assert max(counted) <= 50 * 8
+    (before, after), = metrics.recorded
+    assert before > 50000 and after <= 50
@@ -0,0 +1,14 @@
+import logging
+
+from shared_code.prompts import PROMPT_CACHE_MIN_TOKENS, set_prompt_layouts
+
+
+def test_short_prefix_with_examples_is_reported(caplog):
+    with caplog.at_level(logging.WARNING):
+        set_prompt_layouts([("forgot my password", "NHSUK Profiles")])
+        assert f"below the {PROMPT_CACHE_MIN_TOKENS}" in caplog.text
+
+        caplog.clear()
+        set_prompt_layouts([("forgot my password", "NHSUK Profiles")], pad=True)
+        assert "below the" not in caplog.text
+    set_prompt_layouts()
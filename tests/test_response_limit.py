@@ -0,0 +1,54 @@
+import gzip
+import os
+
+import azure.functions as func
+import pytest
+
+# The app reads its settings when it is imported; no request in these tests reaches the endpoint
+os.environ.update({
+    'OPENAI_ENDPOINT': 'http://127.0.0.1:1/',
+    'OPENAI_API_KEY': 'test',
+    'OPENAI_API_VERSION': '2024-02-01',
+    'OPENAI_MODEL': 'gpt-4o-mini',
+    'CLASSIFICATION_CACHE_ENABLED': 'false',
+    'CLASSIFY_METRICS_EXPORT': 'false',
+})
+
+import azure_function_app  # noqa: E402
+from shared_code.streaming import ResponseTooLarge, buffer_rows, join_limited  # noqa: E402
+
+
+def _handler(name):
+    return next(f.get_user_function() for f in azure_function_app.app.get_functions()
+                if f.get_function_name() == name)
+
+
+def test_compressed_export_that_expands_past_the_limit_is_refused(monkeypatch):
+    monkeypatch.setenv('CLASSIFY_MAX_RESPONSE_BYTES', '10000')
+    csv_text = "Number,Description\n" + "".join(f"T{i},{'printer jammed ' * 10}\n" for i in range(1000))
+    body = gzip.compress(csv_text.encode('utf-8'))
+    assert len(body) < 10000 < len(csv_text)
+
+    classified = []
+    monkeypatch.setattr(azure_function_app, 'classify_ticket', lambda description: classified.append(description))
+    response = _handler('classify_tickets')(func.HttpRequest(
+        'POST', '/api/classify_tickets', body=body, headers={'Content-Encoding': 'gzip'}
+    ))
+
+    assert response.status_code == 413
+    assert b"CLASSIFY_MAX_RESPONSE_BYTES" in response.get_body()
+    assert classified == []
+
+
+def test_rows_under_the_limit_are_kept_in_order():
+    rows = [{'Number': str(i), 'Description': "vpn drops"} for i in range(5)]
+    assert buffer_rows(iter(rows), 1000) == rows
+    with pytest.raises(ResponseTooLarge):
+        buffer_rows(iter(rows), 30)
+
+
+def test_join_limited():
+    assert join_limited(["a,b\n", "1,2\n"], 8) == "a,b\n1,2\n"
+    assert join_limited(["a,b\n", "1,2\n"], 0) == "a,b\n1,2\n"
+    with pytest.raises(ResponseTooLarge):
+        join_limited(["a,b\n", "1,2\n"], 7)
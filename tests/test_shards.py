@@ -0,0 +1,56 @@
+import csv
+
+import pytest
+
+import shards
+
+
+def _write_export(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=["Number", "Description"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _read_shards(path, count):
+    offsets = shards.shard_offsets(path, count)
+    return offsets, [
+        row for start, end in zip(offsets, offsets[1:])
+        for row in shards.iter_shard_rows(path, start, end, ["Number", "Description"])
+    ]
+
+
+def test_quoted_newline_straddling_a_shard_boundary(tmp_path):
+    path = tmp_path / "export.csv"
+    # The middle of the file, where the second shard starts, falls inside the quoted field
+    rows = [
+        {'Number': "CS1", 'Description': "short"},
+        {'Number': "CS2", 'Description': "line one\n" * 20 + 'said "hello"\n' + "line two\n" * 20},
+        {'Number': "CS3", 'Description': "also short"},
+    ]
+    _write_export(path, rows)
+    size = path.stat().st_size
+    middle = path.read_bytes().index(b"line one", size // 2 - 10)
+    assert middle < size // 2 + 10
+
+    offsets, read = _read_shards(str(path), 2)
+
+    assert read == rows
+    data = path.read_bytes()
+    assert all(data[offset - 1:offset] == b"\n" for offset in offsets[:-1])
+
+
+@pytest.mark.parametrize("scan_bytes", [3, 16, 1 << 20])
+@pytest.mark.parametrize("count", [1, 2, 3, 5, 8])
+def test_every_row_is_read_once(tmp_path, monkeypatch, scan_bytes, count):
+    monkeypatch.setattr(shards, 'SCAN_BYTES', scan_bytes)
+    path = tmp_path / "export.csv"
+    rows = [
+        {'Number': f"CS{i}", 'Description': f'ticket {i}\n"quoted"\nlast line' if i % 3 == 0 else f"ticket {i}"}
+        for i in range(40)
+    ]
+    _write_export(path, rows)
+
+    _, read = _read_shards(str(path), count)
+
+    assert read == rows
@@ -0,0 +1,64 @@
+"""Train the local fast-path classifier from earlier "- Categorized.csv" output.
+
+Reads the [local_classifier] section of config.ini, checks the model on a
+held-out fifth of the tickets, then trains on all of them and saves it to
+model_path. Enable it for classify_tickets.py with `enabled = true`.
+
+    python train_local_classifier.py
+"""
+import os
+import random
+
+from classify_tickets import (
+    CATEGORY_COL,
+    CONFIG_PATH,
+    DESCRIPTION_COL,
+    load_local_classifier_config,
+)
+from shared_code.local_classifier import LocalClassifier, match_rule, read_training_examples
+
+
+def evaluate(model, examples):
+    """Share of tickets answered locally and how often those answers were right"""
+    answered = correct = 0
+    for description, category in examples:
+        prediction = model.classify(description)
+        if prediction is not None:
+            answered += 1
+            correct += prediction == category
+    coverage = answered / len(examples) if examples else 0.0
+    precision = correct / answered if answered else 0.0
+    return coverage, precision
+
+
+def main():
+    local_config = load_local_classifier_config(CONFIG_PATH)
+    missing = [path for path in local_config['training_files'] if not os.path.exists(path)]
+    if missing:
+        print(f"Error: training files not found: {missing}")
+        return
+    examples = list(read_training_examples(local_config['training_files'], DESCRIPTION_COL, CATEGORY_COL))
+    print(f"Read {len(examples)} classified tickets from {len(local_config['training_files'])} file(s)")
+
+    rule_examples = [(d, c) for d, c in examples if match_rule(d)]
+    if rule_examples:
+        rule_correct = sum(match_rule(d) == c for d, c in rule_examples)
+        print(f"Rules match {len(rule_examples)} tickets, agreeing with the recorded category "
+              f"for {rule_correct / len(rule_examples):.1%}")
+
+    shuffled = examples[:]
+    random.Random(1).shuffle(shuffled)
+    split = len(shuffled) * 4 // 5
+    if 0 < split < len(shuffled):
+        held_out_model = LocalClassifier.train(shuffled[:split], threshold=local_config['threshold'])
+        coverage, precision = evaluate(held_out_model, shuffled[split:])
+        print(f"Held-out check at threshold {local_config['threshold']}: "
+              f"{coverage:.1%} answered locally, {precision:.1%} of those correct")
+
+    model = LocalClassifier.train(examples, threshold=local_config['threshold'])
+    model.save(local_config['model_path'])
+    print(f"Saved model for {len(model.classes)} categories to {local_config['model_path']}")
+
+
+if __name__ == "__main__":
+    main()